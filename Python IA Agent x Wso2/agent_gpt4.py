@@ -1,21 +1,155 @@
+import time
+_MODULE_START = time.perf_counter()  # Referencia para el informe de tiempos de arranque
 import os
 import requests
+import aiohttp
+from aiohttp import web
 import asyncio
+import inspect
 import json
 import base64
 import argparse
 import threading
-import time
 import sys
+import re
+import difflib
+import heapq
+import sqlite3
+import hashlib
+import hmac
+import uuid
+import math
+import bisect
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, Counter, deque
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, parse_qs, quote
 from dotenv import load_dotenv
-import semantic_kernel as sk  # <<< SEMANTIC KERNEL
-from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion  # <<< SEMANTIC KERNEL
-from semantic_kernel.functions import kernel_function  # <<< SEMANTIC KERNEL
-from semantic_kernel.contents.chat_history import ChatHistory  # <<< SEMANTIC KERNEL
+
+from intent_router import route as route_intent, is_open_question  # Router de intenciones precompilado
 
 # Variable global para modo debug
 DEBUG_MODE = False
 
+# ============================================
+# CARGA DIFERIDA DE SEMANTIC KERNEL
+# ============================================
+
+# Importar Semantic Kernel cuesta varios segundos: se difiere hasta que hace falta el LLM
+_KERNEL_FUNCTIONS = []  # (función, nombre, descripción) marcadas antes de importar Semantic Kernel
+_semantic_kernel = None
+_semantic_kernel_lock = threading.Lock()
+
+def kernel_function(name: str = None, description: str = None):
+    """Marca una función del plugin; el decorador real de Semantic Kernel se aplica al cargarlo"""
+    def decorator(func):
+        _KERNEL_FUNCTIONS.append((func, name, description))
+        return func
+    return decorator
+
+def load_semantic_kernel():
+    """Importa Semantic Kernel la primera vez que se necesita y registra las funciones marcadas"""
+    global _semantic_kernel
+    with _semantic_kernel_lock:
+        if _semantic_kernel is None:
+            import semantic_kernel  # <<< SEMANTIC KERNEL
+            from semantic_kernel.functions import kernel_function as sk_kernel_function  # <<< SEMANTIC KERNEL
+            for func, name, description in _KERNEL_FUNCTIONS:
+                sk_kernel_function(name=name, description=description)(func)  # <<< SEMANTIC KERNEL
+            _semantic_kernel = semantic_kernel
+    return _semantic_kernel
+
+class LazyKernel:
+    """
+    Kernel de Semantic Kernel construido en segundo plano la primera vez que se pide.
+
+    La construcción (import + servicios + plugin) se hace una sola vez en un hilo daemon, así
+    no bloquea ni la entrada del usuario ni la salida del programa. Expone las mismas llamadas
+    que usa el agente (invoke_prompt / invoke_prompt_stream).
+    """
+
+    def __init__(self, factory):
+        self._factory = factory   # Función síncrona que devuelve el Kernel ya configurado
+        self._future = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._future is None:
+                self._future = concurrent.futures.Future()
+                threading.Thread(target=self._build, daemon=True).start()
+        return self._future
+
+    def _build(self):
+        try:
+            self._future.set_result(self._factory())
+        except BaseException as e:
+            self._future.set_exception(e)
+
+    async def get(self):
+        return await asyncio.wrap_future(self.start())
+
+    async def invoke_prompt(self, *args, **kwargs):
+        return await (await self.get()).invoke_prompt(*args, **kwargs)  # <<< SEMANTIC KERNEL
+
+    async def invoke_prompt_stream(self, *args, **kwargs):
+        kernel = await self.get()
+        async for message in kernel.invoke_prompt_stream(*args, **kwargs):  # <<< SEMANTIC KERNEL
+            yield message
+
+    async def generate_embeddings(self, texts: list):
+        """Embeddings del servicio 'embeddings' (caché de respuestas en modo similitud)"""
+        return await (await self.get()).get_service("embeddings").generate_embeddings(texts)  # <<< SEMANTIC KERNEL
+
+def check_llm_connection(kernel: LazyKernel, model_id: str) -> bool:
+    """Verifica la clave de OpenAI y el modelo sin generar tokens (consulta de metadatos del modelo)"""
+    started = time.perf_counter()
+    try:
+        kernel.start().result()
+        import openai
+        openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY")).models.retrieve(model_id)
+    except Exception as e:
+        print(f"\n{Colors.red('ERROR')} Error de conexión con OpenAI: {e}")
+        return False
+    if DEBUG_MODE:
+        print(f"\n{Colors.green('OK')} Conexión con OpenAI verificada ({time.perf_counter() - started:.2f}s)")
+    return True
+
+def build_kernel(shopify_plugin, model_id: str):
+    """Importa Semantic Kernel y configura servicios y plugin (para LazyKernel: en segundo plano, una sola vez)"""
+    sk = load_semantic_kernel()  # <<< SEMANTIC KERNEL
+    from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion, OpenAITextEmbedding  # <<< SEMANTIC KERNEL
+    kernel = sk.Kernel()  # <<< SEMANTIC KERNEL
+    kernel.add_service(OpenAIChatCompletion(service_id="openai", api_key=os.getenv("OPENAI_API_KEY"), ai_model_id=model_id))  # <<< SEMANTIC KERNEL
+    if RESPONSE_CACHE_SIMILARITY > 0:
+        kernel.add_service(OpenAITextEmbedding(service_id="embeddings", api_key=os.getenv("OPENAI_API_KEY"),
+                                               ai_model_id=os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")))  # <<< SEMANTIC KERNEL
+    kernel.add_plugin(shopify_plugin, plugin_name="Shopify")  # <<< SEMANTIC KERNEL
+    if DEBUG_MODE:
+        print(f"\n✓ Modelo configurado: {model_id}")
+        print("✓ Plugin de Shopify registrado")
+    return kernel
+
+class StartupTimer:
+    """Mide las fases del arranque desde que se carga el módulo"""
+
+    def __init__(self, origin: float = _MODULE_START):
+        self.origin = origin
+        self.last = origin
+        self.phases = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        detail = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        return f"Arranque: {self.last - self.origin:.2f}s ({detail})"
+
 # ============================================
 # INDICADOR DE PROGRESO
 # ============================================
@@ -23,6 +157,8 @@ DEBUG_MODE = False
 class ThinkingIndicator:
     """Clase para mostrar un indicador de 'pensando...' animado"""
     
+    enabled = True  # Desactivado en modo batch (sin terminal interactivo)
+    
     def __init__(self, message="Pensando"):
         self.message = message
         self.running = False
@@ -30,7 +166,7 @@ class ThinkingIndicator:
     
     def start(self):
         """Inicia el indicador animado"""
-        if not DEBUG_MODE and not self.running:
+        if self.enabled and not DEBUG_MODE and not self.running:
             self.running = True
             self.thread = threading.Thread(target=self._animate)
             self.thread.daemon = True
@@ -143,53 +279,687 @@ DIRECT_MODE = False
 # Cargar variables de entorno
 load_dotenv()
 
-print("=" * 60)
-print("ECOMMERCE AI AGENT v1.3 (SHOPIFY + WSO2)")
-print("=" * 60)
+# ============================================
+# INSTRUMENTACIÓN POR ETAPAS
+# ============================================
+
+PROFILE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Límites (s) de los histogramas
+PROFILE_MAX_SAMPLES = int(os.getenv("PROFILE_MAX_SAMPLES", "10000"))  # Últimas muestras por etapa para p50/p95
+
+class _NullSpan:
+    """Span vacío: con la instrumentación desactivada no se mide nada"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("profiler", "stage", "started")
+
+    def __init__(self, profiler, stage: str):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+class StageHistogram:
+    """Latencias de una etapa: buckets acumulados (para exportar) y las últimas muestras (para percentiles)"""
+
+    def __init__(self, max_samples: int):
+        self.buckets = [0] * (len(PROFILE_BUCKETS) + 1)  # El último es +Inf
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(PROFILE_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class StageProfiler:
+    """
+    Registro de latencias por etapa de cada consulta: intención, token de WSO2, llamadas HTTP a
+    Shopify (a través del Gateway), funciones del plugin, construcción del prompt y LLM.
+
+    Desactivado por defecto: span() devuelve un contexto vacío. Con --profile cada etapa alimenta
+    su histograma; summary() da p50/p95 y export() lo vuelca en JSON u OpenMetrics. Los indicadores
+    (gauges) registrados se leen en el momento de exportar.
+    """
+
+    def __init__(self, max_samples: int = PROFILE_MAX_SAMPLES):
+        self.enabled = False
+        self.max_samples = max_samples
+        self.histograms = {}  # etapa -> StageHistogram (en orden de primera aparición)
+        self.gauges = {}      # nombre -> (ayuda, etiqueta, función que devuelve {valor de la etiqueta: número})
+        self._lock = threading.Lock()
+
+    def register_gauge(self, name: str, help_text: str, callback, label: str = "shop"):
+        """Registra un indicador instantáneo (p.ej. profundidad de cola) que se exporta como 'agent_<name>'"""
+        self.gauges[name] = (help_text, label, callback)
+
+    def span(self, stage: str):
+        return _Span(self, stage) if self.enabled else _NULL_SPAN
+
+    def observe(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = StageHistogram(self.max_samples)
+            histogram.observe(seconds)
+
+    def summary(self) -> str:
+        if not self.histograms:
+            return "Perfil: sin mediciones"
+        width = max(len(stage) for stage in self.histograms)
+        lines = ["Perfil por etapa (ms):"]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                lines.append(f"  {stage.ljust(width)}  n={histogram.count:<5} p50 {histogram.percentile(0.5) * 1000:8.1f}  "
+                             f"p95 {histogram.percentile(0.95) * 1000:8.1f}  máx {max(histogram.samples) * 1000:8.1f}")
+        for name, (_help_text, label, callback) in self.gauges.items():
+            values = ", ".join(f"{key}={value}" for key, value in callback().items())
+            lines.append(f"  {name}: {values or '-'}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {stage: {"count": histogram.count, "sum_seconds": round(histogram.total, 6),
+                            "p50_ms": round(histogram.percentile(0.5) * 1000, 3),
+                            "p95_ms": round(histogram.percentile(0.95) * 1000, 3),
+                            "max_ms": round(max(histogram.samples) * 1000, 3)}
+                    for stage, histogram in self.histograms.items()}
+
+    def to_openmetrics(self) -> str:
+        """Histograma 'agent_stage_seconds' con la etiqueta 'stage', en formato de texto OpenMetrics"""
+        lines = ["# TYPE agent_stage_seconds histogram", "# UNIT agent_stage_seconds seconds",
+                 "# HELP agent_stage_seconds Latencia de cada etapa del agente."]
+        bounds = [str(bound) for bound in PROFILE_BUCKETS] + ["+Inf"]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(bounds, histogram.buckets):
+                    cumulative += count
+                    lines.append(f'agent_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'agent_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+                lines.append(f'agent_stage_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+        for name, (help_text, label, callback) in self.gauges.items():
+            lines += [f"# TYPE agent_{name} gauge", f"# HELP agent_{name} {help_text}"]
+            lines += [f'agent_{name}{{{label}="{key}"}} {value}' for key, value in callback().items()]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """Escribe el perfil en `path`: JSON si termina en .json, OpenMetrics en otro caso"""
+        with open(path, 'w', encoding='utf-8') as out:
+            if path.endswith('.json'):
+                json.dump(self.to_dict(), out, ensure_ascii=False, indent=2)
+            else:
+                out.write(self.to_openmetrics())
+
+PROFILER = StageProfiler()  # Registro global (se activa con --profile)
 
 # ============================================
-# SISTEMA DE MEMORIA DE PRECIOS
+# HISTORIAL DE PRECIOS (SQLITE)
 # ============================================
 
-class PriceMemory:
-    """Clase para recordar cambios de precio anteriores"""
-    def __init__(self):
-        self.price_history = {}  # {product_id: {previous: precio_anterior, current: precio_actual}}
-    
-    def remember_price_change(self, product_id: str, old_price: str, new_price: str):
-        """Guarda un cambio de precio"""
-        self.price_history[product_id] = {
-            'previous': old_price,
-            'current': new_price
-        }
+PRICE_HISTORY_RETENTION_DAYS = float(os.getenv("PRICE_HISTORY_RETENTION_DAYS", "365"))  # 0 = sin límite
+
+class PriceHistory:
+    """
+    Registro de cambios de precio en SQLite (WAL), solo de añadir e indexado por producto y fecha.
+
+    Cada cambio es una fila; deshacer añade otra fila que apunta al cambio deshecho (`reverts`), así
+    se pueden deshacer varios pasos seguidos y el registro conserva todo lo ocurrido. Los cambios de
+    una actualización masiva comparten `batch_id` para revertir el lote completo. Mantiene la API de
+    la antigua memoria de precios (remember_price_change / get_previous_price / has_history).
+    """
+
+    def __init__(self, path: str = None, retention_days: float = PRICE_HISTORY_RETENTION_DAYS):
+        self.path = path or os.getenv("PRICE_HISTORY_PATH", "price_history.sqlite")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS price_changes (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           "product_id TEXT NOT NULL, title TEXT, variant_id TEXT, old_price TEXT NOT NULL, "
+                           "new_price TEXT NOT NULL, changed_at REAL NOT NULL, batch_id TEXT, reverts INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS price_changes_product ON price_changes (product_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS price_changes_time ON price_changes (changed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS price_changes_batch ON price_changes (batch_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS price_changes_reverts ON price_changes (reverts)")
+        if retention_days > 0:
+            self._conn.execute("DELETE FROM price_changes WHERE changed_at < ?", (time.time() - retention_days * 86400,))
+        self._conn.commit()
+
+    # Cambios vigentes: no son deshaceres y nadie los ha deshecho
+    _ACTIVE = ("reverts IS NULL AND NOT EXISTS "
+               "(SELECT 1 FROM price_changes AS undo WHERE undo.reverts = price_changes.id)")
+
+    def remember_price_change(self, product_id: str, old_price: str, new_price: str, batch_id: str = None,
+                              title: str = None, variant_id=None) -> int:
+        """Guarda un cambio de precio y devuelve su ID en el registro"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO price_changes (product_id, title, variant_id, old_price, new_price, changed_at, batch_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(product_id), title, str(variant_id) if variant_id else None, str(old_price), str(new_price),
+                 time.time(), batch_id))
         if DEBUG_MODE:
-            print(f"   Guardado en memoria: ID {product_id} cambió de ${old_price} a ${new_price}")
-    
+            print(f"   Guardado en historial: ID {product_id} cambió de ${old_price} a ${new_price}"
+                  + (f" (lote {batch_id})" if batch_id else ""))
+        return cursor.lastrowid
+
+    def record_revert(self, change: dict):
+        """Añade la fila que deshace `change` (precio nuevo → precio anterior)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO price_changes (product_id, title, variant_id, old_price, new_price, changed_at, batch_id, reverts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (change['product_id'], change['title'], change['variant_id'], change['new_price'], change['old_price'],
+                 time.time(), change['batch_id'], change['id']))
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def latest_change(self, product_id: str) -> dict or None:
+        """Último cambio vigente del producto (el que se desharía a continuación)"""
+        rows = self._query(f"SELECT * FROM price_changes WHERE product_id = ? AND {self._ACTIVE} ORDER BY id DESC LIMIT 1",
+                           (str(product_id),))
+        return rows[0] if rows else None
+
+    def undo_depth(self, product_id: str) -> int:
+        """Número de cambios vigentes que se pueden deshacer para el producto"""
+        return self._query(f"SELECT COUNT(*) AS n FROM price_changes WHERE product_id = ? AND {self._ACTIVE}",
+                           (str(product_id),))[0]['n']
+
     def get_previous_price(self, product_id: str) -> str or None:
         """Obtiene el precio anterior de un producto"""
-        if product_id in self.price_history:
-            return self.price_history[product_id]['previous']
-        return None
-    
+        change = self.latest_change(product_id)
+        return change['old_price'] if change else None
+
     def has_history(self, product_id: str) -> bool:
         """Verifica si hay historial para un producto"""
-        return product_id in self.price_history
+        return self.latest_change(product_id) is not None
+
+    def last_batch_id(self) -> str or None:
+        """Último lote con cambios vigentes"""
+        rows = self._query(f"SELECT batch_id FROM price_changes WHERE batch_id IS NOT NULL AND {self._ACTIVE} "
+                           "ORDER BY id DESC LIMIT 1")
+        return rows[0]['batch_id'] if rows else None
+
+    def batch_changes(self, batch_id: str) -> list:
+        """Cambios vigentes de un lote (actualización masiva), en orden"""
+        return self._query(f"SELECT * FROM price_changes WHERE batch_id = ? AND {self._ACTIVE} ORDER BY id", (batch_id,))
+
+    def changes_since(self, since: float, until: float = None) -> list:
+        """Todos los cambios (incluidos los deshaceres) en [since, until) (epoch)"""
+        return self._query("SELECT * FROM price_changes WHERE changed_at >= ? AND changed_at < ? ORDER BY id",
+                           (since, until if until is not None else float("inf")))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
 # ============================================
-# PLUGIN DE SHOPIFY (VERSIÓN REVISADA Y SIMPLIFICADA)
+# TRANSPORTE HTTP COMPARTIDO (POOL + KEEP-ALIVE)
 # ============================================
 
-class ShopifyPlugin:
+def _http_settings_from_env() -> dict:
+    """Lee la configuración HTTP_* del .env (compartida por los transportes síncrono y asíncrono)."""
+    pool_sizes = {}
+    # Formato: HTTP_POOL_SIZES="gateway.example.com:8243=20,otro-host=5"
+    for entry in os.getenv("HTTP_POOL_SIZES", "").split(","):
+        if "=" in entry:
+            host, size = entry.rsplit("=", 1)
+            try:
+                pool_sizes[host.strip()] = int(size)
+            except ValueError:
+                print(f"   {Colors.yellow('AVISO')} HTTP_POOL_SIZES ignora entrada no válida: '{entry}'")
+    return {
+        "connect_timeout": float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+        "max_retries": int(os.getenv("HTTP_MAX_RETRIES", "3")),
+        "backoff_factor": float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5")),
+        "pool_maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "10")),
+        "pool_sizes": pool_sizes
+    }
+
+
+def _retry_after_seconds(headers) -> float or None:
+    """Segundos de la cabecera Retry-After (None si no viene o no es numérica)"""
+    retry_after = headers.get("Retry-After") if headers else None
+    try:
+        return float(retry_after) if retry_after else None
+    except ValueError:
+        return None
+
+
+class HttpTransport:
     """
-    Plugin para interactuar con la tienda Shopify a través del Gateway de WSO2.
-    Utiliza OAuth2 para autenticarse en el Gateway.
+    Sesión HTTP compartida por todas las llamadas al Gateway y a Shopify.
+
+    Reutiliza conexiones TCP+TLS (keep-alive) con pools por host, aplica timeouts de
+    conexión/lectura y reintenta con backoff exponencial ante errores de conexión, 5xx y 429
+    (respetando Retry-After). Con retry=False no se reintenta ningún estado HTTP: las llamadas REST
+    a Shopify lo hacen en el plugin, pidiendo turno al planificador de la tienda en cada intento.
     """
-    
-    def __init__(self):
-        self.price_memory = PriceMemory()  # Sistema de memoria de precios
-    
-    def _get_wso2_access_token(self) -> str or None:
-        """Obtiene un token de acceso de WSO2."""
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+    THROTTLED_STATUS = 429
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, max_retries: int = 3,
+                 backoff_factor: float = 0.5, pool_maxsize: int = 10, pool_sizes: dict = None, verify: bool = False):
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        self.session.verify = verify
+
+        # urllib3 solo reintenta errores de conexión; los estados HTTP los reintenta request()
+        # (sin Retry-After: urllib3 reintentaría 413/429/503 que lo traen aunque no estén en la lista)
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(),
+            allowed_methods=frozenset(["GET", "PUT", "POST"]),  # PUT de precio y client_credentials son idempotentes
+            respect_retry_after_header=False,
+            raise_on_status=False  # Tras agotar reintentos devolvemos la última respuesta para diagnosticarla
+        )
+        pool_sizes = pool_sizes or {}
+
+        def make_adapter(size: int) -> HTTPAdapter:
+            return HTTPAdapter(pool_connections=max(10, len(pool_sizes) + 1), pool_maxsize=size, max_retries=retry)
+
+        default_adapter = make_adapter(pool_maxsize)
+        self.session.mount("https://", default_adapter)
+        self.session.mount("http://", default_adapter)
+        # requests elige el adaptador con el prefijo más largo, así cada host tiene su propio pool
+        for host, size in pool_sizes.items():
+            host_adapter = make_adapter(size)
+            self.session.mount(f"https://{host}", host_adapter)
+            self.session.mount(f"http://{host}", host_adapter)
+
+    @classmethod
+    def from_env(cls) -> "HttpTransport":
+        """Construye el transporte a partir de las variables HTTP_* del .env"""
+        return cls(**_http_settings_from_env())
+
+    def request(self, method: str, url: str, retry: bool = True, **kwargs) -> requests.Response:
+        """Realiza la petición usando el pool compartido y el timeout por defecto."""
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            response = self.session.request(method, url, **kwargs)
+            retryable = response.status_code in self.RETRY_STATUSES or response.status_code == self.THROTTLED_STATUS
+            if not retry or not retryable or attempt >= self.max_retries:
+                return response
+            response.close()
+            time.sleep(_retry_after_seconds(response.headers) or self.backoff_factor * (2 ** attempt))
+
+    def close(self):
+        self.session.close()
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+def get_http_transport() -> HttpTransport:
+    """Devuelve el transporte HTTP compartido del proceso (se crea la primera vez)."""
+    global _shared_transport
+    if _shared_transport is None:
+        with _shared_transport_lock:
+            if _shared_transport is None:
+                _shared_transport = HttpTransport.from_env()
+    return _shared_transport
+
+class AsyncHttpTransport:
+    """
+    Equivalente asíncrono de HttpTransport sobre aiohttp.
+
+    Un único ClientSession (por event loop) mantiene las conexiones keep-alive; el número de
+    peticiones simultáneas por host se limita con semáforos según HTTP_POOL_MAXSIZE / HTTP_POOL_SIZES.
+    """
+
+    RETRY_STATUSES = HttpTransport.RETRY_STATUSES
+    THROTTLED_STATUS = HttpTransport.THROTTLED_STATUS
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, max_retries: int = 3,
+                 backoff_factor: float = 0.5, pool_maxsize: int = 10, pool_sizes: dict = None, verify: bool = False):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
+        self.pool_sizes = pool_sizes or {}
+        self.verify = verify
+        self._session = None
+        self._loop = None
+        self._host_semaphores = {}
+
+    @classmethod
+    def from_env(cls) -> "AsyncHttpTransport":
+        return cls(**_http_settings_from_env())
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        # La sesión de aiohttp está ligada a su event loop: si cambia (otro asyncio.run) se crea otra
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=0, ssl=None if self.verify else False, keepalive_timeout=30)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._loop = loop
+            self._host_semaphores = {}
+        return self._session
+
+    def _get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        from urllib.parse import urlsplit
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            size = self.pool_sizes.get(host, self.pool_sizes.get(host.split(":")[0], self.pool_maxsize))
+            self._host_semaphores[host] = asyncio.Semaphore(size)
+        return self._host_semaphores[host]
+
+    def _retry_delay(self, attempt: int, headers=None) -> float:
+        return _retry_after_seconds(headers) or self.backoff_factor * (2 ** attempt)
+
+    async def request(self, method: str, url: str, retry: bool = True, **kwargs) -> "HttpResponse":
+        """Realiza la petición con reintentos ante errores de conexión y (si retry) 5xx y 429."""
+        session = self._get_session()
+        semaphore = self._get_host_semaphore(url)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    async with session.request(method, url, **kwargs) as response:
+                        content = await response.read()
+                        result = HttpResponse(response.status, content, response.headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            retryable = result.status_code in self.RETRY_STATUSES or result.status_code == self.THROTTLED_STATUS
+            if retry and retryable and attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt, result.headers))
+                continue
+            return result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class HttpResponse:
+    """Respuesta ya leída (status, cuerpo y cabeceras) independiente de la sesión aiohttp."""
+
+    def __init__(self, status_code: int, content: bytes, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+
+_shared_async_transport = None
+
+def get_async_http_transport() -> AsyncHttpTransport:
+    """Devuelve el transporte HTTP asíncrono compartido del proceso (se crea la primera vez)."""
+    global _shared_async_transport
+    if _shared_async_transport is None:
+        with _shared_transport_lock:
+            if _shared_async_transport is None:
+                _shared_async_transport = AsyncHttpTransport.from_env()
+    return _shared_async_transport
+
+# ============================================
+# PLANIFICADOR DE LLAMADAS A SHOPIFY (LEAKY BUCKET)
+# ============================================
+
+SHOPIFY_CALL_LIMIT = int(os.getenv("SHOPIFY_CALL_LIMIT", "40"))  # Capacidad del cubo REST (80 en Plus; la cabecera la corrige)
+SHOPIFY_LEAK_RATE = float(os.getenv("SHOPIFY_LEAK_RATE", "0"))   # Llamadas/s que vacía Shopify (0 = límite / 20)
+SHOPIFY_CALL_HEADROOM = int(os.getenv("SHOPIFY_CALL_HEADROOM", "2"))  # Huecos del cubo que se dejan libres
+SHOPIFY_THROTTLE_RETRIES = int(os.getenv("SHOPIFY_THROTTLE_RETRIES", "3"))  # Reintentos tras un 429 o un 5xx (cada uno pide turno)
+
+class ShopifyCallScheduler:
+    """
+    Planificador por tienda del cubo con fuga de Shopify (X-Shopify-Shop-Api-Call-Limit "usadas/límite").
+
+    Cada llamada reserva su turno bajo un candado y el nivel estimado incluye las llamadas ya
+    reservadas, así que los turnos se reparten en orden de llegada y el ritmo sostenido queda justo
+    por debajo del límite (límite - margen). Las cabeceras solo suben el nivel estimado (lo reservado
+    aún no ha llegado a Shopify) y un 429 pausa la cola entera durante Retry-After.
+    Compartido por los hilos y corrutinas del proceso (ver get_call_scheduler). El mismo cubo, en
+    puntos de coste en lugar de llamadas, planifica la API GraphQL (ver get_graphql_scheduler).
+    """
+
+    def __init__(self, shop: str = "default", limit: int = SHOPIFY_CALL_LIMIT, leak_rate: float = SHOPIFY_LEAK_RATE,
+                 headroom: int = SHOPIFY_CALL_HEADROOM):
+        self.shop = shop
+        self.limit = limit
+        self.headroom = headroom
+        self._leak_rate = leak_rate
+        self._level = 0.0
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.waiting = 0      # Llamadas esperando turno ahora mismo (profundidad de la cola)
+        self.max_waiting = 0
+        self.calls = 0
+        self.throttled = 0    # 429 recibidos
+        self.total_wait = 0.0
+
+    @property
+    def leak_rate(self) -> float:
+        return self._leak_rate or self.limit / 20  # Shopify vacía el cubo completo en 20 s (2/s estándar, 4/s Plus)
+
+    def _leak(self, now: float):
+        self._level = max(0.0, self._level - (now - self._stamp) * self.leak_rate)
+        self._stamp = now
+
+    def _reserve(self, cost: float = 1) -> float:
+        """Reserva el siguiente turno (de `cost` unidades del cubo) y devuelve los segundos que faltan para él"""
+        with self._lock:
+            now = time.monotonic()
+            self._leak(now)
+            capacity = max(cost, self.limit - self.headroom)
+            wait = max(0.0, (self._level + cost - capacity) / self.leak_rate, self._paused_until - now)
+            self._level += cost
+            self.calls += 1
+            self.total_wait += wait
+            if wait > 0:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            return wait
+
+    def _leave_queue(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, cost: float = 1) -> float:
+        """Espera (bloqueando el hilo) hasta el turno de la llamada. Devuelve los segundos esperados."""
+        wait = self._reserve(cost)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave_queue()
+        return wait
+
+    async def acquire_async(self, cost: float = 1) -> float:
+        """Versión asíncrona de acquire: cede el event loop mientras espera."""
+        wait = self._reserve(cost)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave_queue()
+        return wait
+
+    def observe(self, headers):
+        """Sincroniza el límite y el nivel estimado con la cabecera de Shopify."""
+        call_limit = headers.get("X-Shopify-Shop-Api-Call-Limit") if headers else None
+        if not call_limit or "/" not in call_limit:
+            return
+        try:
+            used, limit = (int(part) for part in call_limit.split("/", 1))
+        except ValueError:
+            return
+        with self._lock:
+            self._leak(time.monotonic())
+            self.limit = limit
+            self._level = max(self._level, float(used))
+
+    def observe_cost(self, cost: dict, reserved: float, throttled: bool = False):
+        """
+        Sincroniza un cubo de coste GraphQL con `extensions.cost` de la respuesta.
+
+        Devuelve lo reservado de más (Shopify cobra el coste real, y nada si la consulta fue THROTTLED)
+        y toma límite, ritmo y nivel de `throttleStatus`; así el siguiente acquire espera lo justo.
+        """
+        status = cost.get("throttleStatus") or {}
+        actual = 0 if throttled else cost.get("actualQueryCost")
+        with self._lock:
+            self._leak(time.monotonic())
+            if actual is not None:
+                self._level = max(0.0, self._level - max(0.0, reserved - actual))
+            if status:
+                self.limit = int(status["maximumAvailable"])
+                self._leak_rate = float(status["restoreRate"])
+                self._level = max(self._level, self.limit - float(status["currentlyAvailable"]))
+            if throttled:
+                self.throttled += 1
+
+    def throttle(self, headers) -> float:
+        """Tras un 429: da el cubo por lleno y pausa la cola durante Retry-After. Devuelve la pausa."""
+        retry_after = _retry_after_seconds(headers) or 1 / self.leak_rate
+        with self._lock:
+            now = time.monotonic()
+            self._leak(now)
+            self._level = max(self._level, float(self.limit))
+            self._paused_until = max(self._paused_until, now + retry_after)
+            self.throttled += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._leak(time.monotonic())
+            return {"limit": self.limit, "leak_rate": self.leak_rate, "level": round(self._level, 2),
+                    "waiting": self.waiting, "max_waiting": self.max_waiting, "calls": self.calls,
+                    "throttled": self.throttled,
+                    "avg_wait_ms": round(self.total_wait / self.calls * 1000, 1) if self.calls else 0.0}
+
+
+_call_schedulers = {}  # tienda -> ShopifyCallScheduler
+
+def get_call_scheduler(shop: str = "default") -> ShopifyCallScheduler:
+    """Devuelve el planificador compartido de la tienda (se crea la primera vez)."""
+    with _shared_transport_lock:
+        scheduler = _call_schedulers.get(shop)
+        if scheduler is None:
+            scheduler = _call_schedulers[shop] = ShopifyCallScheduler(shop)
+        return scheduler
+
+PROFILER.register_gauge("shopify_queue_depth", "Llamadas a Shopify esperando turno en el planificador.",
+                        lambda: {shop: scheduler.waiting for shop, scheduler in list(_call_schedulers.items())})
+
+# ============================================
+# GESTOR DE TOKENS DE WSO2 (CACHÉ + REFRESCO)
+# ============================================
+
+class WSO2TokenManager:
+    """
+    Cachea el token client-credentials de WSO2 hasta poco antes de su `expires_in`.
+
+    - Single-flight: solo un hilo pide token al endpoint a la vez; el resto espera y reutiliza el resultado.
+    - Refresco en segundo plano: al entrar en la ventana de refresco se lanza UNA renovación en otro hilo
+      mientras los llamantes siguen usando el token vigente.
+    - Ambos márgenes se limitan a una fracción de `expires_in`, así los tokens de vida corta también se reutilizan.
+    """
+
+    DEFAULT_EXPIRES_IN = 3600  # Valor por defecto de WSO2 si la respuesta no trae expires_in
+
+    def __init__(self, expiry_margin: float = 30, refresh_ahead: float = 120, transport: HttpTransport = None):
+        self.transport = transport or get_http_transport()
+        self.expiry_margin = expiry_margin    # Segundos antes de expirar en los que el token deja de usarse (máx. 1/4 de expires_in)
+        self.refresh_ahead = refresh_ahead    # Segundos antes de expirar en los que se renueva en segundo plano (máx. 1/2)
+        self._token = None
+        self._usable_until = 0.0  # Instantes (monotonic) calculados una vez al recibir cada token
+        self._refresh_at = 0.0
+        self._state_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # Single-flight de peticiones al endpoint de tokens
+        self._background_refreshing = False
+
+    def get_token(self) -> str or None:
+        """Devuelve un token válido, pidiendo uno nuevo solo si no hay ninguno utilizable."""
+        token, usable_until, refresh_at = self._token, self._usable_until, self._refresh_at
+        now = time.monotonic()
+        if token and now < usable_until:
+            if now >= refresh_at:
+                self._schedule_background_refresh()
+            return token
+
+        with self._refresh_lock:
+            # Otro hilo puede haber renovado el token mientras esperábamos el lock
+            if self._token and time.monotonic() < self._usable_until:
+                return self._token
+            return self._fetch_token()
+
+    async def get_token_async(self) -> str or None:
+        """Versión para el event loop: el caso habitual (token cacheado) no cede el control;
+        solo cuando hay que pedir token se delega en un hilo para no bloquear el loop."""
+        token, usable_until, refresh_at = self._token, self._usable_until, self._refresh_at
+        now = time.monotonic()
+        if token and now < usable_until:
+            if now >= refresh_at:
+                self._schedule_background_refresh()
+            return token
+        return await asyncio.to_thread(self.get_token)
+
+    def invalidate(self, token: str):
+        """Descarta el token indicado (p.ej. tras un 401). Si ya se renovó, no hace nada."""
+        with self._state_lock:
+            if self._token == token:
+                self._token = None
+                self._usable_until = self._refresh_at = 0.0
+
+    def _schedule_background_refresh(self):
+        with self._state_lock:
+            if self._background_refreshing:
+                return
+            self._background_refreshing = True
+        thread = threading.Thread(target=self._background_refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            with self._refresh_lock:
+                # Solo renovar si nadie lo ha hecho ya
+                if time.monotonic() >= self._refresh_at:
+                    self._fetch_token()
+        finally:
+            with self._state_lock:
+                self._background_refreshing = False
+
+    def _fetch_token(self) -> str or None:
+        """Pide un token nuevo al endpoint de WSO2. Debe llamarse con _refresh_lock adquirido."""
         if DEBUG_MODE:
             print("   Solicitando token de acceso a WSO2...")
         token_endpoint = os.getenv("WSO2_TOKEN_ENDPOINT")
@@ -206,11 +976,23 @@ class ShopifyPlugin:
         payload = "grant_type=client_credentials"
         
         try:
-            response = requests.post(token_endpoint, headers=headers, data=payload, verify=False)
+            with PROFILER.span("wso2_token"):
+                response = self.transport.request("POST", token_endpoint, headers=headers, data=payload)
             if response.status_code == 200:
+                token_data = response.json()
+                token = token_data.get("access_token")
+                try:
+                    expires_in = float(token_data.get("expires_in", self.DEFAULT_EXPIRES_IN))
+                except (TypeError, ValueError):
+                    expires_in = self.DEFAULT_EXPIRES_IN
+                expires_at = time.monotonic() + expires_in
+                with self._state_lock:
+                    self._token = token
+                    self._usable_until = expires_at - min(self.expiry_margin, expires_in / 4)
+                    self._refresh_at = expires_at - min(self.refresh_ahead, expires_in / 2)
                 if DEBUG_MODE:
-                    print(f"   {Colors.green('OK')} Token de acceso de WSO2 obtenido.")
-                return response.json().get("access_token")
+                    print(f"   {Colors.green('OK')} Token de acceso de WSO2 obtenido (expira en {expires_in:.0f}s).")
+                return token
             else:
                 print(f"   {Colors.red('ERROR')} Error al obtener token WSO2: {response.status_code} - {response.text}")
                 return None
@@ -218,467 +1000,2534 @@ class ShopifyPlugin:
             print(f"   {Colors.red('ERROR')} Excepción al conectar con WSO2: {str(e)}")
             return None
 
-    def _make_api_call(self, method: str, api_path: str, payload: dict = None) -> dict:
-        """Función centralizada para hacer TODAS las llamadas a través de WSO2."""
-        
-        # Paso 1: Obtener token de WSO2
-        wso2_token = self._get_wso2_access_token()
-        if not wso2_token:
-            return {"error": "Fallo al obtener token de WSO2."}
+# ============================================
+# PAGINACIÓN Y BÚSQUEDA DE PRODUCTOS EN STREAMING
+# ============================================
 
-        # Paso 2: Preparar la petición
-        wso2_gw_url = os.getenv("WSO2_GW_URL")
-        shopify_api_token = os.getenv("SHOPIFY_API_TOKEN")
+PRODUCT_PAGE_LIMIT = 250  # Máximo permitido por Shopify (por defecto devuelve solo 50)
+LIST_FIELDS = "id,title,variants,updated_at"  # Proyección para listados y ordenación
+SEARCH_FIELDS = "id,title,body_html,tags,product_type,vendor,variants,updated_at"  # Búsquedas y filtros masivos
+PRODUCT_FIELDS = "id,title,variants"  # Campos mínimos para actualizar el precio de un producto
+VARIANT_CHECK_FIELDS = "id,price,updated_at"  # Relectura mínima para la concurrencia optimista
 
-        full_url = f"{wso2_gw_url}/shopify/1.0.0{api_path}"
-        if DEBUG_MODE:
-            print(f"   URL completa: {full_url}")
-        headers = {
-            "Authorization": f"Bearer {wso2_token}", # Autenticación para el Gateway
-            "X-Shopify-Access-Token": shopify_api_token # Cabecera para el backend de Shopify
-        }
-        if DEBUG_MODE:
-            print(f"   Headers: Authorization=Bearer [TOKEN], X-Shopify-Access-Token=[TOKEN]")
+_NEXT_LINK_RE = re.compile(r'<([^>]+)>\s*;\s*rel="next"')
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
 
-        # Paso 3: Realizar la petición
-        try:
-            if method.upper() == 'GET':
-                response = requests.get(full_url, headers=headers, verify=False)
-            elif method.upper() == 'PUT':
-                 headers["Content-Type"] = "application/json"
-                 response = requests.put(full_url, headers=headers, json=payload, verify=False)
-            else:
-                return {"error": f"Método {method} no implementado."}
-            
-            # Paso 4: Devolver el resultado
-            # Si la respuesta es exitosa pero no tiene contenido (ej. 204), devolvemos un JSON vacío
-            if 200 <= response.status_code < 300:
-                # Verificar si la respuesta es JSON válido
-                try:
-                    if response.content:
-                        return response.json()
-                    else:
-                        return {}
-                except json.JSONDecodeError:
-                    # Si no es JSON, puede ser HTML (redirección)
-                    if "text/html" in response.headers.get("content-type", ""):
-                        print("    El Gateway devuelve HTML en lugar de JSON")
-                        print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Posible redirección o página de error")
-                        print("   SOLUCIÓN: Verifica la configuración del endpoint en WSO2")
-                        return {"error": "Gateway devuelve HTML", "detail": "La respuesta no es JSON válido"}
-                    else:
-                        return {"error": "Respuesta no válida", "detail": "No se pudo procesar la respuesta"}
-            else:
-                # Mostrar el error específico que devuelve el gateway
-                error_detail = response.text
-                print(f"   {Colors.red('ERROR')} Error del Gateway: {response.status_code}")
-                print(f"   Error details: {error_detail}")
-                
-                # Interpretar el error específico
-                if response.status_code == 401:
-                    if "Invalid API key or access token" in error_detail:
-                        print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: El token de Shopify es inválido o ha expirado")
-                        print("   SOLUCIÓN: Verifica SHOPIFY_API_TOKEN en el archivo .env")
-                    elif "unrecognized login or wrong password" in error_detail:
-                        print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Credenciales de Shopify incorrectas")
-                        print("   SOLUCIÓN: Verifica SHOPIFY_API_TOKEN en el archivo .env")
-                    else:
-                        print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Error de autenticación en el Gateway")
-                        print("   SOLUCIÓN: Verifica la configuración de WSO2")
-                elif response.status_code == 403:
-                    print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Acceso denegado - posible problema de suscripción")
-                    print("   SOLUCIÓN: Verifica que la aplicación esté suscrita a la API en WSO2")
-                elif response.status_code == 404:
-                    print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Recurso no encontrado")
-                    print("   SOLUCIÓN: Verifica la URL del Gateway y el contexto de la API")
-                
-                return {"error": f"Error del Gateway: {response.status_code}", "detail": error_detail}
-                
-        except requests.exceptions.RequestException as e:
-            print(f"   {Colors.red('ERROR')} Error de conexión: {str(e)}")
-            return {"error": "Excepción de conexión", "detail": str(e)}
-        except json.JSONDecodeError as e:
-            print(f"   {Colors.red('ERROR')} Error al decodificar JSON: {str(e)}")
-            return {"error": "Error al procesar respuesta JSON", "detail": str(e)}
-        except Exception as e:
-            print(f"   {Colors.red('ERROR')} Error inesperado: {str(e)}")
-            return {"error": "Error inesperado", "detail": str(e)}
 
-    @kernel_function(name="get_products_list", description="Obtiene la lista de productos con sus IDs.")  # <<< SEMANTIC KERNEL
-    def get_products_list(self) -> str:
-        if DEBUG_MODE:
-            print("\n[EJECUTANDO] → get_products_list()")
-        data = self._make_api_call("GET", "/products.json")
-        
-        if "products" in data:
-            products_data = data["products"]
-            # CORRECCIÓN APLICADA: Ahora incluye el ID del producto
-            product_info = [
-                f"- ID: {p['id']} - {p['title']} - ${p.get('variants', [{}])[0].get('price', 'N/A')}" 
-                for p in products_data
-            ]
-            return f"Productos encontrados ({len(products_data)} total):\n" + "\n".join(product_info)
-        return f"No se pudieron obtener los productos. Razón: {data.get('error', 'Desconocida')} - {data.get('detail', '')}"
+class ShopifyAPIError(Exception):
+    """Error de la API durante un recorrido paginado; `data` contiene el dict de error de _make_api_call."""
 
-    @kernel_function(name="get_products_sorted", description="Obtiene productos ordenados por precio.")  # <<< SEMANTIC KERNEL
-    def get_products_sorted(self, order: str = "desc") -> str:
-        """
-        Obtiene productos ordenados por precio
-        order: 'asc' para menor a mayor, 'desc' para mayor a menor
-        """
-        if DEBUG_MODE:
-            print(f"\n[EJECUTANDO] → get_products_sorted(order={order})")
-        data = self._make_api_call("GET", "/products.json")
-        
-        if "products" in data:
-            products_data = data["products"]
-            
-            # Preparar datos con ID, título, precio y precio numérico para ordenar
-            products_with_details = []
-            for p in products_data:
-                price_str = p.get('variants', [{}])[0].get('price', 'N/A')
-                try:
-                    price_num = float(price_str) if price_str != 'N/A' else 0
-                except (ValueError, TypeError):
-                    price_num = 0
-                
-                products_with_details.append({
-                    'id': p['id'],
-                    'title': p['title'],
-                    'price_str': price_str,
-                    'price_num': price_num
-                })
-            
-            # Ordenar por precio
-            if order.lower() in ['asc', 'ascending', 'menor', 'low']:
-                products_with_details.sort(key=lambda x: x['price_num'])
-                order_desc = "de menor a mayor precio"
-            else:
-                products_with_details.sort(key=lambda x: x['price_num'], reverse=True)
-                order_desc = "de mayor a menor precio"
-            
-            # Formatear la salida
-            product_info = [
-                f"- ID: {p['id']} - {p['title']} - ${p['price_str']}" 
-                for p in products_with_details
-            ]
-            
-            return f"Productos encontrados ({len(products_data)} total) ordenados {order_desc}:\n" + "\n".join(product_info)
-        return f"No se pudieron obtener los productos. Razón: {data.get('error', 'Desconocida')} - {data.get('detail', '')}"
+    def __init__(self, data: dict):
+        super().__init__(data.get("error", "Error desconocido"))
+        self.data = data
 
-    @kernel_function(name="count_products", description="Cuenta el total de productos.")  # <<< SEMANTIC KERNEL
-    def count_products(self) -> str:
-        if DEBUG_MODE:
-            print("\n[EJECUTANDO] → count_products()")
-        data = self._make_api_call("GET", "/products/count.json")
-        
-        if "count" in data:
-            return f"La tienda tiene {data['count']} productos en total."
-        return f"No se pudo obtener el conteo. Razón: {data.get('error', 'Desconocida')} - {data.get('detail', '')}"
 
-    @kernel_function(name="update_product_price", description="Actualiza el precio de un producto dado su ID.")  # <<< SEMANTIC KERNEL
-    def update_product_price(self, product_id: str, new_price: str, remember_old: bool = True) -> str:
-        """Actualiza el precio de un producto dado su ID."""
-        if DEBUG_MODE:
-            print(f"\n[EJECUTANDO] → update_product_price() para ID {product_id} a ${new_price}")
-        
-        # PASO 1: Obtener precio actual antes del cambio
-        old_price = None
-        if remember_old:
-            if DEBUG_MODE:
-                print("   Obteniendo precio actual...")
-            current_data = self._make_api_call("GET", f"/products/{product_id}.json")
-            if "product" in current_data and current_data["product"].get("variants"):
-                old_price = current_data["product"]["variants"][0].get("price", "0")
-                if DEBUG_MODE:
-                    print(f"   Precio actual: ${old_price}")
-            else:
-                print(f"   {Colors.red('ERROR')} No se pudo obtener precio actual: {current_data}")
-        
-        # PASO 2: Preparar payload para la actualización
-        if DEBUG_MODE:
-            print("   Preparando actualización...")
-        
-        # Obtener el variant ID correcto
-        current_data = self._make_api_call("GET", f"/products/{product_id}.json")
-        if "product" not in current_data:
-            return f"{Colors.red('ERROR')} Error: No se pudo obtener información del producto ID {product_id}"
-        
-        variants = current_data["product"].get("variants", [])
-        if not variants:
-            return f"{Colors.red('ERROR')} Error: El producto ID {product_id} no tiene variantes"
-        
-        variant_id = variants[0]["id"]  # Usar el ID de la variante
-        if DEBUG_MODE:
-            print(f"   Variant ID: {variant_id}")
-        
-        # El payload correcto debe incluir el variant ID
-        payload = {
-            "product": {
-                "id": int(product_id),
-                "variants": [{
-                    "id": variant_id,
-                    "price": new_price
-                }]
-            }
-        }
+@dataclass
+class ShopifyResult:
+    """
+    Resultado tipado de una función del plugin de Shopify.
+
+    El éxito se consulta en `ok` (sin buscar patrones en el texto) y los datos concretos (IDs,
+    precios, filas) van en `data`. El texto con colores solo se genera al mostrarlo (render/str);
+    to_dict() es la versión serializable para los modos batch y servidor.
+    """
+    ok: bool
+    message: str
+    status: str = None  # Etiqueta al mostrarlo: 'OK' | 'ERROR' | 'AVISO' | None (sin etiqueta)
+    data: dict = field(default_factory=dict)
+    notes: list = field(default_factory=list)  # Avisos secundarios (p.ej. producto sugerido por similitud)
+
+    @classmethod
+    def success(cls, message: str, **data) -> "ShopifyResult":
+        return cls(True, message, 'OK', data)
+
+    @classmethod
+    def error(cls, message: str, **data) -> "ShopifyResult":
+        return cls(False, message, 'ERROR', data)
+
+    @classmethod
+    def warning(cls, message: str, **data) -> "ShopifyResult":
+        return cls(False, message, 'AVISO', data)
+
+    def render(self) -> str:
+        """Texto para la consola o el prompt (con colores si el terminal los admite)"""
+        labels = {'OK': Colors.green, 'ERROR': Colors.red, 'AVISO': Colors.yellow}
+        text = f"{labels[self.status](self.status)} {self.message}" if self.status in labels else self.message
+        for note in self.notes:
+            text += f"\n{Colors.yellow('NOTE')} {note}"
+        return text
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def to_dict(self) -> dict:
+        result = {"ok": self.ok, "status": self.status, "message": self.message}
+        if self.data:
+            result["data"] = self.data
+        if self.notes:
+            result["notes"] = self.notes
+        return result
+
+
+def _product_price(product: dict) -> str:
+    return (product.get('variants') or [{}])[0].get('price', 'N/A')
+
+
+def _build_search_text(product: dict) -> str:
+    """Texto buscable: título + descripción sin HTML + tags (en minúsculas)."""
+    title = (product.get('title') or '').lower()
+    body = _HTML_TAG_RE.sub(' ', product.get('body_html') or '').lower()
+    tags = (product.get('tags') or '').lower()
+    return f"{title} {body} {tags}".strip()
+
+
+class ProductMatcher:
+    """
+    Búsqueda por nombre sobre un flujo de productos, sin retener el catálogo completo.
+
+    Mantiene la prioridad de siempre: coincidencia exacta de título > primera coincidencia parcial
+    en título/descripción/tags > mejor similitud (difflib) sobre título y texto combinado.
+    """
+
+    FUZZY_THRESHOLD = 0.55  # Umbral algo más permisivo
+
+    def __init__(self, product_name: str):
+        self.product_name = product_name
+        self.query = product_name.lower().strip()
+        self.exact = None
+        self.partial = None
+        self.fuzzy_candidates = []  # (resumen, título en minúsculas, texto combinado capado a 256)
+        self.seen = 0
+        self.sample_titles = []
+
+    @staticmethod
+    def _summary(product: dict) -> dict:
+        return {'id': str(product['id']), 'name': product['title'], 'price': _product_price(product)}
+
+    def feed(self, product: dict) -> bool:
+        """Procesa un producto. Devuelve True si ya hay coincidencia exacta (se puede dejar de leer)."""
+        self.seen += 1
+        title = product.get('title') or ''
+        if len(self.sample_titles) < 5:
+            self.sample_titles.append(title or '(sin título)')
+
+        # 1) Coincidencia exacta por título
+        if title.lower() == self.query:
+            self.exact = self._summary(product)
+            return True
+
+        # 2) Coincidencia parcial; solo hace falta la primera y, si la hay, la similitud no se usa
+        if self.partial is None:
+            searchable = _build_search_text(product)
+            if self.query in searchable:
+                self.partial = self._summary(product)
+                self.fuzzy_candidates = []
+            else:
+                self.fuzzy_candidates.append((self._summary(product), title.lower(), searchable[:256]))
+        return False
+
+    def result(self) -> dict:
+        if self.exact:
+            if DEBUG_MODE:
+                print(f"   {Colors.green('OK')} Coincidencia exacta (título): {self.exact['name']}")
+            return {'found': True, **self.exact}
+        if self.partial:
+            if DEBUG_MODE:
+                print(f"   {Colors.green('OK')} Coincidencia parcial: {self.partial['name']}")
+            return {'found': True, **self.partial}
+
+        # 3) Similitud flexible (sobre título y texto combinado)
+        best_match = None
+        best_ratio = self.FUZZY_THRESHOLD
+        for summary, title, combined in self.fuzzy_candidates:
+            ratio_title = difflib.SequenceMatcher(None, self.query, title).ratio()
+            if ratio_title > best_ratio:
+                best_ratio = ratio_title
+                best_match = summary
+                continue
+            ratio_combined = difflib.SequenceMatcher(None, self.query, combined).ratio()
+            if ratio_combined > best_ratio:
+                best_ratio = ratio_combined
+                best_match = summary
+
+        if best_match:
+            if DEBUG_MODE:
+                print(f"   {Colors.yellow('SUGERENCIA')} Similaridad {best_ratio:.0%}: {best_match['name']}")
+            return {'found': True, **best_match, 'similarity': best_ratio, 'suggestion': True}
+
+        # 4) No encontrado: sugerir primeros productos para ayudar
+        if DEBUG_MODE:
+            print(f"   {Colors.red('ERROR')} No se encontró '{self.product_name}'")
+            print(f"   {Colors.yellow('SUGERENCIA')} Productos disponibles:")
+            for title in self.sample_titles:
+                print(f"     - {title}")
+            if self.seen > 5:
+                print(f"     ... y {self.seen - 5} productos más")
+        return {'found': False, 'error': 'Producto no encontrado'}
+
+# ============================================
+# CACHÉ LOCAL DEL CATÁLOGO (TTL + LRU)
+# ============================================
+
+class CatalogCache:
+    """
+    Caché en proceso de productos indexada por ID, con TTL y límite LRU.
+
+    Cada entrada recuerda qué campos contiene (proyección `fields=`) para no servir un producto
+    incompleto. Además guarda el orden del último catálogo completo descargado, de modo que un
+    listado seguido de una ordenación o búsqueda no vuelve a descargar la tienda entera.
+    """
+
+    def __init__(self, ttl: float = 120.0, max_entries: int = 50000):
+        self.ttl = ttl                  # Segundos de validez (0 desactiva la caché)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # {product_id: (producto, campos o None=todos, guardado_en)}
+        self._full_catalog = None       # (ids en orden de Shopify, campos, cargado_en)
+        self._lock = threading.Lock()
+        self._listeners = []            # Callbacks (producto, campos) / (product_id, None) al cambiar una entrada
+        self.generation = 0             # Cambia cada vez que se registra o se pierde un catálogo completo
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "CatalogCache":
+        return cls(ttl=float(os.getenv("CATALOG_CACHE_TTL", "120")),
+                   max_entries=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "50000")))
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def add_listener(self, callback):
+        """Registra un callback para mantener estructuras derivadas (p.ej. el índice de búsqueda)."""
+        self._listeners.append(callback)
+
+    def _notify(self, product, fields):
+        for callback in self._listeners:
+            callback(product, fields)
+
+    @staticmethod
+    def _fields_set(fields: str):
+        return frozenset(f.strip() for f in fields.split(",")) if fields else None
+
+    @staticmethod
+    def _covers(available, required) -> bool:
+        return available is None or (required is not None and required <= available)
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return time.monotonic() - stored_at < self.ttl
+
+    def get(self, product_id, fields: str = None) -> dict or None:
+        """Devuelve el producto cacheado si está vigente y contiene los campos pedidos."""
+        if not self.enabled:
+            return None
+        key = str(product_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._is_fresh(entry[2]) and self._covers(entry[1], self._fields_set(fields)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, product: dict, fields: str = None):
+        """Guarda (o completa) un producto. `fields=None` indica que el producto viene completo."""
+        if not self.enabled or not product or "id" not in product:
+            return
+        key = str(product["id"])
+        new_fields = self._fields_set(fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._is_fresh(entry[2]) and new_fields is not None:
+                # Fusionar con lo que ya teníamos para no perder campos de otra proyección
+                # (se conserva la marca de tiempo antigua: la entrada caduca con su dato más viejo)
+                merged = {**entry[0], **product}
+                merged_fields = None if entry[1] is None else entry[1] | new_fields
+                self._entries[key] = (merged, merged_fields, entry[2])
+            else:
+                self._entries[key] = (product, new_fields, time.monotonic())
+            self._entries.move_to_end(key)
+            stored_product, stored_fields, _ = self._entries[key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._drop_full_catalog()  # Ya no tenemos el catálogo completo
+        self._notify(stored_product, stored_fields)
+
+    def _drop_full_catalog(self):
+        if self._full_catalog is not None:
+            self._full_catalog = None
+            self.generation += 1
+
+    def mark_full_catalog(self, product_ids: list, fields: str):
+        """Registra que se ha descargado el catálogo completo (en este orden) con esa proyección."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(product_ids) <= self.max_entries:
+                self._full_catalog = ([str(pid) for pid in product_ids], self._fields_set(fields), time.monotonic())
+                self.generation += 1
+
+    def full_catalog_generation(self, fields: str = None) -> int or None:
+        """Generación del catálogo completo vigente que cubre `fields`, sin materializar la lista."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if not self._full_catalog:
+                return None
+            product_ids, available, loaded_at = self._full_catalog
+            if not self._is_fresh(loaded_at) or not self._covers(available, self._fields_set(fields)):
+                return None
+            return self.generation
+
+    def full_catalog(self, fields: str = None) -> list or None:
+        """Devuelve el catálogo completo cacheado (lista de productos) o None si no está disponible."""
+        if not self.enabled:
+            return None
+        required = self._fields_set(fields)
+        with self._lock:
+            if not self._full_catalog:
+                self.misses += 1
+                return None
+            product_ids, available, loaded_at = self._full_catalog
+            if not self._is_fresh(loaded_at) or not self._covers(available, required):
+                self.misses += 1
+                return None
+            products = []
+            for product_id in product_ids:
+                entry = self._entries.get(product_id)
+                if entry is None:
+                    self._drop_full_catalog()
+                    self.misses += 1
+                    return None
+                products.append(entry[0])
+            self.hits += 1
+            return products
+
+    def apply_variant(self, product_id, variant: dict):
+        """Write-through de un PUT /variants/{id}.json: sustituye esa variante en el producto cacheado."""
+        if not self.enabled:
+            return
+        key = str(product_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            product, fields, stored_at = entry
+            variants = [{**v, **variant} if v.get("id") == variant.get("id") else v for v in product.get("variants", [])]
+            updated = {**product, "variants": variants}
+            if variant.get("updated_at"):
+                updated["updated_at"] = variant["updated_at"]
+            self._entries[key] = (updated, fields, stored_at)
+        self._notify(updated, fields)
+
+    def invalidate(self, product_id=None):
+        """Elimina un producto (o toda la caché si no se indica ID)."""
+        with self._lock:
+            if product_id is None:
+                self._entries.clear()
+                self._drop_full_catalog()
+            else:
+                self._entries.pop(str(product_id), None)
+                if self._full_catalog and str(product_id) in self._full_catalog[0]:
+                    self._drop_full_catalog()
+        if product_id is not None:
+            self._notify(str(product_id), None)
+
+# ============================================
+# ÍNDICE DE BÚSQUEDA DE PRODUCTOS (INVERTIDO + TRIGRAMAS)
+# ============================================
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductSearchIndex:
+    """
+    Índice de búsqueda por nombre sobre título, descripción sin HTML y tags.
+
+    Un índice invertido de tokens y otro de trigramas de caracteres acotan los candidatos, de modo que
+    la verificación de subcadenas y la similitud de difflib solo se calculan sobre una lista corta.
+    Se construye una vez y después se actualiza producto a producto con los cambios que notifica la
+    caché (p.ej. el write-through de un PUT); un catálogo completo nuevo solo añade altas y quita bajas.
+    """
+
+    MAX_FUZZY_CANDIDATES = 64  # Candidatos de similitud en catálogos grandes
+    FULL_FUZZY_LIMIT = 500     # Hasta este tamaño la similitud se calcula sobre todo el catálogo
+
+    def __init__(self, fields: str = SEARCH_FIELDS):
+        self.required_fields = frozenset(fields.split(","))
+        self.generation = None
+        self._docs = {}        # {product_id: (resumen, título en minúsculas, texto buscable)}
+        self._titles = {}      # {título en minúsculas: {product_id}}
+        self._tokens = {}      # {token: {product_id}}
+        self._grams = {}       # {trigrama: {product_id}} sobre el texto buscable completo (subcadenas)
+        self._title_grams = {} # {trigrama: {product_id}} sobre el título (similitud)
+        self._head_grams = {}  # {trigrama: {product_id}} sobre el texto combinado capado a 256 (similitud)
+        self._gram_sizes = {}  # {product_id: (nº trigramas del título, nº trigramas del texto capado)}
+        self._lock = threading.Lock()
+
+    def rebuild(self, products: list, generation: int):
+        with self._lock:
+            self._docs, self._titles, self._tokens, self._grams = {}, {}, {}, {}
+            self._title_grams, self._head_grams, self._gram_sizes = {}, {}, {}
+            for product in products:
+                self._add(product)
+            self.generation = generation
+
+    def sync(self, products: list, generation: int):
+        """
+        Alinea el índice con un catálogo completo nuevo de la caché sin reconstruirlo.
+
+        Los productos ya indexados están al día (on_cache_change recibe cada put y write-through),
+        así que solo se indexan los que faltan y se quitan los que ya no están en el catálogo.
+        """
+        if self.generation is None:
+            self.rebuild(products, generation)
+            return
+        with self._lock:
+            current = {str(product["id"]): product for product in products}
+            for product_id in self._docs.keys() - current.keys():
+                self._remove(product_id)
+            for product_id, product in current.items():
+                if product_id not in self._docs:
+                    self._add(product)
+            self.generation = generation
+
+    def on_cache_change(self, product, fields):
+        """Listener de CatalogCache: mantiene el índice al día de forma incremental."""
+        with self._lock:
+            if self.generation is None:
+                return
+            if fields is None and not isinstance(product, dict):
+                self._remove(product)  # Invalidación de un producto concreto
+            elif fields is None or self.required_fields <= fields:
+                self._remove(str(product["id"]))
+                self._add(product)
+            elif str(product["id"]) in self._docs:
+                # Proyección parcial (p.ej. listado): solo cambian precio/título del resumen
+                self._remove(str(product["id"]))
+                self._add(product)
+
+    def _add(self, product: dict):
+        product_id = str(product["id"])
+        title = (product.get('title') or '').lower()
+        searchable = _build_search_text(product)
+        self._docs[product_id] = (ProductMatcher._summary(product), title, searchable)
+        self._titles.setdefault(title, set()).add(product_id)
+        for token in set(_TOKEN_RE.findall(searchable)):
+            self._tokens.setdefault(token, set()).add(product_id)
+        for gram in _trigrams(searchable):
+            self._grams.setdefault(gram, set()).add(product_id)
+        # Mismos textos que compara difflib: el título y el texto combinado capado a 256 caracteres
+        title_grams, head_grams = _trigrams(title), _trigrams(searchable[:256])
+        for gram in title_grams:
+            self._title_grams.setdefault(gram, set()).add(product_id)
+        for gram in head_grams:
+            self._head_grams.setdefault(gram, set()).add(product_id)
+        self._gram_sizes[product_id] = (len(title_grams), len(head_grams))
+
+    def _remove(self, product_id: str):
+        doc = self._docs.pop(product_id, None)
+        if not doc:
+            return
+        _, title, searchable = doc
+        self._discard(self._titles, title, product_id)
+        for token in set(_TOKEN_RE.findall(searchable)):
+            self._discard(self._tokens, token, product_id)
+        for gram in _trigrams(searchable):
+            self._discard(self._grams, gram, product_id)
+        for gram in _trigrams(title):
+            self._discard(self._title_grams, gram, product_id)
+        for gram in _trigrams(searchable[:256]):
+            self._discard(self._head_grams, gram, product_id)
+        self._gram_sizes.pop(product_id, None)
+
+    @staticmethod
+    def _discard(postings: dict, key: str, product_id: str):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del postings[key]
+
+    @staticmethod
+    def _in_catalog_order(product_ids) -> list:
+        # Shopify devuelve el catálogo ordenado por ID: se respeta para desempatar como antes
+        return sorted(product_ids, key=int)
+
+    def search(self, product_name: str) -> dict:
+        """
+        Misma prioridad que ProductMatcher sin recorrer el catálogo. Las coincidencias exacta y parcial
+        dan el mismo resultado; la similitud también hasta FULL_FUZZY_LIMIT productos, y por encima se
+        calcula solo sobre los MAX_FUZZY_CANDIDATES con más trigramas en común (aproximación).
+        """
+        query = product_name.lower().strip()
+        with self._lock:
+            # 1) Coincidencia exacta por título
+            exact_ids = self._titles.get(query)
+            if exact_ids:
+                summary = self._docs[self._in_catalog_order(exact_ids)[0]][0]
+                if DEBUG_MODE:
+                    print(f"   {Colors.green('OK')} Coincidencia exacta (título, índice): {summary['name']}")
+                return {'found': True, **summary}
+
+            # 2) Coincidencia parcial: los candidatos deben contener todos los trigramas de la consulta
+            query_grams = _trigrams(query)
+            if query_grams:
+                postings = sorted((self._grams.get(g, set()) for g in query_grams), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            else:
+                candidates = self._docs.keys()
+            for product_id in self._in_catalog_order(candidates):
+                if query in self._docs[product_id][2]:
+                    summary = self._docs[product_id][0]
+                    if DEBUG_MODE:
+                        print(f"   {Colors.green('OK')} Coincidencia parcial (índice): {summary['name']}")
+                    return {'found': True, **summary}
+
+            # 3) Similitud flexible: en catálogos grandes solo sobre los candidatos más parecidos por
+            #    trigramas (Jaccard contra el título o contra el texto combinado capado, lo que sea mayor)
+            if query_grams and len(self._docs) > self.FULL_FUZZY_LIMIT:
+                title_overlap, head_overlap = Counter(), Counter()
+                for gram in query_grams:
+                    title_overlap.update(self._title_grams.get(gram, ()))
+                    head_overlap.update(self._head_grams.get(gram, ()))
+
+                def jaccard(shared: int, size: int) -> float:
+                    return shared / (len(query_grams) + size - shared)
+
+                scores = {}
+                for product_id, shared in title_overlap.items():
+                    scores[product_id] = jaccard(shared, self._gram_sizes[product_id][0])
+                for product_id, shared in head_overlap.items():
+                    scores[product_id] = max(scores.get(product_id, 0.0), jaccard(shared, self._gram_sizes[product_id][1]))
+                fuzzy_ids = heapq.nlargest(self.MAX_FUZZY_CANDIDATES, scores, key=scores.get)
+            else:
+                fuzzy_ids = list(self._docs.keys())
+            matcher = ProductMatcher(product_name)
+            matcher.fuzzy_candidates = [
+                (summary, title, searchable[:256])
+                for summary, title, searchable in (self._docs[pid] for pid in self._in_catalog_order(fuzzy_ids))
+            ]
+            matcher.seen = len(self._docs)
+            matcher.sample_titles = [self._docs[pid][0]['name'] for pid in self._in_catalog_order(self._docs)[:5]] if DEBUG_MODE else []
+            return matcher.result()
+
+# ============================================
+# SNAPSHOT PERSISTENTE DEL CATÁLOGO (SQLITE)
+# ============================================
+
+def _parse_shopify_timestamp(value: str):
+    """Convierte un updated_at de Shopify (ISO 8601 con zona) a datetime en UTC, o None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+class CatalogSnapshot:
+    """
+    Copia compacta del catálogo en un fichero SQLite local con marca de agua `updated_at`.
+
+    Al arrancar se carga el snapshot y solo se piden a Shopify los productos modificados desde
+    la marca de agua (`updated_at_min`), en lugar de recorrer la tienda entera.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, updated_at TEXT, data TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row(product: dict) -> tuple:
+        return (int(product["id"]), product.get("updated_at"), json.dumps(product, separators=(",", ":")))
+
+    def load(self):
+        """Devuelve (productos ordenados por ID, campos, marca de agua) o None si está vacío."""
+        with self._lock:
+            meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+            rows = self._conn.execute("SELECT data FROM products ORDER BY id").fetchall()
+        if not rows or not meta.get("fields"):
+            return None
+        return [json.loads(data) for (data,) in rows], meta["fields"], meta.get("watermark")
+
+    def replace_all(self, products: list, fields: str):
+        """Sustituye el snapshot por un catálogo completo recién descargado."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM products")
+            self._conn.executemany("INSERT INTO products (id, updated_at, data) VALUES (?, ?, ?)",
+                                   [self._row(p) for p in products])
+            self._write_meta(fields, products)
+
+    def upsert(self, products: list, fields: str):
+        """Aplica un delta (productos nuevos o modificados)."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO products (id, updated_at, data) VALUES (?, ?, ?)",
+                                   [self._row(p) for p in products])
+            self._write_meta(fields, products)
+
+    def _write_meta(self, fields: str, products: list):
+        current = self._conn.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        watermark = _parse_shopify_timestamp(current[0]) if current else None
+        for product in products:
+            updated_at = _parse_shopify_timestamp(product.get("updated_at"))
+            if updated_at and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fields', ?)", (fields,))
+        if watermark:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)", (watermark.isoformat(),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# ============================================
+# ACTUALIZACIÓN MASIVA DE PRECIOS
+# ============================================
+
+BULK_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", "4"))  # PUTs simultáneos en una actualización masiva
+CENT = Decimal("0.01")
+
+
+def describe_price_operation(operation: str, value) -> str:
+    return {
+        'add': f"añadiendo ${value}",
+        'subtract': f"restando ${value}",
+        'divide': f"dividiendo entre {value}",
+        'multiply': f"multiplicando por {value}",
+        'percent_reduce': f"reduciendo {value}%",
+        'percent_increase': f"incrementando {value}%",
+    }.get(operation, operation)
+
+
+def compute_bulk_prices(prices: list, operation: str, value) -> list:
+    """
+    Calcula los nuevos precios de todos los productos en una sola pasada.
+
+    Usa aritmética Decimal con redondeo a céntimos ROUND_HALF_UP (lo que espera un comercio),
+    en lugar de float. Lanza ValueError si la operación no es válida.
+    """
+    value = Decimal(str(value))
+    if operation == 'divide':
+        if value == 0:
+            raise ValueError("División por cero")
+        return [(price / value).quantize(CENT, rounding=ROUND_HALF_UP) for price in prices]
+    # El resto de operaciones son afines: precio * factor + desplazamiento
+    factor, offset = {
+        'add': (Decimal(1), value),
+        'subtract': (Decimal(1), -value),
+        'multiply': (value, Decimal(0)),
+        'percent_reduce': (1 - value / 100, Decimal(0)),
+        'percent_increase': (1 + value / 100, Decimal(0)),
+    }.get(operation, (None, None))
+    if factor is None:
+        raise ValueError(f"Operación '{operation}' no soportada")
+    return [(price * factor + offset).quantize(CENT, rounding=ROUND_HALF_UP) for price in prices]
+
+
+# ============================================
+# TIENDAS (MULTITIENDA)
+# ============================================
+
+DEFAULT_SHOP = "default"  # Nombre de la tienda única configurada con SHOPIFY_API_TOKEN
+ALL_SHOPS = "*"           # Ámbito de las consultas a todas las tiendas a la vez
+
+@dataclass
+class ShopConfig:
+    """Una tienda detrás del Gateway de WSO2: contexto de su API en el Gateway y token de Shopify."""
+    name: str
+    api_context: str = "/shopify/1.0.0"
+    access_token: str = None
+
+    @classmethod
+    def from_env(cls, name: str = DEFAULT_SHOP) -> "ShopConfig":
+        """Lee <prefijo>API_TOKEN y <prefijo>API_CONTEXT (por defecto /shopify-<nombre>/1.0.0)"""
+        shop = cls(name)
+        default_context = "/shopify/1.0.0" if name == DEFAULT_SHOP else f"/shopify-{name}/1.0.0"
+        shop.api_context = os.getenv(f"{shop.env_prefix}API_CONTEXT", default_context)
+        shop.access_token = os.getenv(shop.token_variable)
+        return shop
+
+    @property
+    def env_prefix(self) -> str:
+        """Prefijo de sus variables en el .env: SHOPIFY_ (tienda única) o SHOPIFY_<NOMBRE>_"""
+        return "SHOPIFY_" if self.name == DEFAULT_SHOP else f"SHOPIFY_{re.sub(r'[^A-Za-z0-9]', '_', self.name).upper()}_"
+
+    @property
+    def token_variable(self) -> str:
+        return f"{self.env_prefix}API_TOKEN"
+
+    def file_path(self, path: str) -> str:
+        """Fichero local propio de la tienda (snapshot, historial): catalog_snapshot.sqlite -> catalog_snapshot.eu.sqlite"""
+        if self.name == DEFAULT_SHOP:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.name}{ext}"
+
+
+def shops_from_env() -> list:
+    """
+    Tiendas del .env. SHOPIFY_SHOPS=eu,us declara varias; cada una lee SHOPIFY_<NOMBRE>_API_TOKEN y
+    SHOPIFY_<NOMBRE>_API_CONTEXT (por defecto /shopify-<nombre>/1.0.0). Sin SHOPIFY_SHOPS se usa la
+    tienda única de SHOPIFY_API_TOKEN, como hasta ahora.
+    """
+    names = [name.strip().lower() for name in os.getenv("SHOPIFY_SHOPS", "").split(",") if name.strip()]
+    return [ShopConfig.from_env(name) for name in names] or [ShopConfig.from_env()]
+
+
+_ALL_SHOPS_PATTERN = re.compile(
+    r"\s*\b(?:en|de|in|across|from|for)\s+(?:todas\s+las\s+tiendas|cada\s+tienda|all\s+(?:the\s+|my\s+)?(?:stores|shops)"
+    r"|every\s+(?:store|shop)|each\s+(?:store|shop))\b", re.IGNORECASE)
+
+class ShopRegistry:
+    """
+    Tiendas que sirve el proceso detrás del mismo Gateway de WSO2.
+
+    Cada tienda tiene su propio plugin (token de Shopify, pool HTTP, caché y snapshot del catálogo,
+    historial de precios y planificador de llamadas), creado por `make_plugin` la primera vez que se
+    usa. resolve() detecta la tienda mencionada en una consulta y fan_out() ejecuta la misma función
+    en todas las tiendas a la vez.
+    """
+
+    def __init__(self, shops: list, make_plugin, default: str = None):
+        self.shops = {shop.name: shop for shop in shops}
+        self.default = default if default in self.shops else shops[0].name
+        self._make_plugin = make_plugin
+        self._plugins = {}
+        self._lock = threading.Lock()
+        # Solo cuentan las tiendas registradas: "lista los productos de la tienda" no se confunde con un nombre
+        names = "|".join(re.escape(name) for name in sorted(self.shops, key=len, reverse=True))
+        self._shop_pattern = re.compile(
+            rf"\s*\b(?:en|de|para|in|from|on|for)\s+(?:(?:la|the)\s+)?(?:tienda|store|shop)\s+({names})\b"
+            rf"|\s*\b(?:en|de|in|from|on|for)\s+the\s+({names})\s+(?:store|shop)\b", re.IGNORECASE)
+
+    @property
+    def multi(self) -> bool:
+        return len(self.shops) > 1
+
+    def get(self, name: str = None):
+        """Plugin de la tienda (la tienda por defecto si no se indica). KeyError si no existe."""
+        name = name or self.default
+        shop = self.shops[name]
+        with self._lock:
+            plugin = self._plugins.get(name)
+            if plugin is None:
+                plugin = self._plugins[name] = self._make_plugin(shop)
+            return plugin
+
+    def plugins(self) -> dict:
+        return {name: self.get(name) for name in self.shops}
+
+    def resolve(self, text: str):
+        """Devuelve (ámbito, texto sin la mención): ALL_SHOPS, el nombre de una tienda o None si no se menciona"""
+        match = _ALL_SHOPS_PATTERN.search(text)
+        if match:
+            return ALL_SHOPS, (text[:match.start()] + text[match.end():]).strip()
+        match = self._shop_pattern.search(text)
+        if match:
+            return (match.group(1) or match.group(2)).lower(), (text[:match.start()] + text[match.end():]).strip()
+        return None, text
+
+    async def fan_out(self, call, function_name: str, *args) -> dict:
+        """Ejecuta `function_name` en todas las tiendas en paralelo con `call` (p.ej. agent._call_shopify): {tienda: ShopifyResult}"""
+        names = list(self.shops)
+        results = await asyncio.gather(*(call(getattr(self.get(name), function_name), *args) for name in names),
+                                       return_exceptions=True)
+        return {name: result if isinstance(result, ShopifyResult) else ShopifyResult.error(f"Error inesperado: {result}")
+                for name, result in zip(names, results)}
+
+    @staticmethod
+    def merge_results(results: dict) -> ShopifyResult:
+        """Une los resultados por tienda: un bloque por tienda y, en conteos y listados, el total de todas"""
+        blocks = [f"Tienda {name}:\n{result.message}" for name, result in results.items()]
+        data = {"shops": {name: result.to_dict() for name, result in results.items()}}
+        header = f"Resultados de {len(results)} tiendas:"
+        if all("count" in result.data for result in results.values()):
+            data["count"] = sum(int(result.data["count"]) for result in results.values())
+            header = f"Las {len(results)} tiendas tienen {data['count']} productos en total."
+        elif all("products" in result.data for result in results.values()):
+            data["products"] = [{**product, "shop": name} for name, result in results.items() for product in result.data["products"]]
+            data["total"] = len(data["products"])
+            per_shop = ", ".join(f"{name}: {result.data['total']}" for name, result in results.items())
+            header = f"Productos de {len(results)} tiendas ({data['total']} total; {per_shop}):"
+        return ShopifyResult(all(result.ok for result in results.values()), "\n\n".join([header] + blocks), data=data)
+
+    async def aclose(self):
+        """Cierra los recursos de las tiendas abiertas: pools HTTP (síncronos y aiohttp), snapshots e historiales"""
+        for plugin in list(self._plugins.values()):
+            if hasattr(plugin, "aclose"):
+                await plugin.aclose()
+            else:
+                plugin.close()
+
+# ============================================
+# PLUGIN DE SHOPIFY (VERSIÓN REVISADA Y SIMPLIFICADA)
+# ============================================
+
+class ShopifyPlugin:
+    """
+    Plugin para interactuar con la tienda Shopify a través del Gateway de WSO2.
+    Utiliza OAuth2 para autenticarse en el Gateway.
+    """
+    
+    def __init__(self, token_manager: WSO2TokenManager = None, transport: HttpTransport = None,
+                 catalog_cache: CatalogCache = None, catalog_snapshot: CatalogSnapshot = None,
+                 price_history: PriceHistory = None, call_scheduler: ShopifyCallScheduler = None,
+                 shop: ShopConfig = None):
+        self.shop = shop or ShopConfig.from_env()  # Tienda a la que van las llamadas (contexto en WSO2 y token)
+        self.price_history = price_history or PriceHistory()  # Registro persistente de cambios de precio
+        self.catalog_cache = catalog_cache or CatalogCache.from_env()  # Caché local de productos
+        self.catalog_snapshot = catalog_snapshot  # Snapshot en disco (None = desactivado)
+        self.search_index = ProductSearchIndex()  # Índice de búsqueda por nombre sobre la caché
+        self.catalog_cache.add_listener(self.search_index.on_cache_change)
+        self.transport = transport or get_http_transport()  # Pool de conexiones compartido
+        self.token_manager = token_manager or WSO2TokenManager(transport=self.transport)  # Token de WSO2 cacheado y compartido
+        self.call_scheduler = call_scheduler or get_call_scheduler(self.shop.name)  # Ritmo de llamadas según el cubo de Shopify
+    
+    def close(self):
+        """Cierra el pool HTTP, el snapshot y el historial de la tienda (llamar al terminar el programa)."""
+        self.transport.close()
+        if self.catalog_snapshot:
+            self.catalog_snapshot.close()
+        self.price_history.close()
+
+    def _get_wso2_access_token(self) -> str or None:
+        """Obtiene un token de acceso de WSO2 (cacheado por el gestor de tokens)."""
+        return self.token_manager.get_token()
+
+    def _build_api_url(self, api_path: str) -> str:
+        wso2_gw_url = os.getenv("WSO2_GW_URL")
+        full_url = f"{wso2_gw_url}{self.shop.api_context}{api_path}"
+        if DEBUG_MODE:
+            print(f"   URL completa: {full_url}")
+        return full_url
+
+    def _build_api_headers(self, wso2_token: str, method: str) -> dict:
+        headers = {
+            "Authorization": f"Bearer {wso2_token}", # Autenticación para el Gateway
+            "X-Shopify-Access-Token": self.shop.access_token # Cabecera para el backend de Shopify
+        }
+        if method.upper() in ('PUT', 'POST'):
+            headers["Content-Type"] = "application/json"
+        if DEBUG_MODE:
+            print(f"   Headers: Authorization=Bearer [TOKEN], X-Shopify-Access-Token=[TOKEN]")
+        return headers
+
+    def _scheduler_for(self, api_path: str) -> ShopifyCallScheduler or None:
+        # GraphQL limita por coste de la consulta, no por el cubo REST de llamadas: lo planifica
+        # ShopifyGraphQLPlugin._graphql con su propio cubo de coste
+        return None if api_path == GRAPHQL_PATH else self.call_scheduler
+
+    def _scheduled_retry_delay(self, scheduler: ShopifyCallScheduler, response, attempt: int) -> float or None:
+        """
+        Reintentos de las llamadas planificadas (el transporte no reintenta estados HTTP para ellas).
+
+        Un 429 pausa la cola de la tienda (la espera la aplica el siguiente acquire) y un 5xx espera
+        con backoff; cada reintento vuelve a pedir turno. Devuelve la espera previa o None si no se reintenta.
+        """
+        if attempt > SHOPIFY_THROTTLE_RETRIES:
+            return None
+        if response.status_code == HttpTransport.THROTTLED_STATUS:
+            pause = scheduler.throttle(response.headers)
+            if DEBUG_MODE:
+                print(f"   {Colors.yellow('AVISO')} 429 de Shopify, cola de '{scheduler.shop}' en pausa {pause:.1f}s")
+            return 0.0
+        if response.status_code in HttpTransport.RETRY_STATUSES:
+            delay = _retry_after_seconds(response.headers) or self.transport.backoff_factor * (2 ** attempt)
+            if DEBUG_MODE:
+                print(f"   {Colors.yellow('AVISO')} {response.status_code} del Gateway, reintentando en {delay:.1f}s")
+            return delay
+        return None
+
+    def _make_api_call(self, method: str, api_path: str, payload: dict = None) -> dict:
+        """Función centralizada para hacer TODAS las llamadas a través de WSO2."""
+        data, _headers = self._make_api_request(method, api_path, payload)
+        return data
+
+    def _make_api_request(self, method: str, api_path: str, payload: dict = None):
+        """Como _make_api_call pero devuelve también las cabeceras de la respuesta: (data, headers)."""
+        
+        # Paso 1: Preparar la petición
+        full_url = self._build_api_url(api_path)
+        if method.upper() not in ('GET', 'PUT', 'POST'):
+            return {"error": f"Método {method} no implementado."}, {}
+
+        # Paso 2: Realizar la petición en su turno (reintentando con token nuevo ante 401 y tras la pausa ante 429)
+        scheduler = self._scheduler_for(api_path)
+        try:
+            for attempt in range(SHOPIFY_THROTTLE_RETRIES + 2):
+                wso2_token = self._get_wso2_access_token()
+                if not wso2_token:
+                    return {"error": "Fallo al obtener token de WSO2."}, {}
+
+                headers = self._build_api_headers(wso2_token, method)
+                if scheduler:
+                    PROFILER.observe("shopify_queue", scheduler.acquire())
+                with PROFILER.span(f"shopify_{method.lower()}"):
+                    # Con planificador los reintentos (429 y 5xx) se hacen aquí, pidiendo turno otra vez
+                    response = self.transport.request(method.upper(), full_url, headers=headers, json=payload,
+                                                      retry=scheduler is None)
+
+                if response.status_code == 401 and attempt == 0:
+                    if DEBUG_MODE:
+                        print(f"   {Colors.yellow('AVISO')} 401 del Gateway, renovando token y reintentando...")
+                    self.token_manager.invalidate(wso2_token)
+                    continue
+                if scheduler:
+                    delay = self._scheduled_retry_delay(scheduler, response, attempt)
+                    if delay is not None:
+                        response.close()
+                        time.sleep(delay)
+                        continue
+                    scheduler.observe(response.headers)
+                break
+            
+            # Paso 3: Devolver el resultado
+            return self._parse_gateway_response(response.status_code, response.content, response.headers), response.headers
+                
+        except requests.exceptions.RequestException as e:
+            print(f"   {Colors.red('ERROR')} Error de conexión: {str(e)}")
+            return {"error": "Excepción de conexión", "detail": str(e)}, {}
+        except Exception as e:
+            print(f"   {Colors.red('ERROR')} Error inesperado: {str(e)}")
+            return {"error": "Error inesperado", "detail": str(e)}, {}
+
+    @staticmethod
+    def _next_page_info(headers) -> str or None:
+        """Extrae el cursor page_info del enlace rel="next" de la cabecera Link de Shopify."""
+        link_header = headers.get("Link") or headers.get("link") or ""
+        for part in link_header.split(","):
+            match = _NEXT_LINK_RE.search(part)
+            if match:
+                return parse_qs(urlsplit(match.group(1)).query).get("page_info", [None])[0]
+        return None
+
+    def _products_page_path(self, fields: str, page_info: str = None, updated_at_min: str = None) -> str:
+        # Con page_info Shopify solo admite limit y fields (el resto de filtros van en el cursor)
+        path = f"/products.json?limit={PRODUCT_PAGE_LIMIT}&fields={fields}"
+        if page_info:
+            path += f"&page_info={page_info}"
+        elif updated_at_min:
+            path += f"&updated_at_min={quote(updated_at_min)}"
+        return path
+
+    def _iter_api_products(self, fields: str, updated_at_min: str = None):
+        """Recorre las páginas de /products.json directamente contra la API (sin caché)."""
+        page_info = None
+        while True:
+            data, headers = self._make_api_request("GET", self._products_page_path(fields, page_info, updated_at_min))
+            if "products" not in data:
+                raise ShopifyAPIError(data)
+            yield from data["products"]
+            page_info = self._next_page_info(headers)
+            if not page_info:
+                return
+
+    def _iter_products(self, fields: str = LIST_FIELDS, refresh: bool = False):
+        """Genera TODOS los productos de la tienda siguiendo los cursores de paginación.
+
+        Si el catálogo completo está en caché se sirve de ahí; si no (o con `refresh`), se descarga
+        y se cachea. Lanza ShopifyAPIError si alguna página falla."""
+        cached = None if refresh else self.catalog_cache.full_catalog(fields)
+        if cached is not None:
+            if DEBUG_MODE:
+                print(f"   Catálogo servido desde caché ({len(cached)} productos)")
+            yield from cached
+            return
+
+        product_ids = []
+        for product in self._iter_api_products(fields):
+            self.catalog_cache.put(product, fields)
+            product_ids.append(product["id"])
+            yield product
+        # Solo si se ha recorrido entero queda marcado como catálogo completo
+        self.catalog_cache.mark_full_catalog(product_ids, fields)
+        self._save_snapshot(fields)
+
+    # --------------------------------------------
+    # Snapshot en disco: arranque con sincronización incremental
+    # --------------------------------------------
+
+    def _save_snapshot(self, fields: str):
+        """Persiste el catálogo completo recién descargado (si hay snapshot configurado)."""
+        if not self.catalog_snapshot:
+            return
+        products = self.catalog_cache.full_catalog(fields)
+        if products is not None:
+            self.catalog_snapshot.replace_all(products, fields)
+
+    def _restore_snapshot(self):
+        """Carga el snapshot en la caché. Devuelve (ids, campos, marca de agua) o None."""
+        if not self.catalog_snapshot or not self.catalog_cache.enabled:
+            return None
+        loaded = self.catalog_snapshot.load()
+        if not loaded:
+            return None
+        products, fields, watermark = loaded
+        for product in products:
+            self.catalog_cache.put(product, fields)
+        return [p["id"] for p in products], fields, watermark
+
+    def _apply_snapshot_delta(self, product_ids: list, fields: str, changed: list, count_data: dict) -> str:
+        """Fusiona los productos modificados y marca el catálogo como completo si cuadra el conteo."""
+        known = set(product_ids)
+        for product in changed:
+            self.catalog_cache.put(product, fields)
+            if product["id"] not in known:
+                known.add(product["id"])
+        if changed:
+            self.catalog_snapshot.upsert(changed, fields)
+        # Shopify ordena /products.json por ID por defecto
+        ordered_ids = sorted(known, key=int)
+
+        # Las bajas no aparecen en el delta: si el conteo no cuadra, el primer listado hará un recorrido completo
+        if count_data.get("count") == len(ordered_ids):
+            self.catalog_cache.mark_full_catalog(ordered_ids, fields)
+            return f"Snapshot del catálogo sincronizado: {len(ordered_ids)} productos ({len(changed)} cambios desde la última sesión)."
+        return (f"Snapshot cargado con {len(ordered_ids)} productos, pero la tienda tiene {count_data.get('count', '?')}: "
+                "se hará una descarga completa en la primera consulta.")
+
+    def sync_catalog_snapshot(self) -> str or None:
+        """Arranque en caliente: carga el snapshot y trae solo los productos cambiados desde la marca de agua."""
+        restored = self._restore_snapshot()
+        if not restored:
+            return None
+        product_ids, fields, watermark = restored
+        try:
+            changed = list(self._iter_api_products(fields, updated_at_min=watermark))
+        except ShopifyAPIError as e:
+            return f"No se pudo sincronizar el snapshot: {e.data.get('error', 'Desconocida')}"
+        count_data = self._count_data()
+        return self._apply_snapshot_delta(product_ids, fields, changed, count_data)
+
+    def _search_with_index(self, product_name: str) -> dict or None:
+        """Busca en el índice si hay un catálogo completo con campos de búsqueda en caché; si no, None."""
+        generation = self.catalog_cache.full_catalog_generation(SEARCH_FIELDS)
+        if generation is None:
+            return None
+        if self.search_index.generation != generation:
+            products = self.catalog_cache.full_catalog(SEARCH_FIELDS)
+            if products is None:
+                return None
+            self.search_index.sync(products, generation)
+        return self.search_index.search(product_name)
+
+    def _count_data(self) -> dict:
+        """GET /products/count.json: {"count": N} o un dict con "error"."""
+        return self._make_api_call("GET", "/products/count.json")
+
+    def _fetch_product(self, product_id: str) -> dict:
+        """GET /products/{id}.json directamente contra la API (guarda el resultado en caché)."""
+        data = self._make_api_call("GET", f"/products/{product_id}.json")
+        if "product" in data:
+            self.catalog_cache.put(data["product"])
+        return data
+
+    def _fetch_variant(self, product_id: str, variant_id) -> dict:
+        """GET /variants/{id}.json con solo los campos que necesita la comprobación optimista."""
+        return self._make_api_call("GET", f"/variants/{variant_id}.json?fields={VARIANT_CHECK_FIELDS}")
+
+    def _write_variant_price(self, product_id: str, variant_id, new_price: str) -> dict:
+        """PUT /variants/{id}.json solo con el precio. Devuelve {"variant": {...}} o un dict con "error"."""
+        payload = self._variant_payload(variant_id, new_price)
+        if DEBUG_MODE:
+            print(f"   Payload enviado: {payload}")
+        return self._make_api_call("PUT", f"/variants/{variant_id}.json", payload=payload)
+
+    def _load_price_target(self, product_id: str):
+        """Lee el producto una sola vez para cambiar su precio. Devuelve (datos, viene_de_caché)."""
+        cached = self.catalog_cache.get(product_id, PRODUCT_FIELDS)
+        if cached is not None:
+            return {"product": cached}, True
+        return self._fetch_product(product_id), False
+
+    def _apply_price_update(self, product_id: str, new_price: str, remember_old: bool = True,
+                            target: tuple = None, derived: bool = False) -> ShopifyResult:
+        """
+        Cambia el precio con una lectura y una escritura.
+
+        `target` reutiliza la lectura que ya hizo el llamante. Si el producto venía de la caché se
+        relee solo la variante y se compara su updated_at (concurrencia optimista); con `derived`
+        (el precio nuevo se calculó a partir del anterior) un cambio concurrente aborta la operación.
+        """
+        current_data, from_cache = target or self._load_price_target(product_id)
+        variant_id, error = self._build_price_payload(product_id, current_data)
+        if error:
+            return error
+        variant = current_data["product"]["variants"][0]
+        if from_cache:
+            variant, error = self._check_variant_conflict(product_id, variant, self._fetch_variant(product_id, variant_id), derived)
+            if error:
+                return error
+        old_price = variant.get("price", "0")
+        if DEBUG_MODE:
+            print(f"   Precio actual: ${old_price}")
+        data = self._write_variant_price(product_id, variant_id, new_price)
+        return self._evaluate_variant_update(data, product_id, new_price, old_price, remember_old)
+
+    def _parse_gateway_response(self, status_code: int, content: bytes, headers) -> dict:
+        """Convierte la respuesta del Gateway en dict, diagnosticando los errores conocidos."""
+        # Si la respuesta es exitosa pero no tiene contenido (ej. 204), devolvemos un JSON vacío
+        if 200 <= status_code < 300:
+            # Verificar si la respuesta es JSON válido
+            try:
+                if content:
+                    return json.loads(content)
+                else:
+                    return {}
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                # Si no es JSON, puede ser HTML (redirección)
+                if "text/html" in headers.get("content-type", ""):
+                    print("    El Gateway devuelve HTML en lugar de JSON")
+                    print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Posible redirección o página de error")
+                    print("   SOLUCIÓN: Verifica la configuración del endpoint en WSO2")
+                    return {"error": "Gateway devuelve HTML", "detail": "La respuesta no es JSON válido"}
+                else:
+                    return {"error": "Respuesta no válida", "detail": "No se pudo procesar la respuesta"}
+
+        # Mostrar el error específico que devuelve el gateway
+        error_detail = content.decode("utf-8", errors="replace") if content else ""
+        print(f"   {Colors.red('ERROR')} Error del Gateway: {status_code}")
+        print(f"   Error details: {error_detail}")
+        
+        # Interpretar el error específico
+        if status_code == 401:
+            if "Invalid API key or access token" in error_detail:
+                print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: El token de Shopify es inválido o ha expirado")
+                print(f"   SOLUCIÓN: Verifica {self.shop.token_variable} en el archivo .env")
+            elif "unrecognized login or wrong password" in error_detail:
+                print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Credenciales de Shopify incorrectas")
+                print(f"   SOLUCIÓN: Verifica {self.shop.token_variable} en el archivo .env")
+            else:
+                print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Error de autenticación en el Gateway")
+                print("   SOLUCIÓN: Verifica la configuración de WSO2")
+        elif status_code == 403:
+            print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Acceso denegado - posible problema de suscripción")
+            print("   SOLUCIÓN: Verifica que la aplicación esté suscrita a la API en WSO2")
+        elif status_code == 404:
+            print(f"   {Colors.yellow('DEBUG')} DIAGNÓSTICO: Recurso no encontrado")
+            print("   SOLUCIÓN: Verifica la URL del Gateway y el contexto de la API")
+        
+        return {"error": f"Error del Gateway: {status_code}", "detail": error_detail}
+
+    # --------------------------------------------
+    # Lógica común (sin E/S) compartida por las variantes síncrona y asíncrona
+    # --------------------------------------------
+
+    def _format_fetch_error(self, data: dict) -> ShopifyResult:
+        return ShopifyResult(False, f"No se pudieron obtener los productos. Razón: {data.get('error', 'Desconocida')} - {data.get('detail', '')}",
+                             data={"error": data.get('error'), "detail": data.get('detail')})
+
+    @staticmethod
+    def _list_row(product: dict) -> tuple:
+        """Fila (ID, título, precio) de un listado"""
+        return (product['id'], product['title'], _product_price(product))
+
+    @staticmethod
+    def _listing_result(header: str, rows: list) -> ShopifyResult:
+        """Listado de filas (ID, título, precio): texto para mostrar + productos en `data`"""
+        # CORRECCIÓN APLICADA: Ahora incluye el ID del producto
+        product_info = [f"- ID: {product_id} - {title} - ${price}" for product_id, title, price in rows]
+        return ShopifyResult(True, header + "\n" + "\n".join(product_info),
+                             data={"total": len(rows), "products": [{"id": product_id, "title": title, "price": price}
+                                                                    for product_id, title, price in rows]})
+
+    def _format_products_list(self, rows: list) -> ShopifyResult:
+        return self._listing_result(f"Productos encontrados ({len(rows)} total):", rows)
+
+    @staticmethod
+    def _sort_row(product: dict) -> tuple:
+        """Fila compacta (precio numérico, ID, título, precio) para ordenar sin retener el producto."""
+        price_str = _product_price(product)
+        try:
+            price_num = float(price_str) if price_str != 'N/A' else 0
+        except (ValueError, TypeError):
+            price_num = 0
+        return (price_num, product['id'], product['title'], price_str)
+
+    def _format_products_sorted(self, rows: list, order: str) -> ShopifyResult:
+        # Ordenar por precio (sort estable: a igual precio se respeta el orden de Shopify)
+        if order.lower() in ['asc', 'ascending', 'menor', 'low']:
+            rows.sort(key=lambda row: row[0])
+            order_desc = "de menor a mayor precio"
+        else:
+            rows.sort(key=lambda row: row[0], reverse=True)
+            order_desc = "de mayor a menor precio"
+        
+        # Formatear la salida
+        return self._listing_result(f"Productos encontrados ({len(rows)} total) ordenados {order_desc}:",
+                                    [row[1:] for row in rows])
+
+    def _format_count(self, data: dict) -> ShopifyResult:
+        if "count" in data:
+            return ShopifyResult(True, f"La tienda tiene {data['count']} productos en total.", data={"count": data['count']})
+        return ShopifyResult(False, f"No se pudo obtener el conteo. Razón: {data.get('error', 'Desconocida')} - {data.get('detail', '')}",
+                             data={"error": data.get('error'), "detail": data.get('detail')})
+
+    @staticmethod
+    def _format_overview(count: ShopifyResult, listing: ShopifyResult) -> ShopifyResult:
+        return ShopifyResult(count.ok and listing.ok, f"{count.message}\n{listing.message}", data={**count.data, **listing.data})
+
+    @staticmethod
+    def _current_price(current_data: dict) -> Decimal or None:
+        """Precio de la primera variante como Decimal (None si no hay variantes o no es numérico)."""
+        variants = (current_data.get("product") or {}).get("variants")
+        if not variants:
+            return None
+        try:
+            return Decimal(str(variants[0].get("price", "0")))
+        except InvalidOperation:
+            return None
+
+    def _compute_math_price(self, current_price: Decimal, operation: str, value):
+        """Calcula el nuevo precio con la misma aritmética Decimal que la actualización masiva.
+        Devuelve (nuevo_precio, texto_operación) o (None, ShopifyResult de error)."""
+        try:
+            new_price = compute_bulk_prices([current_price], operation, value)[0]
+        except ValueError as e:
+            return None, ShopifyResult.error(str(e))
+        except InvalidOperation:
+            return None, ShopifyResult.error(f"Valor no numérico para la operación: {value}")
+        return new_price, describe_price_operation(operation, value)
+
+    @staticmethod
+    def _format_math_result(result: ShopifyResult, product_name: str, current_price: Decimal, new_price: Decimal,
+                            operation_text: str) -> ShopifyResult:
+        if not result.ok:
+            return result
+        return ShopifyResult.success(f"Operación exitosa: '{product_name}' actualizado de ${current_price} a ${new_price} ({operation_text})",
+                                     **result.data, product_name=product_name)
+
+    def _build_price_payload(self, product_id: str, current_data: dict):
+        """Extrae el variant ID del producto. Devuelve (variant_id, None) o (None, ShopifyResult de error)."""
+        if "product" not in current_data:
+            return None, ShopifyResult.error(f"Error: No se pudo obtener información del producto ID {product_id}", product_id=product_id)
+        
+        variants = current_data["product"].get("variants", [])
+        if not variants:
+            return None, ShopifyResult.error(f"Error: El producto ID {product_id} no tiene variantes", product_id=product_id)
+        
+        variant_id = variants[0]["id"]  # Usar el ID de la variante
+        if DEBUG_MODE:
+            print(f"   Variant ID: {variant_id}")
+        return variant_id, None
+
+    def _check_variant_conflict(self, product_id: str, known: dict, data: dict, derived: bool):
+        """
+        Compara la variante cacheada con la recién leída. Devuelve (variante vigente, None) o (None, ShopifyResult).
+
+        Si cambió en Shopify se actualiza la caché; para precios derivados del anterior es un conflicto.
+        """
+        fresh = data.get("variant") if data else None
+        if not fresh:
+            return None, ShopifyResult.error(f"Error: No se pudo verificar el precio actual del producto ID {product_id}: "
+                                             f"{data.get('error', 'Desconocida')} - {data.get('detail', '')}", product_id=product_id)
+        if known.get("updated_at") and fresh.get("updated_at"):
+            changed = known["updated_at"] != fresh["updated_at"]
+        else:
+            changed = str(known.get("price")) != str(fresh.get("price"))
+        if not changed:
+            return {**known, **fresh}, None
+
+        self.catalog_cache.apply_variant(product_id, fresh)
+        if derived:
+            return None, ShopifyResult.warning(f"Conflicto: el producto ID {product_id} cambió en Shopify desde la última lectura "
+                                               f"(precio actual ${fresh.get('price')}). No se aplicó el cambio; repite la operación para calcularlo sobre el precio actual.",
+                                               product_id=product_id, current_price=fresh.get('price'))
+        if DEBUG_MODE:
+            print(f"   {Colors.yellow('AVISO')} El precio cambió en Shopify (ahora ${fresh.get('price')}), se toma como precio anterior")
+        return {**known, **fresh}, None
+
+    def _evaluate_variant_update(self, data: dict, product_id: str, new_price: str, old_price: str, remember_old: bool) -> ShopifyResult:
+        """Verifica la respuesta de la escritura ({"variant": {...}}), hace write-through y guarda el cambio en memoria."""
+        if DEBUG_MODE:
+            print(f"   Respuesta completa: {data}")
+
+        variant = data.get("variant") if data else None
+        if not variant:
+            return ShopifyResult.error(f"Error en la actualización. Respuesta: {data.get('error', 'Desconocida')} - {data.get('detail', 'Sin detalles')}",
+                                       product_id=product_id)
+        updated_price = variant.get("price")
+        if not updated_price:
+            return ShopifyResult(False, f"Respuesta sin confirmación de precio: {data}", data={"product_id": product_id})
+        if DEBUG_MODE:
+            print(f"   {Colors.green('OK')} Precio confirmado en respuesta: ${updated_price}")
+
+        try:
+            # Shopify guarda céntimos: se compara lo enviado redondeado igual que compute_bulk_prices
+            confirmed = Decimal(str(updated_price)) == Decimal(str(new_price)).quantize(CENT, rounding=ROUND_HALF_UP)
+        except InvalidOperation:
+            confirmed = str(updated_price) == str(new_price)
+        if not confirmed:
+            return ShopifyResult.warning(f"Actualización parcial: Se envió ${new_price} pero la respuesta muestra ${updated_price}",
+                                         product_id=product_id, old_price=old_price, new_price=updated_price)
+
+        # Write-through: la respuesta es la variante actualizada
+        self.catalog_cache.apply_variant(product_id, variant)
+        if old_price and remember_old:
+            cached = self.catalog_cache.get(product_id)
+            self.price_history.remember_price_change(product_id, old_price, new_price, title=cached and cached.get('title'),
+                                                     variant_id=variant.get('id'))
+        return ShopifyResult.success(f"Éxito confirmado: El precio del producto ID {product_id} se ha actualizado de ${old_price} a ${updated_price}.",
+                                     product_id=product_id, old_price=old_price, new_price=updated_price)
+
+    # --------------------------------------------
+    # Actualización masiva (lógica común)
+    # --------------------------------------------
+
+    @staticmethod
+    def _matches_bulk_filter(product: dict, filter_text: str, filter_field: str) -> bool:
+        """Filtro de selección: 'tag', 'product_type', 'vendor' (exactos) o 'any' (título/tags/tipo)."""
+        needle = filter_text.lower().strip()
+        if filter_field == 'tag':
+            return needle in [t.strip().lower() for t in (product.get('tags') or '').split(',')]
+        if filter_field in ('product_type', 'vendor'):
+            return (product.get(filter_field) or '').lower() == needle
+        if needle in ('', 'products', 'productos', 'items', 'artículos'):
+            return True  # "todos los productos"
+        haystack = f"{product.get('title') or ''} {product.get('tags') or ''} {product.get('product_type') or ''}".lower()
+        # Plural sencillo ("snowboards" → "snowboard")
+        stem = needle[:-1] if needle.endswith('s') and len(needle) > 3 else needle
+        return needle in haystack or stem in haystack
+
+    def _plan_bulk_update(self, products: list, operation: str, value: float):
+        """Calcula todos los precios nuevos de una pasada. Devuelve la lista de items o un ShopifyResult de error."""
+        items, prices = [], []
+        batch_id = uuid.uuid4().hex[:8]  # Lote del historial: permite revertir la actualización completa
+        for product in products:
+            variant = (product.get('variants') or [None])[0]
+            if not variant:
+                continue
+            item = {'product_id': str(product['id']), 'title': product['title'], 'variant_id': variant['id'],
+                    'old_price': variant.get('price'), 'new_price': None, 'status': 'pendiente', 'batch_id': batch_id}
+            try:
+                prices.append(Decimal(str(variant.get('price'))))
+            except InvalidOperation:
+                item['status'] = 'error: precio actual no numérico'
+                prices.append(None)
+            items.append(item)
+
+        valid = [(item, price) for item, price in zip(items, prices) if price is not None]
+        try:
+            new_prices = compute_bulk_prices([price for _, price in valid], operation, value)
+        except ValueError as e:
+            return ShopifyResult.error(str(e))
+        for (item, _), new_price in zip(valid, new_prices):
+            if new_price < 0:
+                item['status'] = 'error: el precio resultante sería negativo'
+            else:
+                item['new_price'] = str(new_price)
+        return items
+
+    @staticmethod
+    def _variant_payload(variant_id, new_price: str) -> dict:
+        return {"variant": {"id": variant_id, "price": new_price}}
+
+    def _finish_bulk_item(self, item: dict, data: dict):
+        """Verifica la respuesta del PUT de la variante, hace write-through y guarda el historial."""
+        variant = data.get("variant") if isinstance(data, dict) else None
+        try:
+            confirmed = variant is not None and Decimal(str(variant.get("price"))) == Decimal(item['new_price'])
+        except InvalidOperation:
+            confirmed = False
+        if confirmed:
+            item['status'] = 'OK'
+            self.catalog_cache.apply_variant(item['product_id'], variant)
+            if item.get('reverts'):
+                self.price_history.record_revert(item['reverts'])
+            else:
+                self.price_history.remember_price_change(item['product_id'], item['old_price'], item['new_price'],
+                                                         batch_id=item['batch_id'], title=item['title'],
+                                                         variant_id=item['variant_id'])
+        elif variant is not None:
+            item['status'] = f"aviso: la respuesta muestra ${variant.get('price')}"
+        else:
+            item['status'] = f"error: {data.get('error', 'Desconocido')} {data.get('detail', '')}".strip()
+
+    def _format_bulk_result(self, items: list, filter_text: str, filter_field: str, operation: str, value) -> ShopifyResult:
+        if not items:
+            return ShopifyResult.warning(f"Ningún producto coincide con el filtro '{filter_text}' ({filter_field}).")
+        ok = sum(1 for item in items if item['status'] == 'OK')
+        header = (f"Actualización masiva ({describe_price_operation(operation, value)}) sobre '{filter_text}' ({filter_field}): "
+                  f"{len(items)} productos, {ok} actualizados, {len(items) - ok} con error.")
+        if ok:
+            header += f" Lote {items[0]['batch_id']} (se puede revertir completo)."
+        return self._bulk_result(header, items, ok)
+
+    @staticmethod
+    def _bulk_result(header: str, items: list, ok: int) -> ShopifyResult:
+        """Tabla por producto; `ok` solo si se confirmaron todas las filas"""
+        rows = ["ID | Producto | Precio anterior | Precio nuevo | Estado"]
+        rows += [f"{item['product_id']} | {item['title']} | ${item['old_price']} | "
+                 f"{'$' + item['new_price'] if item['new_price'] else '-'} | {item['status']}" for item in items]
+        fields = ('product_id', 'title', 'old_price', 'new_price', 'status')
+        return ShopifyResult(ok == len(items), header + "\n" + "\n".join(rows),
+                             data={"batch_id": items[0]['batch_id'], "updated": ok, "failed": len(items) - ok,
+                                   "items": [{key: item[key] for key in fields} for item in items]})
+
+    # --------------------------------------------
+    # Historial de precios: deshacer y consultas (lógica común)
+    # --------------------------------------------
+
+    def _finish_revert(self, change: dict, result: ShopifyResult) -> ShopifyResult:
+        """Registra el deshacer si la escritura se confirmó y devuelve el resultado final"""
+        if not result.ok:
+            return result
+        self.price_history.record_revert(change)
+        message = f"Precio restaurado: ID {change['product_id']} vuelve a costar ${change['old_price']}"
+        remaining = self.price_history.undo_depth(change['product_id'])
+        if remaining:
+            message += f" (quedan {remaining} cambios anteriores que se pueden deshacer)"
+        return ShopifyResult(True, message, data={"product_id": change['product_id'], "price": change['old_price'],
+                                                  "undo_remaining": remaining})
+
+    def _plan_batch_revert(self, batch_id: str):
+        """Items para deshacer un lote (el último si no se indica). Devuelve (batch_id, items) o (None, ShopifyResult)."""
+        batch_id = (batch_id or "").strip().lower() or self.price_history.last_batch_id()
+        if not batch_id:
+            return None, ShopifyResult.error("No hay actualizaciones masivas pendientes de revertir en el historial")
+        changes = self.price_history.batch_changes(batch_id)
+        if not changes:
+            return None, ShopifyResult.warning(f"El lote {batch_id} no tiene cambios pendientes de revertir", batch_id=batch_id)
+        items = [{'product_id': change['product_id'], 'title': change['title'] or '-', 'variant_id': change['variant_id'],
+                  'old_price': change['new_price'], 'new_price': change['old_price'], 'status': 'pendiente',
+                  'batch_id': batch_id, 'reverts': change} for change in changes]
+        return batch_id, items
+
+    def _format_batch_revert(self, batch_id: str, items: list) -> ShopifyResult:
+        ok = sum(1 for item in items if item['status'] == 'OK')
+        header = f"Lote {batch_id} revertido: {len(items)} productos, {ok} restaurados, {len(items) - ok} con error."
+        return self._bulk_result(header, items, ok)
+
+    def _format_price_changes(self, period: str = "today") -> ShopifyResult:
+        """Cambios de precio de hoy, de ayer o de los últimos 7 días ('today' | 'yesterday' | 'week')"""
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        since, until, label = {
+            'yesterday': (midnight - 86400, midnight, "de ayer"),
+            'week': (time.time() - 7 * 86400, None, "de los últimos 7 días"),
+        }.get(period, (midnight, None, "de hoy"))
+        changes = self.price_history.changes_since(since, until)
+        if not changes:
+            return ShopifyResult(True, f"No hay cambios de precio {label}.", data={"period": period, "changes": []})
+        rows = ["Fecha | ID | Producto | Precio anterior | Precio nuevo | Lote"]
+        rows += [f"{datetime.fromtimestamp(change['changed_at']).strftime('%d/%m %H:%M')} | {change['product_id']} | "
+                 f"{change['title'] or '-'} | ${change['old_price']} | ${change['new_price']}"
+                 f"{' (deshacer)' if change['reverts'] else ''} | {change['batch_id'] or '-'}" for change in changes]
+        return ShopifyResult(True, f"Cambios de precio {label}: {len(changes)}\n" + "\n".join(rows),
+                             data={"period": period, "changes": changes})
+
+    # --------------------------------------------
+    # Funciones expuestas al kernel
+    # --------------------------------------------
+
+    @kernel_function(name="get_products_list", description="Obtiene la lista de productos con sus IDs.")  # <<< SEMANTIC KERNEL
+    def get_products_list(self) -> ShopifyResult:
+        if DEBUG_MODE:
+            print("\n[EJECUTANDO] → get_products_list()")
+        try:
+            rows = [self._list_row(p) for p in self._iter_products(LIST_FIELDS)]
+        except ShopifyAPIError as e:
+            return self._format_fetch_error(e.data)
+        return self._format_products_list(rows)
+
+    @kernel_function(name="get_products_sorted", description="Obtiene productos ordenados por precio.")  # <<< SEMANTIC KERNEL
+    def get_products_sorted(self, order: str = "desc") -> ShopifyResult:
+        """
+        Obtiene productos ordenados por precio
+        order: 'asc' para menor a mayor, 'desc' para mayor a menor
+        """
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → get_products_sorted(order={order})")
+        try:
+            rows = [self._sort_row(p) for p in self._iter_products(LIST_FIELDS)]
+        except ShopifyAPIError as e:
+            return self._format_fetch_error(e.data)
+        return self._format_products_sorted(rows, order)
+
+    @kernel_function(name="count_products", description="Cuenta el total de productos.")  # <<< SEMANTIC KERNEL
+    def count_products(self) -> ShopifyResult:
+        if DEBUG_MODE:
+            print("\n[EJECUTANDO] → count_products()")
+        return self._format_count(self._count_data())
+
+    @kernel_function(name="get_store_overview", description="Obtiene el conteo total y la lista de productos.")  # <<< SEMANTIC KERNEL
+    def get_store_overview(self) -> ShopifyResult:
+        if DEBUG_MODE:
+            print("\n[EJECUTANDO] → get_store_overview()")
+        return self._format_overview(self.count_products(), self.get_products_list())
+
+    @kernel_function(name="update_product_price", description="Actualiza el precio de un producto dado su ID.")  # <<< SEMANTIC KERNEL
+    def update_product_price(self, product_id: str, new_price: str, remember_old: bool = True) -> ShopifyResult:
+        """Actualiza el precio de un producto dado su ID."""
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → update_product_price() para ID {product_id} a ${new_price}")
+        return self._apply_price_update(product_id, new_price, remember_old)
+
+    @kernel_function(name="find_product_by_name", description="Busca un producto por su nombre y devuelve su ID.")  # <<< SEMANTIC KERNEL
+    def find_product_by_name(self, product_name: str) -> dict:
+        """Busca un producto por nombre, descripción o etiquetas con tolerancia a errores."""
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → find_product_by_name() buscando '{product_name}'")
+        indexed = self._search_with_index(product_name)
+        if indexed is not None:
+            return indexed
+        matcher = ProductMatcher(product_name)
+        try:
+            for product in self._iter_products(SEARCH_FIELDS):
+                if matcher.feed(product):
+                    break
+        except ShopifyAPIError:
+            return {'found': False, 'error': 'Producto no encontrado'}
+        return matcher.result()
+
+    @kernel_function(name="update_product_price_with_math", description="Actualiza el precio de un producto aplicando una operación matemática.")  # <<< SEMANTIC KERNEL
+    def update_product_price_with_math(self, product_identifier: str, operation: str, value: float, is_id: bool = True) -> ShopifyResult:
+        """Actualiza el precio de un producto aplicando una operación matemática (sumar, restar)"""
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → update_product_price_with_math() {operation} {value} a producto {product_identifier}")
+        
+        # Obtener información del producto (esta lectura se reutiliza para la actualización)
+        if is_id:
+            product_id = product_identifier
+            target = self._load_price_target(product_id)
+            current_data = target[0]
+            if "product" not in current_data:
+                return ShopifyResult.error(f"Error: No se pudo obtener información del producto ID {product_id}", product_id=product_id)
+            product_name = current_data["product"]["title"]
+        else:
+            # Buscar por nombre
+            search_result = self.find_product_by_name(product_identifier)
+            if not search_result['found']:
+                return ShopifyResult.error(f"No se encontró el producto '{product_identifier}'")
+            product_id = search_result['id']
+            product_name = search_result['name']
+            target = self._load_price_target(product_id)
+            current_data = target[0]
         
+        # Obtener precio actual
+        current_price = self._current_price(current_data)
+        if current_price is None:
+            return ShopifyResult.error("No se pudo obtener el precio actual del producto", product_id=product_id)
         if DEBUG_MODE:
-            print(f"   Payload enviado: {payload}")
+            print(f"   Precio actual de '{product_name}': ${current_price}")
+        
+        # Calcular nuevo precio
+        new_price, operation_text = self._compute_math_price(current_price, operation, value)
+        if new_price is None:
+            return operation_text
         
-        # PASO 3: Realizar la actualización
         if DEBUG_MODE:
-            print("   Enviando actualización...")
-        data = self._make_api_call("PUT", f"/products/{product_id}.json", payload=payload)
+            print(f"   Calculando: ${current_price} {operation_text} = ${new_price}")
         
+        # Actualizar con el nuevo precio calculado (ya redondeado a céntimos)
+        result = self._apply_price_update(product_id, str(new_price), target=target, derived=True)
+        return self._format_math_result(result, product_name, current_price, new_price, operation_text)
+
+    @kernel_function(name="update_product_price_by_name", description="Actualiza el precio de un producto usando su nombre.")  # <<< SEMANTIC KERNEL
+    def update_product_price_by_name(self, product_name: str, new_price: str) -> ShopifyResult:
+        """Actualiza el precio de un producto buscándolo por nombre"""
         if DEBUG_MODE:
-            print(f"   Respuesta completa: {data}")
+            print(f"\n[EJECUTANDO] → update_product_price_by_name() para '{product_name}' a ${new_price}")
         
-        # PASO 4: Verificar el resultado
-        if data and "product" in data:
-            # Verificar si realmente se actualizó
-            updated_variants = data["product"].get("variants", [])
-            if updated_variants and updated_variants[0].get("price"):
-                updated_price = updated_variants[0]["price"]
-                if DEBUG_MODE:
-                    print(f"   {Colors.green('OK')} Precio confirmado en respuesta: ${updated_price}")
-                
-                # Comparar valores numéricos en lugar de strings para evitar problemas con decimales
-                try:
-                    updated_price_num = float(updated_price)
-                    new_price_num = float(new_price)
-                    
-                    if abs(updated_price_num - new_price_num) < 0.01:  # Tolerancia para decimales
-                        # PASO 5: Guardar en memoria el cambio
-                        if old_price and remember_old:
-                            self.price_memory.remember_price_change(product_id, old_price, new_price)
-                        
-                        return f"{Colors.green('OK')} Éxito confirmado: El precio del producto ID {product_id} se ha actualizado de ${old_price} a ${updated_price}."
-                    else:
-                        return f"{Colors.yellow('AVISO')} Actualización parcial: Se envió ${new_price} pero la respuesta muestra ${updated_price}"
-                except ValueError:
-                    # Si no se pueden convertir a números, usar comparación de strings como fallback
-                    if str(updated_price) == str(new_price):
-                        if old_price and remember_old:
-                            self.price_memory.remember_price_change(product_id, old_price, new_price)
-                        return f"{Colors.green('OK')} Éxito confirmado: El precio del producto ID {product_id} se ha actualizado de ${old_price} a ${updated_price}."
-                    else:
-                        return f"{Colors.yellow('AVISO')} Actualización parcial: Se envió ${new_price} pero la respuesta muestra ${updated_price}"
+        # Buscar el producto por nombre
+        search_result = self.find_product_by_name(product_name)
+        if not search_result['found']:
+            return ShopifyResult.error(f"No se encontró el producto '{product_name}'. Verifica el nombre o usa el ID del producto.")
+        
+        self._log_name_match(search_result)
+        result = self.update_product_price(search_result['id'], new_price)
+        return self._annotate_name_match(result, search_result, product_name)
+
+    def _log_name_match(self, search_result: dict):
+        if DEBUG_MODE:
+            if search_result.get('suggestion'):
+                print(f"   {Colors.yellow('SUGGESTION')} Using similar product: {search_result['name']} (ID: {search_result['id']}) - Similarity: {search_result.get('similarity', 0):.1%}")
             else:
-                return f" Respuesta sin confirmación de precio: {data}"
+                print(f"   {Colors.green('OK')} Producto encontrado: {search_result['name']} (ID: {search_result['id']})")
+
+    def _annotate_name_match(self, result: ShopifyResult, search_result: dict, product_name: str) -> ShopifyResult:
+        # Si es una sugerencia (producto similar), agregar información sobre la sugerencia al resultado
+        if search_result.get('suggestion') and result.ok and DEBUG_MODE:
+            result.notes.append(f"Used '{search_result['name']}' (similarity {search_result.get('similarity', 0):.1%}) instead of '{product_name}'")
+        return result
+
+    @kernel_function(name="revert_price", description="Restaura el precio anterior de un producto.")  # <<< SEMANTIC KERNEL
+    def revert_price(self, product_id: str) -> ShopifyResult:
+        """Restaura el precio anterior de un producto"""
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → revert_price() para ID {product_id}")
+        
+        change = self.price_history.latest_change(product_id)
+        if not change:
+            return ShopifyResult.error(f"No hay historial de precios para el producto ID {product_id}", product_id=product_id)
+        
+        # Usar la función de actualización pero sin registrar un cambio nuevo: se registra como deshacer
+        result = self.update_product_price(product_id, change['old_price'], remember_old=False)
+        return self._finish_revert(change, result)
+
+    @kernel_function(name="revert_batch", description="Revierte una actualización masiva completa (la última si no se indica el lote).")  # <<< SEMANTIC KERNEL
+    def revert_batch(self, batch_id: str = "") -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → revert_batch() lote '{batch_id or 'último'}'")
+        batch_id, items = self._plan_batch_revert(batch_id)
+        if batch_id is None:
+            return items
+        self._execute_bulk_updates(items)
+        return self._format_batch_revert(batch_id, items)
+
+    @kernel_function(name="get_price_changes", description="Lista los cambios de precio de hoy ('today'), de ayer ('yesterday') o de los últimos 7 días ('week').")  # <<< SEMANTIC KERNEL
+    def get_price_changes(self, period: str = "today") -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → get_price_changes({period})")
+        return self._format_price_changes(period)
+
+    @kernel_function(name="bulk_update_prices", description="Actualiza en bloque el precio de los productos que cumplen un filtro (texto, tag, product_type o vendor) aplicando una operación matemática.")  # <<< SEMANTIC KERNEL
+    def bulk_update_prices(self, filter_text: str, operation: str, value: float, filter_field: str = "any") -> ShopifyResult:
+        """Reprecia todos los productos seleccionados con un pool acotado de hilos y ritmo según Shopify.
+
+        La selección se lee siempre de Shopify (no de la caché): los PUT son ciegos, así que los
+        precios nuevos y el precio anterior del historial deben partir del precio vigente."""
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → bulk_update_prices() {operation} {value} sobre '{filter_text}' ({filter_field})")
+        try:
+            selected = [p for p in self._iter_products(SEARCH_FIELDS, refresh=True) if self._matches_bulk_filter(p, filter_text, filter_field)]
+        except ShopifyAPIError as e:
+            return self._format_fetch_error(e.data)
+
+        items = self._plan_bulk_update(selected, operation, value)
+        if isinstance(items, ShopifyResult):
+            return items
+        self._execute_bulk_updates([item for item in items if item['status'] == 'pendiente'])
+        return self._format_bulk_result(items, filter_text, filter_field, operation, value)
+
+    def _execute_bulk_updates(self, pending: list):
+        """Envía un PUT por variante con un pool acotado de hilos (el planificador marca el ritmo)."""
+
+        def update_item(item: dict):
+            data = self._make_api_call("PUT", f"/variants/{item['variant_id']}.json",
+                                       payload=self._variant_payload(item['variant_id'], item['new_price']))
+            self._finish_bulk_item(item, data)
+
+        with ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS) as pool:
+            list(pool.map(update_item, pending))
+
+# ============================================
+# PLUGIN DE SHOPIFY ASÍNCRONO (AIOHTTP)
+# ============================================
+
+class AsyncShopifyPlugin(ShopifyPlugin):
+    """
+    Variante asíncrona de ShopifyPlugin: expone las mismas funciones del kernel como corrutinas
+    sobre AsyncHttpTransport, de modo que la E/S no bloquea el event loop y las llamadas
+    independientes (p.ej. conteo + listado) se ejecutan en paralelo.
+    """
+
+    def __init__(self, token_manager: WSO2TokenManager = None, transport: HttpTransport = None,
+                 catalog_cache: CatalogCache = None, catalog_snapshot: CatalogSnapshot = None,
+                 price_history: PriceHistory = None, async_transport: AsyncHttpTransport = None,
+                 call_scheduler: ShopifyCallScheduler = None, shop: ShopConfig = None):
+        super().__init__(token_manager=token_manager, transport=transport, catalog_cache=catalog_cache,
+                         catalog_snapshot=catalog_snapshot, price_history=price_history, call_scheduler=call_scheduler,
+                         shop=shop)
+        self.async_transport = async_transport or get_async_http_transport()
+
+    async def aclose(self):
+        """Cierra la sesión aiohttp y el resto de recursos de la tienda (llamar al terminar el programa)."""
+        await self.async_transport.close()
+        self.close()
+
+    async def _make_api_call_async(self, method: str, api_path: str, payload: dict = None) -> dict:
+        """Versión asíncrona de _make_api_call: mismo contrato y mismos diagnósticos."""
+        data, _headers = await self._make_api_request_async(method, api_path, payload)
+        return data
+
+    async def _make_api_request_async(self, method: str, api_path: str, payload: dict = None):
+        full_url = self._build_api_url(api_path)
+        if method.upper() not in ('GET', 'PUT', 'POST'):
+            return {"error": f"Método {method} no implementado."}, {}
+
+        scheduler = self._scheduler_for(api_path)
+        try:
+            for attempt in range(SHOPIFY_THROTTLE_RETRIES + 2):
+                wso2_token = await self.token_manager.get_token_async()
+                if not wso2_token:
+                    return {"error": "Fallo al obtener token de WSO2."}, {}
+
+                headers = self._build_api_headers(wso2_token, method)
+                if scheduler:
+                    PROFILER.observe("shopify_queue", await scheduler.acquire_async())
+                with PROFILER.span(f"shopify_{method.lower()}"):
+                    response = await self.async_transport.request(method.upper(), full_url, headers=headers, json=payload,
+                                                                  retry=scheduler is None)
+
+                if response.status_code == 401 and attempt == 0:
+                    if DEBUG_MODE:
+                        print(f"   {Colors.yellow('AVISO')} 401 del Gateway, renovando token y reintentando...")
+                    self.token_manager.invalidate(wso2_token)
+                    continue
+                if scheduler:
+                    delay = self._scheduled_retry_delay(scheduler, response, attempt)
+                    if delay is not None:
+                        await asyncio.sleep(delay)
+                        continue
+                    scheduler.observe(response.headers)
+                break
+
+            return self._parse_gateway_response(response.status_code, response.content, response.headers), response.headers
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"   {Colors.red('ERROR')} Error de conexión: {str(e) or type(e).__name__}")
+            return {"error": "Excepción de conexión", "detail": str(e) or type(e).__name__}, {}
+        except Exception as e:
+            print(f"   {Colors.red('ERROR')} Error inesperado: {str(e)}")
+            return {"error": "Error inesperado", "detail": str(e)}, {}
+
+    async def _aiter_products(self, fields: str = LIST_FIELDS, refresh: bool = False):
+        """Versión asíncrona de _iter_products (generador asíncrono)."""
+        cached = None if refresh else self.catalog_cache.full_catalog(fields)
+        if cached is not None:
+            if DEBUG_MODE:
+                print(f"   Catálogo servido desde caché ({len(cached)} productos)")
+            for product in cached:
+                yield product
+            return
+
+        product_ids = []
+        async for product in self._aiter_api_products(fields):
+            self.catalog_cache.put(product, fields)
+            product_ids.append(product["id"])
+            yield product
+        self.catalog_cache.mark_full_catalog(product_ids, fields)
+        if self.catalog_snapshot:
+            await asyncio.to_thread(self._save_snapshot, fields)
+
+    async def _aiter_api_products(self, fields: str, updated_at_min: str = None):
+        """Versión asíncrona de _iter_api_products."""
+        page_info = None
+        while True:
+            data, headers = await self._make_api_request_async("GET", self._products_page_path(fields, page_info, updated_at_min))
+            if "products" not in data:
+                raise ShopifyAPIError(data)
+            for product in data["products"]:
+                yield product
+            page_info = self._next_page_info(headers)
+            if not page_info:
+                return
+
+    async def sync_catalog_snapshot_async(self) -> str or None:
+        """Versión asíncrona de sync_catalog_snapshot: delta y conteo se piden en paralelo."""
+        restored = await asyncio.to_thread(self._restore_snapshot)
+        if not restored:
+            return None
+        product_ids, fields, watermark = restored
+
+        async def fetch_changed():
+            return [p async for p in self._aiter_api_products(fields, updated_at_min=watermark)]
+
+        try:
+            changed, count_data = await asyncio.gather(fetch_changed(), self._make_api_call_async("GET", "/products/count.json"))
+        except ShopifyAPIError as e:
+            return f"No se pudo sincronizar el snapshot: {e.data.get('error', 'Desconocida')}"
+        return await asyncio.to_thread(self._apply_snapshot_delta, product_ids, fields, changed, count_data)
+
+    async def _afetch_product(self, product_id: str) -> dict:
+        data = await self._make_api_call_async("GET", f"/products/{product_id}.json")
+        if "product" in data:
+            self.catalog_cache.put(data["product"])
+        return data
+
+    async def _aload_price_target(self, product_id: str):
+        """Versión asíncrona de _load_price_target."""
+        cached = self.catalog_cache.get(product_id, PRODUCT_FIELDS)
+        if cached is not None:
+            return {"product": cached}, True
+        return await self._afetch_product(product_id), False
+
+    async def _apply_price_update_async(self, product_id: str, new_price: str, remember_old: bool = True,
+                                        target: tuple = None, derived: bool = False) -> ShopifyResult:
+        """Versión asíncrona de _apply_price_update: una lectura y un PUT de la variante."""
+        current_data, from_cache = target or await self._aload_price_target(product_id)
+        variant_id, error = self._build_price_payload(product_id, current_data)
+        if error:
+            return error
+        variant = current_data["product"]["variants"][0]
+        if from_cache:
+            fresh = await self._make_api_call_async("GET", f"/variants/{variant_id}.json?fields={VARIANT_CHECK_FIELDS}")
+            variant, error = self._check_variant_conflict(product_id, variant, fresh, derived)
+            if error:
+                return error
+        old_price = variant.get("price", "0")
+        if DEBUG_MODE:
+            print(f"   Precio actual: ${old_price}")
+        data = await self._make_api_call_async("PUT", f"/variants/{variant_id}.json",
+                                               payload=self._variant_payload(variant_id, new_price))
+        return self._evaluate_variant_update(data, product_id, new_price, old_price, remember_old)
+
+    @kernel_function(name="get_products_list", description="Obtiene la lista de productos con sus IDs.")  # <<< SEMANTIC KERNEL
+    async def get_products_list(self) -> ShopifyResult:
+        if DEBUG_MODE:
+            print("\n[EJECUTANDO] → get_products_list()")
+        try:
+            rows = [self._list_row(p) async for p in self._aiter_products(LIST_FIELDS)]
+        except ShopifyAPIError as e:
+            return self._format_fetch_error(e.data)
+        return self._format_products_list(rows)
+
+    @kernel_function(name="get_products_sorted", description="Obtiene productos ordenados por precio.")  # <<< SEMANTIC KERNEL
+    async def get_products_sorted(self, order: str = "desc") -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → get_products_sorted(order={order})")
+        try:
+            rows = [self._sort_row(p) async for p in self._aiter_products(LIST_FIELDS)]
+        except ShopifyAPIError as e:
+            return self._format_fetch_error(e.data)
+        return self._format_products_sorted(rows, order)
+
+    @kernel_function(name="count_products", description="Cuenta el total de productos.")  # <<< SEMANTIC KERNEL
+    async def count_products(self) -> ShopifyResult:
+        if DEBUG_MODE:
+            print("\n[EJECUTANDO] → count_products()")
+        data = await self._make_api_call_async("GET", "/products/count.json")
+        return self._format_count(data)
+
+    @kernel_function(name="get_store_overview", description="Obtiene el conteo total y la lista de productos.")  # <<< SEMANTIC KERNEL
+    async def get_store_overview(self) -> ShopifyResult:
+        if DEBUG_MODE:
+            print("\n[EJECUTANDO] → get_store_overview()")
+        # Conteo y listado son independientes: se lanzan en paralelo
+        count, listing = await asyncio.gather(self.count_products(), self.get_products_list())
+        return self._format_overview(count, listing)
+
+    @kernel_function(name="update_product_price", description="Actualiza el precio de un producto dado su ID.")  # <<< SEMANTIC KERNEL
+    async def update_product_price(self, product_id: str, new_price: str, remember_old: bool = True) -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → update_product_price() para ID {product_id} a ${new_price}")
+        return await self._apply_price_update_async(product_id, new_price, remember_old)
+
+    @kernel_function(name="find_product_by_name", description="Busca un producto por su nombre y devuelve su ID.")  # <<< SEMANTIC KERNEL
+    async def find_product_by_name(self, product_name: str) -> dict:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → find_product_by_name() buscando '{product_name}'")
+        indexed = self._search_with_index(product_name)
+        if indexed is not None:
+            return indexed
+        matcher = ProductMatcher(product_name)
+        try:
+            async for product in self._aiter_products(SEARCH_FIELDS):
+                if matcher.feed(product):
+                    break
+        except ShopifyAPIError:
+            return {'found': False, 'error': 'Producto no encontrado'}
+        return matcher.result()
+
+    @kernel_function(name="update_product_price_with_math", description="Actualiza el precio de un producto aplicando una operación matemática.")  # <<< SEMANTIC KERNEL
+    async def update_product_price_with_math(self, product_identifier: str, operation: str, value: float, is_id: bool = True) -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → update_product_price_with_math() {operation} {value} a producto {product_identifier}")
+
+        if is_id:
+            product_id = product_identifier
+            target = await self._aload_price_target(product_id)
+            current_data = target[0]
+            if "product" not in current_data:
+                return ShopifyResult.error(f"Error: No se pudo obtener información del producto ID {product_id}", product_id=product_id)
+            product_name = current_data["product"]["title"]
         else:
-            return f"{Colors.red('ERROR')} Error en la actualización. Respuesta: {data.get('error', 'Desconocida')} - {data.get('detail', 'Sin detalles')}"
+            search_result = await self.find_product_by_name(product_identifier)
+            if not search_result['found']:
+                return ShopifyResult.error(f"No se encontró el producto '{product_identifier}'")
+            product_id = search_result['id']
+            product_name = search_result['name']
+            target = await self._aload_price_target(product_id)
+            current_data = target[0]
+
+        current_price = self._current_price(current_data)
+        if current_price is None:
+            return ShopifyResult.error("No se pudo obtener el precio actual del producto", product_id=product_id)
+
+        new_price, operation_text = self._compute_math_price(current_price, operation, value)
+        if new_price is None:
+            return operation_text
+        if DEBUG_MODE:
+            print(f"   Calculando: ${current_price} {operation_text} = ${new_price}")
+
+        result = await self._apply_price_update_async(product_id, str(new_price), target=target, derived=True)
+        return self._format_math_result(result, product_name, current_price, new_price, operation_text)
+
+    @kernel_function(name="update_product_price_by_name", description="Actualiza el precio de un producto usando su nombre.")  # <<< SEMANTIC KERNEL
+    async def update_product_price_by_name(self, product_name: str, new_price: str) -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → update_product_price_by_name() para '{product_name}' a ${new_price}")
+
+        search_result = await self.find_product_by_name(product_name)
+        if not search_result['found']:
+            return ShopifyResult.error(f"No se encontró el producto '{product_name}'. Verifica el nombre o usa el ID del producto.")
+
+        self._log_name_match(search_result)
+        result = await self.update_product_price(search_result['id'], new_price)
+        return self._annotate_name_match(result, search_result, product_name)
+
+    @kernel_function(name="revert_price", description="Restaura el precio anterior de un producto.")  # <<< SEMANTIC KERNEL
+    async def revert_price(self, product_id: str) -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → revert_price() para ID {product_id}")
+
+        change = self.price_history.latest_change(product_id)
+        if not change:
+            return ShopifyResult.error(f"No hay historial de precios para el producto ID {product_id}", product_id=product_id)
+
+        result = await self.update_product_price(product_id, change['old_price'], remember_old=False)
+        return self._finish_revert(change, result)
+
+    @kernel_function(name="revert_batch", description="Revierte una actualización masiva completa (la última si no se indica el lote).")  # <<< SEMANTIC KERNEL
+    async def revert_batch(self, batch_id: str = "") -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → revert_batch() lote '{batch_id or 'último'}'")
+        batch_id, items = self._plan_batch_revert(batch_id)
+        if batch_id is None:
+            return items
+        await self._execute_bulk_updates_async(items)
+        return self._format_batch_revert(batch_id, items)
+
+    @kernel_function(name="get_price_changes", description="Lista los cambios de precio de hoy ('today'), de ayer ('yesterday') o de los últimos 7 días ('week').")  # <<< SEMANTIC KERNEL
+    async def get_price_changes(self, period: str = "today") -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → get_price_changes({period})")
+        return self._format_price_changes(period)
+
+    @kernel_function(name="bulk_update_prices", description="Actualiza en bloque el precio de los productos que cumplen un filtro (texto, tag, product_type o vendor) aplicando una operación matemática.")  # <<< SEMANTIC KERNEL
+    async def bulk_update_prices(self, filter_text: str, operation: str, value: float, filter_field: str = "any") -> ShopifyResult:
+        if DEBUG_MODE:
+            print(f"\n[EJECUTANDO] → bulk_update_prices() {operation} {value} sobre '{filter_text}' ({filter_field})")
+        try:
+            selected = [p async for p in self._aiter_products(SEARCH_FIELDS, refresh=True) if self._matches_bulk_filter(p, filter_text, filter_field)]
+        except ShopifyAPIError as e:
+            return self._format_fetch_error(e.data)
+
+        items = self._plan_bulk_update(selected, operation, value)
+        if isinstance(items, ShopifyResult):
+            return items
+        await self._execute_bulk_updates_async([item for item in items if item['status'] == 'pendiente'])
+        return self._format_bulk_result(items, filter_text, filter_field, operation, value)
+
+    async def _execute_bulk_updates_async(self, pending: list):
+        """Un PUT por variante con como mucho BULK_MAX_WORKERS en vuelo (el planificador marca el ritmo)."""
+        semaphore = asyncio.Semaphore(BULK_MAX_WORKERS)
+
+        async def update_item(item: dict):
+            async with semaphore:
+                data = await self._make_api_call_async("PUT", f"/variants/{item['variant_id']}.json",
+                                                       payload=self._variant_payload(item['variant_id'], item['new_price']))
+                self._finish_bulk_item(item, data)
+
+        await asyncio.gather(*(update_item(item) for item in pending))
+
+# ============================================
+# PLUGIN DE SHOPIFY GRAPHQL (ADMIN API)
+# ============================================
+
+GRAPHQL_PATH = "/graphql.json"  # Misma ruta del Gateway de WSO2 que la API REST
+# Exportación masiva para el catálogo completo: Shopify la genera en segundo plano (segundos o minutos
+# y una a la vez por tienda), así que solo compensa en catálogos grandes; por defecto se pagina
+GRAPHQL_BULK_EXPORT = os.getenv("GRAPHQL_BULK_EXPORT", "false").lower() not in ("0", "false", "no")
+GRAPHQL_BULK_TIMEOUT = float(os.getenv("GRAPHQL_BULK_TIMEOUT", "300"))  # Segundos máximos esperando una exportación
+GRAPHQL_MUTATION_BATCH = int(os.getenv("GRAPHQL_MUTATION_BATCH", "25"))  # Mutaciones (con alias) por petición
+GRAPHQL_COST_LIMIT = 1000        # Puntos del cubo de coste (plan estándar; cada respuesta trae el real en throttleStatus)
+GRAPHQL_RESTORE_RATE = 50        # Puntos/s que recupera el cubo
+GRAPHQL_DEFAULT_QUERY_COST = 10  # Coste que se reserva para una consulta hasta conocer su requestedQueryCost
+
+# Campos REST (proyección `fields=`) → campo GraphQL equivalente
+_GRAPHQL_PRODUCT_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "body_html": "descriptionHtml",
+    "tags": "tags",
+    "product_type": "productType",
+    "vendor": "vendor",
+    "updated_at": "updatedAt",
+}
+_GRAPHQL_VARIANT_FIELDS = "id price updatedAt"
+
+_GRAPHQL_BULK_RUN = """
+mutation($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}"""
+
+_GRAPHQL_BULK_STATUS = """
+query($id: ID!) {
+  node(id: $id) { ... on BulkOperation { id status errorCode objectCount url } }
+}"""
+
+
+def get_graphql_scheduler(shop: str = "default") -> ShopifyCallScheduler:
+    """Cubo de coste GraphQL compartido de la tienda (registrado como '<tienda>:graphql' junto a los REST)."""
+    key = f"{shop}:graphql"
+    with _shared_transport_lock:
+        scheduler = _call_schedulers.get(key)
+        if scheduler is None:
+            scheduler = _call_schedulers[key] = ShopifyCallScheduler(key, limit=GRAPHQL_COST_LIMIT,
+                                                                     leak_rate=GRAPHQL_RESTORE_RATE, headroom=0)
+        return scheduler
+
+
+def _graphql_throttled(data: dict) -> bool:
+    """True si Shopify rechazó la consulta por falta de puntos (errors[].extensions.code == THROTTLED)"""
+    errors = data.get("errors")
+    return isinstance(errors, list) and any(
+        isinstance(e, dict) and (e.get("extensions") or {}).get("code") == "THROTTLED" for e in errors)
+
+
+def _gid_to_id(gid) -> int:
+    """'gid://shopify/Product/123' → 123"""
+    return int(str(gid).rsplit("/", 1)[-1])
+
+
+def _graphql_selection(fields: str, variants_first: int = None) -> str:
+    """Selección GraphQL de un Product equivalente a la proyección REST `fields`."""
+    requested = [f.strip() for f in fields.split(",")]
+    parts = ["id"] + [_GRAPHQL_PRODUCT_FIELDS[f] for f in requested if f in _GRAPHQL_PRODUCT_FIELDS and f != "id"]
+    if "variants" in requested:
+        arguments = f"(first: {variants_first})" if variants_first else ""
+        parts.append(f"variants{arguments} {{ edges {{ node {{ {_GRAPHQL_VARIANT_FIELDS} }} }} }}")
+    return " ".join(parts)
+
+
+def _rest_variant(node: dict, product_id: int) -> dict:
+    variant = {"id": _gid_to_id(node["id"]), "product_id": product_id, "price": node.get("price")}
+    if "updatedAt" in node:
+        variant["updated_at"] = node["updatedAt"]
+    return variant
+
+
+def _rest_product(node: dict) -> dict:
+    """Convierte un nodo Product de GraphQL al formato REST que usa el resto del agente."""
+    product = {"id": _gid_to_id(node["id"])}
+    for rest_name, graphql_name in _GRAPHQL_PRODUCT_FIELDS.items():
+        if rest_name != "id" and graphql_name in node:
+            value = node[graphql_name]
+            product[rest_name] = ", ".join(value) if rest_name == "tags" else value
+    if "variants" in node:
+        product["variants"] = [_rest_variant(edge["node"], product["id"]) for edge in node["variants"]["edges"]]
+    return product
+
+
+class ShopifyGraphQLPlugin(ShopifyPlugin):
+    """
+    Variante de ShopifyPlugin sobre la Admin API GraphQL (misma ruta del Gateway de WSO2).
+
+    Pide solo los campos que necesita cada función, exporta el catálogo completo con
+    bulkOperationRunQuery (descarga JSONL en streaming) y agrupa los cambios de precio en
+    mutaciones productVariantsBulkUpdate. Los productos se devuelven en formato REST, así que
+    caché, índice y snapshot funcionan igual.
+
+    Cada consulta espera turno en el cubo de coste de la tienda (get_graphql_scheduler), que se
+    ajusta con `extensions.cost` de cada respuesta. Solo hay variante síncrona: en modo asíncrono y
+    en el servidor el agente ejecuta sus funciones en hilos (asyncio.to_thread).
+    """
+
+    def __init__(self, *args, cost_scheduler: ShopifyCallScheduler = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cost_scheduler = cost_scheduler or get_graphql_scheduler(self.shop.name)  # Ritmo según el coste de las consultas
+        self._query_costs = {}  # Documento GraphQL → último requestedQueryCost
+
+    def _graphql(self, query: str, variables: dict = None) -> dict:
+        """
+        POST /graphql.json en su turno del cubo de coste. Devuelve el bloque `data` o un dict con
+        "error" (incluye los `errors` de GraphQL).
+
+        Si Shopify responde THROTTLED, throttleStatus (currentlyAvailable/restoreRate) deja el cubo en
+        su nivel real y el reintento espera en acquire() hasta que haya puntos para la consulta.
+        """
+        payload = {"query": query, "variables": variables or {}}
+        for attempt in range(SHOPIFY_THROTTLE_RETRIES + 1):
+            cost = self._query_costs.get(query, GRAPHQL_DEFAULT_QUERY_COST)
+            PROFILER.observe("shopify_queue", self.cost_scheduler.acquire(cost))
+            data = self._make_api_call("POST", GRAPHQL_PATH, payload=payload)
+            throttled = _graphql_throttled(data)
+            query_cost = (data.get("extensions") or {}).get("cost") or {}
+            self.cost_scheduler.observe_cost(query_cost, cost, throttled)
+            if query_cost.get("requestedQueryCost"):
+                self._query_costs[query] = query_cost["requestedQueryCost"]
+            if not throttled or attempt == SHOPIFY_THROTTLE_RETRIES:
+                break
+            if DEBUG_MODE:
+                available = (query_cost.get("throttleStatus") or {}).get("currentlyAvailable")
+                print(f"   {Colors.yellow('AVISO')} GraphQL THROTTLED (disponibles {available}, coste {self._query_costs.get(query, cost)}), reintentando en su turno")
+        if "error" in data:
+            return data
+        if data.get("errors"):
+            messages = "; ".join(str(e.get("message", e)) if isinstance(e, dict) else str(e) for e in data["errors"])
+            return {"error": "Error GraphQL", "detail": messages}
+        return data.get("data") or {}
+
+    def _count_data(self) -> dict:
+        data = self._graphql("{ productsCount { count } }")
+        if "error" in data:
+            return data
+        return {"count": (data.get("productsCount") or {}).get("count")}
+
+    def _fetch_product(self, product_id: str) -> dict:
+        query = f"query($id: ID!) {{ product(id: $id) {{ {_graphql_selection(PRODUCT_FIELDS, variants_first=1)} }} }}"
+        data = self._graphql(query, {"id": f"gid://shopify/Product/{product_id}"})
+        if "error" in data:
+            return data
+        if not data.get("product"):
+            return {"error": "Producto no encontrado", "detail": f"ID {product_id}"}
+        product = _rest_product(data["product"])
+        self.catalog_cache.put(product, PRODUCT_FIELDS)
+        return {"product": product}
+
+    def _fetch_variant(self, product_id: str, variant_id) -> dict:
+        data = self._graphql(f"query($id: ID!) {{ productVariant(id: $id) {{ {_GRAPHQL_VARIANT_FIELDS} }} }}",
+                             {"id": f"gid://shopify/ProductVariant/{variant_id}"})
+        if "error" in data:
+            return data
+        if not data.get("productVariant"):
+            return {"error": "Variante no encontrada", "detail": f"ID {variant_id}"}
+        return {"variant": _rest_variant(data["productVariant"], int(product_id))}
+
+    def _write_variant_price(self, product_id: str, variant_id, new_price: str) -> dict:
+        return self._update_variant_prices([(product_id, variant_id, new_price)])[0]
+
+    # --------------------------------------------
+    # Lectura del catálogo: exportación masiva o páginas GraphQL
+    # --------------------------------------------
+
+    def _iter_api_products(self, fields: str, updated_at_min: str = None):
+        """Catálogo completo por exportación masiva; los deltas (o si falla la exportación) por páginas."""
+        if updated_at_min is None and GRAPHQL_BULK_EXPORT:
+            try:
+                url = self._run_bulk_export(fields)
+            except ShopifyAPIError as e:
+                if DEBUG_MODE:
+                    print(f"   {Colors.yellow('AVISO')} Exportación masiva no disponible ({e.data.get('detail') or e.data.get('error')}), paginando")
+            else:
+                if url:
+                    yield from self._iter_bulk_results(url)
+                return
+        yield from self._iter_graphql_pages(fields, updated_at_min)
+
+    def _iter_graphql_pages(self, fields: str, updated_at_min: str = None):
+        # Solo se lee la primera variante (el agente trabaja con un precio por producto)
+        query = (f"query($cursor: String, $filter: String) {{ products(first: {PRODUCT_PAGE_LIMIT}, after: $cursor, "
+                 f"query: $filter, sortKey: ID) {{ pageInfo {{ hasNextPage endCursor }} "
+                 f"edges {{ node {{ {_graphql_selection(fields, variants_first=1)} }} }} }} }}")
+        variables = {"cursor": None, "filter": f"updated_at:>='{updated_at_min}'" if updated_at_min else None}
+        while True:
+            data = self._graphql(query, variables)
+            if "error" in data or "products" not in data:
+                raise ShopifyAPIError(data if "error" in data else {"error": "Respuesta GraphQL sin productos"})
+            for edge in data["products"]["edges"]:
+                yield _rest_product(edge["node"])
+            page = data["products"]["pageInfo"]
+            if not page.get("hasNextPage"):
+                return
+            variables["cursor"] = page["endCursor"]
+
+    def _run_bulk_export(self, fields: str) -> str or None:
+        """Lanza bulkOperationRunQuery y espera a que termine. Devuelve la URL del JSONL (None si no hay productos)."""
+        bulk_query = f"{{ products(sortKey: ID) {{ edges {{ node {{ {_graphql_selection(fields)} }} }} }} }}"
+        data = self._graphql(_GRAPHQL_BULK_RUN, {"query": bulk_query})
+        if "error" in data:
+            raise ShopifyAPIError(data)
+        result = data.get("bulkOperationRunQuery") or {}
+        if result.get("userErrors"):
+            raise ShopifyAPIError({"error": "bulkOperationRunQuery", "detail": "; ".join(e["message"] for e in result["userErrors"])})
+        operation_id = result["bulkOperation"]["id"]
+        if DEBUG_MODE:
+            print(f"   Exportación masiva iniciada: {operation_id}")
+
+        # Sondeo con espera creciente hasta que Shopify genera el fichero
+        deadline = time.monotonic() + GRAPHQL_BULK_TIMEOUT
+        delay = 0.5
+        while True:
+            data = self._graphql(_GRAPHQL_BULK_STATUS, {"id": operation_id})
+            if "error" in data:
+                raise ShopifyAPIError(data)
+            operation = data.get("node") or {}
+            status = operation.get("status")
+            if status == "COMPLETED":
+                if DEBUG_MODE:
+                    print(f"   Exportación masiva completada: {operation.get('objectCount')} objetos")
+                return operation.get("url")
+            if status in ("FAILED", "CANCELED", "EXPIRED"):
+                raise ShopifyAPIError({"error": f"Exportación masiva {status}", "detail": operation.get("errorCode") or ""})
+            if time.monotonic() + delay > deadline:
+                raise ShopifyAPIError({"error": "Exportación masiva sin terminar", "detail": f"{GRAPHQL_BULK_TIMEOUT}s"})
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    def _iter_bulk_results(self, url: str):
+        """Descarga el JSONL en streaming. Las variantes llegan como líneas hijas (__parentId) tras su producto."""
+        # La URL firmada apunta al almacenamiento de Shopify, no al Gateway: sin cabeceras de autenticación
+        try:
+            with self.transport.request("GET", url, stream=True) as response:
+                if response.status_code != 200:
+                    raise ShopifyAPIError({"error": f"Descarga de la exportación: {response.status_code}", "detail": url})
+                current = None
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    node = json.loads(line)
+                    parent_id = node.pop("__parentId", None)
+                    if parent_id is None:
+                        if current is not None:
+                            yield current
+                        current = _rest_product(node)
+                        current.setdefault("variants", [])
+                    elif current is not None and _gid_to_id(parent_id) == current["id"]:
+                        current["variants"].append(_rest_variant(node, current["id"]))
+                if current is not None:
+                    yield current
+        except requests.exceptions.RequestException as e:
+            raise ShopifyAPIError({"error": "Excepción de conexión", "detail": str(e)})
+
+    # --------------------------------------------
+    # Escritura de precios: productVariantsBulkUpdate
+    # --------------------------------------------
+
+    @staticmethod
+    def _price_mutation(count: int) -> str:
+        """Documento con `count` mutaciones productVariantsBulkUpdate con alias (m0, m1...)."""
+        declarations = ", ".join(f"$p{i}: ID!, $v{i}: [ProductVariantsBulkInput!]!" for i in range(count))
+        mutations = " ".join(f"m{i}: productVariantsBulkUpdate(productId: $p{i}, variants: $v{i}) "
+                             f"{{ productVariants {{ {_GRAPHQL_VARIANT_FIELDS} }} userErrors {{ field message }} }}"
+                             for i in range(count))
+        return f"mutation({declarations}) {{ {mutations} }}"
+
+    def _update_variant_prices(self, updates: list) -> list:
+        """
+        Cambia precios de variantes agrupando hasta GRAPHQL_MUTATION_BATCH productos por petición.
+
+        `updates` es una lista de (product_id, variant_id, precio); devuelve, en el mismo orden,
+        {"variant": {...}} en formato REST o un dict con "error".
+        """
+        results = []
+        for start in range(0, len(updates), GRAPHQL_MUTATION_BATCH):
+            chunk = updates[start:start + GRAPHQL_MUTATION_BATCH]
+            variables = {}
+            for i, (product_id, variant_id, price) in enumerate(chunk):
+                variables[f"p{i}"] = f"gid://shopify/Product/{product_id}"
+                variables[f"v{i}"] = [{"id": f"gid://shopify/ProductVariant/{variant_id}", "price": str(price)}]
+            data = self._graphql(self._price_mutation(len(chunk)), variables)
+            for i, (product_id, _, _) in enumerate(chunk):
+                if "error" in data:
+                    results.append(data)
+                    continue
+                payload = data.get(f"m{i}") or {}
+                if payload.get("userErrors"):
+                    results.append({"error": "userErrors", "detail": "; ".join(e["message"] for e in payload["userErrors"])})
+                elif payload.get("productVariants"):
+                    results.append({"variant": _rest_variant(payload["productVariants"][0], int(product_id))})
+                else:
+                    results.append({"error": "Respuesta sin variantes", "detail": str(payload)})
+        return results
+
+    def _execute_bulk_updates(self, pending: list):
+        """Todas las variantes en GRAPHQL_MUTATION_BATCH productos por petición en lugar de un PUT por producto."""
+        results = self._update_variant_prices([(item['product_id'], item['variant_id'], item['new_price']) for item in pending])
+        for item, data in zip(pending, results):
+            self._finish_bulk_item(item, data)
+
+# ============================================
+# POLÍTICA DE RESPUESTA (LOCAL O LLM)
+# ============================================
+
+class ResponsePolicy:
+    """
+    Decide, por intención, si la respuesta se muestra localmente o se redacta con el LLM.
+
+    Los resultados de las funciones de Shopify ya vienen formateados (listados con ID, conteos,
+    confirmaciones de precio), así que para las intenciones deterministas reescribirlos con el
+    modelo solo añade latencia y tokens. Las preguntas abiertas ("¿cuál es el más caro?") y los
+    mensajes sin intención siguen yendo al LLM.
+    """
+
+    DETERMINISTIC_INTENTS = ('list', 'count', 'sort', 'update_price', 'revert', 'bulk_update', 'revert_batch', 'price_changes')
+
+    def __init__(self, local_intents=DETERMINISTIC_INTENTS):
+        self.local_intents = frozenset(local_intents)
+        self.llm_calls = Counter()       # Llamadas al LLM por intención ('free_form' = sin intención)
+        self.llm_avoided = Counter()     # Respuestas locales por intención
+
+    @classmethod
+    def parse(cls, spec: str) -> "ResponsePolicy":
+        """'auto' (todas las deterministas en local), 'always' (siempre LLM) o lista de intenciones: 'list,count'."""
+        spec = (spec or 'auto').strip().lower()
+        if spec == 'auto':
+            return cls()
+        if spec == 'always':
+            return cls(local_intents=())
+        intents = [name.strip() for name in spec.split(',') if name.strip()]
+        unknown = [name for name in intents if name not in cls.DETERMINISTIC_INTENTS]
+        if unknown:
+            raise ValueError(f"Intenciones desconocidas en la política LLM: {', '.join(unknown)} "
+                             f"(válidas: {', '.join(cls.DETERMINISTIC_INTENTS)})")
+        return cls(local_intents=intents)
+
+    def render_locally(self, function: str, user_input: str) -> bool:
+        if function not in self.local_intents:
+            return False
+        # Un listado en respuesta a una pregunta abierta necesita que el modelo razone sobre los datos
+        return not (function == 'list' and is_open_question(user_input))
+
+    def record(self, function: str, local: bool):
+        (self.llm_avoided if local else self.llm_calls)[function or 'free_form'] += 1
+
+    def summary(self) -> str:
+        avoided = sum(self.llm_avoided.values())
+        detail = ", ".join(f"{name}={count}" for name, count in self.llm_avoided.most_common())
+        return (f"Llamadas al LLM: {sum(self.llm_calls.values())} | evitadas: {avoided}"
+                + (f" ({detail})" if detail else ""))
+
+# ============================================
+# HISTORIAL DE CONVERSACIÓN ACOTADO
+# ============================================
+
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "20"))
+
+class ConversationHistory:
+    """
+    Últimos turnos de la conversación (pregunta + respuesta), como mucho max_turns.
+
+    Cada consulta al LLM es un único prompt construido con datos recién leídos de Shopify, así que el
+    historial no se envía al modelo: solo se conserva para el informe de depuración.
+    """
+
+    def __init__(self, system_message: str, max_turns: int = HISTORY_MAX_TURNS):
+        self.system_message = system_message
+        self.turns = deque(maxlen=max(1, max_turns))  # [(usuario, respuesta)]; los más antiguos salen solos
+        self.total = 0
+
+    def add_turn(self, user_input: str, reply: str):
+        self.turns.append((user_input, reply or ""))
+        self.total += 1
+
+    def stats(self) -> str:
+        return f"Historial: {len(self.turns)}/{self.turns.maxlen} turnos recientes ({self.total} en la sesión)"
+
+# ============================================
+# EMPAQUETADO DE LISTADOS PARA EL PROMPT
+# ============================================
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # Tokens máximos del listado dentro del prompt
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens (~4 caracteres por token), suficiente para presupuestar"""
+    return len(text) // 4 + 1 if text else 0
+
+def pack_product_listing(listing: ShopifyResult, token_budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    Convierte un listado de productos en una tabla compacta 'id|título|precio' para el prompt.
+
+    Las filas salen directamente de `data['products']` y se añaden en orden hasta agotar el
+    presupuesto de tokens; el resto se resume en una línea con el número de productos omitidos.
+    Los listados de varias tiendas añaden la columna 'tienda'. Un resultado sin productos (p.ej. un
+    error) se muestra tal cual.
+    """
+    products = listing.data.get('products')
+    if not products:
+        return listing.render()
+    with_shop = 'shop' in products[0]
+    packed = [listing.message.split("\n", 1)[0], "tienda|id|título|precio" if with_shop else "id|título|precio"]
+    used = sum(estimate_tokens(line) for line in packed)
+    for index, product in enumerate(products):
+        row = f"{product['id']}|{str(product['title']).replace('|', '/')}|{product['price']}"
+        if with_shop:
+            row = f"{product['shop']}|{row}"
+        used += estimate_tokens(row)
+        if used > token_budget:
+            packed.append(f"[... {len(products) - index} productos más omitidos por límite de tamaño; mostrados {index} de {len(products)}]")
+            break
+        packed.append(row)
+    return "\n".join(packed)
+
+# ============================================
+# CACHÉ DE RESPUESTAS DEL LLM
+# ============================================
 
-    @kernel_function(name="find_product_by_name", description="Busca un producto por su nombre y devuelve su ID.")  # <<< SEMANTIC KERNEL
-    def find_product_by_name(self, product_name: str) -> dict:
-        """Busca un producto por nombre, descripción o etiquetas con tolerancia a errores."""
-        if DEBUG_MODE:
-            print(f"\n[EJECUTANDO] → find_product_by_name() buscando '{product_name}'")
-        data = self._make_api_call("GET", "/products.json")
-
-        if "products" in data:
-            products_data = data["products"]
-            query = product_name.lower().strip()
-
-            # Función auxiliar para texto buscable: título + descripción sin HTML + tags
-            import re as _re
-            def build_search_text(p: dict) -> str:
-                title = (p.get('title') or '').lower()
-                body = (p.get('body_html') or '')
-                body = _re.sub(r'<[^>]+>', ' ', body)  # strip HTML
-                body = body.lower()
-                tags = (p.get('tags') or '').lower()
-                return f"{title} {body} {tags}".strip()
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))  # 0 = solo coincidencia exacta
+RESPONSE_CACHE_CANDIDATES = 200  # Máximo de respuestas comparadas por similitud en cada consulta
 
-            # 1) Coincidencia exacta por título
-            for product in products_data:
-                if (product.get('title') or '').lower() == query:
-                    price = product.get('variants', [{}])[0].get('price', 'N/A')
-                    if DEBUG_MODE:
-                        print(f"   {Colors.green('OK')} Coincidencia exacta (título): {product['title']}")
-                    return {'found': True, 'id': str(product['id']), 'name': product['title'], 'price': price}
-
-            # 2) Coincidencia parcial en título/descripcion/tags
-            for product in products_data:
-                searchable = build_search_text(product)
-                if query in searchable:
-                    price = product.get('variants', [{}])[0].get('price', 'N/A')
-                    if DEBUG_MODE:
-                        print(f"   {Colors.green('OK')} Coincidencia parcial: {product['title']}")
-                    return {'found': True, 'id': str(product['id']), 'name': product['title'], 'price': price}
-
-            # 3) Similitud flexible (sobre título y texto combinado)
-            import difflib as _difflib
-            best_match = None
-            best_ratio = 0.55  # Umbral algo más permisivo
-            for product in products_data:
-                title = (product.get('title') or '').lower()
-                ratio_title = _difflib.SequenceMatcher(None, query, title).ratio()
-                if ratio_title > best_ratio:
-                    best_ratio = ratio_title
-                    best_match = product
-                    continue
-                # probar también sobre el texto combinado (capado a 256 chars)
-                combined = build_search_text(product)[:256]
-                ratio_combined = _difflib.SequenceMatcher(None, query, combined).ratio()
-                if ratio_combined > best_ratio:
-                    best_ratio = ratio_combined
-                    best_match = product
-
-            if best_match:
-                price = best_match.get('variants', [{}])[0].get('price', 'N/A')
-                if DEBUG_MODE:
-                    print(f"   {Colors.yellow('SUGERENCIA')} Similaridad {best_ratio:.0%}: {best_match['title']}")
-                return {
-                    'found': True,
-                    'id': str(best_match['id']),
-                    'name': best_match['title'],
-                    'price': price,
-                    'similarity': best_ratio,
-                    'suggestion': True
-                }
-
-            # 4) No encontrado: sugerir primeros productos para ayudar
-            if DEBUG_MODE:
-                print(f"   {Colors.red('ERROR')} No se encontró '{product_name}'")
-                print(f"   {Colors.yellow('SUGERENCIA')} Productos disponibles:")
-                for i, product in enumerate(products_data[:5]):
-                    print(f"     - {product.get('title','(sin título)')}")
-                if len(products_data) > 5:
-                    print(f"     ... y {len(products_data) - 5} productos más")
+def normalize_prompt(text: str) -> str:
+    """Normaliza mayúsculas, espacios y signos de puntuación de los extremos"""
+    return " ".join(text.casefold().split()).strip(" ?¿!¡.")
 
-        return {'found': False, 'error': 'Producto no encontrado'}
+def _cosine(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
 
-    @kernel_function(name="update_product_price_with_math", description="Actualiza el precio de un producto aplicando una operación matemática.")  # <<< SEMANTIC KERNEL
-    def update_product_price_with_math(self, product_identifier: str, operation: str, value: float, is_id: bool = True) -> str:
-        """Actualiza el precio de un producto aplicando una operación matemática (sumar, restar)"""
-        if DEBUG_MODE:
-            print(f"\n[EJECUTANDO] → update_product_price_with_math() {operation} {value} a producto {product_identifier}")
-        
-        # Obtener información del producto
-        if is_id:
-            product_id = product_identifier
-            current_data = self._make_api_call("GET", f"/products/{product_id}.json")
-            if "product" not in current_data:
-                return f"{Colors.red('ERROR')} Error: No se pudo obtener información del producto ID {product_id}"
-            product_name = current_data["product"]["title"]
-        else:
-            # Buscar por nombre
-            search_result = self.find_product_by_name(product_identifier)
-            if not search_result['found']:
-                return f"{Colors.red('ERROR')} No se encontró el producto '{product_identifier}'"
-            product_id = search_result['id']
-            product_name = search_result['name']
-            current_data = self._make_api_call("GET", f"/products/{product_id}.json")
-        
-        # Obtener precio actual
-        if "product" in current_data and current_data["product"].get("variants"):
-            current_price = float(current_data["product"]["variants"][0].get("price", "0"))
+class ResponseCache:
+    """
+    Caché en disco (SQLite) de las respuestas redactadas por el LLM.
+
+    La clave combina el contexto (intención + datos de Shopify incluidos en el prompt + versión
+    del catálogo) con la pregunta normalizada. Si el catálogo cambia, cambian los datos del
+    prompt y la clave deja de coincidir. Con `similarity` > 0 y un servicio de embeddings, una
+    pregunta casi idéntica con el mismo contexto reutiliza la respuesta guardada.
+    """
+
+    def __init__(self, path: str, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY, embedder=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity if embedder is not None else 0.0
+        self.embedder = embedder  # Servicio de embeddings de Semantic Kernel (opcional)
+        self.hits = Counter()     # 'exact' / 'similar'
+        self.misses = 0
+        self._last_embedding = None  # (pregunta normalizada, vector) para no repetir la llamada en put()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, context TEXT NOT NULL, "
+                           "embedding TEXT, response TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_context ON responses (context)")
+        self._conn.commit()
+
+    @staticmethod
+    def _hash(*parts) -> str:
+        return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def context_key(self, function: str, data: str, catalog_version) -> str:
+        return self._hash(function or "free_form", normalize_prompt(data or ""), catalog_version)
+
+    async def _embed(self, question: str):
+        if self._last_embedding and self._last_embedding[0] == question:
+            return self._last_embedding[1]
+        try:
+            vector = [float(x) for x in (await self.embedder.generate_embeddings([question]))[0]]  # <<< SEMANTIC KERNEL
+        except Exception as e:
             if DEBUG_MODE:
-                print(f"   Precio actual de '{product_name}': ${current_price}")
-        else:
-            return f"{Colors.red('ERROR')} No se pudo obtener el precio actual del producto"
-        
-        # Calcular nuevo precio
-        if operation == 'add':
-            new_price = current_price + value
-            operation_text = f"añadiendo ${value}"
-        elif operation == 'subtract':
-            new_price = current_price - value
-            operation_text = f"restando ${value}"
-        elif operation == 'divide':
-            if value == 0:
-                return f"{Colors.red('ERROR')} División por cero"
-            new_price = current_price / value
-            operation_text = f"dividiendo entre {value}"
-        elif operation == 'multiply':
-            new_price = current_price * value
-            operation_text = f"multiplicando por {value}"
-        elif operation == 'percent_reduce':
-            new_price = current_price * (1 - (value / 100.0))
-            operation_text = f"reduciendo {value}%"
-        elif operation == 'percent_increase':
-            new_price = current_price * (1 + (value / 100.0))
-            operation_text = f"incrementando {value}%"
-        else:
-            return f"{Colors.red('ERROR')} Operación '{operation}' no soportada"
-        
-        if DEBUG_MODE:
-            print(f"   Calculando: ${current_price} {operation_text} = ${new_price}")
-        
-        # Actualizar con el nuevo precio calculado (formateado a 2 decimales)
-        formatted_price = f"{new_price:.2f}"
-        result = self.update_product_price(product_id, formatted_price)
-        
-        # Detectar éxito con los nuevos patrones
-        success_patterns = ["[OK] Éxito", "OK] Éxito", "Éxito confirmado", "se ha actualizado"]
-        if any(pattern in result for pattern in success_patterns):
-            return f"[32mOK[0m Operación exitosa: '{product_name}' actualizado de ${current_price} a ${new_price} ({operation_text})"
-        else:
-            return result
+                print(f"{Colors.yellow('AVISO')} Embeddings no disponibles para la caché: {e}")
+            return None
+        self._last_embedding = (question, vector)
+        return vector
 
-    @kernel_function(name="update_product_price_by_name", description="Actualiza el precio de un producto usando su nombre.")  # <<< SEMANTIC KERNEL
-    def update_product_price_by_name(self, product_name: str, new_price: str) -> str:
-        """Actualiza el precio de un producto buscándolo por nombre"""
-        if DEBUG_MODE:
-            print(f"\n[EJECUTANDO] → update_product_price_by_name() para '{product_name}' a ${new_price}")
-        
-        # Buscar el producto por nombre
-        search_result = self.find_product_by_name(product_name)
-        
-        if search_result['found']:
-            product_id = search_result['id']
-            product_title = search_result['name']
-            
-            # Si es una sugerencia (producto similar), informar al usuario
-            if search_result.get('suggestion'):
-                similarity = search_result.get('similarity', 0)
-                if DEBUG_MODE:
-                    print(f"   {Colors.yellow('SUGGESTION')} Using similar product: {product_title} (ID: {product_id}) - Similarity: {similarity:.1%}")
-                result = self.update_product_price(product_id, new_price)
-                # Agregar información sobre la sugerencia al resultado
-                success_patterns = ["[OK] Éxito", "OK] Éxito", "Éxito confirmado", "se ha actualizado"]
-                if any(pattern in result for pattern in success_patterns):
-                    if DEBUG_MODE:
-                        result += f"\n{Colors.yellow('NOTE')} Used '{product_title}' (similarity {similarity:.1%}) instead of '{product_name}'"
-                return result
-            else:
-                if DEBUG_MODE:
-                    print(f"   {Colors.green('OK')} Producto encontrado: {product_title} (ID: {product_id})")
-                return self.update_product_price(product_id, new_price)
-        else:
-            return f"{Colors.red('ERROR')} No se encontró el producto '{product_name}'. Verifica el nombre o usa el ID del producto."
+    async def get(self, context: str, question: str):
+        """Devuelve la respuesta guardada para la pregunta (o una casi idéntica) o None"""
+        question = normalize_prompt(question)
+        key = self._hash(context, question)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                                     (key, now - self.ttl)).fetchone()
+        if row:
+            self._touch(key, now)
+            self.hits['exact'] += 1
+            return row[0]
+        if self.similarity > 0:
+            vector = await self._embed(question)
+            if vector:
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT key, embedding, response FROM responses WHERE context = ? AND created_at >= ? "
+                        "AND embedding IS NOT NULL ORDER BY used_at DESC LIMIT ?",
+                        (context, now - self.ttl, RESPONSE_CACHE_CANDIDATES)).fetchall()
+                scored = [(_cosine(vector, json.loads(embedding)), row_key, response) for row_key, embedding, response in rows]
+                if scored:
+                    score, row_key, response = max(scored)
+                    if score >= self.similarity:
+                        self._touch(row_key, now)
+                        self.hits['similar'] += 1
+                        return response
+        self.misses += 1
+        return None
 
-    @kernel_function(name="revert_price", description="Restaura el precio anterior de un producto.")  # <<< SEMANTIC KERNEL
-    def revert_price(self, product_id: str) -> str:
-        """Restaura el precio anterior de un producto"""
-        if DEBUG_MODE:
-            print(f"\n[EJECUTANDO] → revert_price() para ID {product_id}")
-        
-        if not self.price_memory.has_history(product_id):
-            return f"{Colors.red('ERROR')} No hay historial de precios para el producto ID {product_id}"
-        
-        previous_price = self.price_memory.get_previous_price(product_id)
-        if previous_price:
-            # Usar la función de actualización pero sin recordar este cambio
-            result = self.update_product_price(product_id, previous_price, remember_old=False)
-            # Detectar éxito con los nuevos patrones
-            success_patterns = ["[OK] Éxito", "OK] Éxito", "Éxito confirmado", "se ha actualizado"]
-            if any(pattern in result for pattern in success_patterns):
-                return f"Precio restaurado: ID {product_id} vuelve a costar ${previous_price}"
-            else:
-                return result
-        return f"{Colors.red('ERROR')} No se pudo obtener el precio anterior para ID {product_id}"
+    async def put(self, context: str, question: str, response: str):
+        question = normalize_prompt(question)
+        vector = await self._embed(question) if self.similarity > 0 else None
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, context, embedding, response, created_at, used_at) "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               (self._hash(context, question), context, json.dumps(vector) if vector else None,
+                                response, now, now))
+            # Expulsión: primero lo caducado, después lo menos usado por encima del límite
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                               "ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def _touch(self, key: str, now: float):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+
+    def summary(self) -> str:
+        hits = sum(self.hits.values())
+        detail = ", ".join(f"{name}={count}" for name, count in self.hits.most_common())
+        return f"Caché de respuestas: {hits} aciertos" + (f" ({detail})" if detail else "") + f", {self.misses} fallos"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# ============================================
+# LATENCIA DE RESPUESTAS DEL LLM
+# ============================================
+
+class LLMLatencyStats:
+    """
+    Acumula la latencia percibida de cada respuesta del LLM.
+
+    - first_token: segundos hasta el primer fragmento visible (con streaming es lo que espera el usuario)
+    - total: segundos hasta recibir la respuesta completa
+    """
+
+    def __init__(self):
+        self.first_token = []
+        self.total = []
+
+    def record(self, first_token: float, total: float):
+        self.first_token.append(first_token)
+        self.total.append(total)
+
+    @staticmethod
+    def _format(samples) -> str:
+        ordered = sorted(samples)
+        median = ordered[len(ordered) // 2]
+        return f"mediana {median:.2f}s, máx {ordered[-1]:.2f}s"
+
+    def summary(self) -> str:
+        if not self.total:
+            return "Latencia LLM: sin respuestas"
+        return (f"Latencia LLM ({len(self.total)} respuestas): primer token {self._format(self.first_token)} | "
+                f"total {self._format(self.total)}")
 
 # ============================================
 # SISTEMA DE EJECUCIÓN MANUAL GARANTIZADA
 # ============================================
 
 class AgentWithManualExecution:
-    def __init__(self, kernel, shopify_plugin):  # <<< SEMANTIC KERNEL
+    def __init__(self, kernel, shopify_plugin, response_policy: ResponsePolicy = None, stream: bool = True,
+                 response_cache: ResponseCache = None, echo: bool = True, shops: ShopRegistry = None):  # <<< SEMANTIC KERNEL
         self.kernel = kernel  # <<< SEMANTIC KERNEL
-        self.shopify = shopify_plugin
-        self.chat_history = ChatHistory()  # <<< SEMANTIC KERNEL
+        self.shopify = shopify_plugin  # Plugin de la tienda por defecto
+        self.shops = shops  # Registro multitienda (None = solo la tienda del plugin)
+        self.response_policy = response_policy or ResponsePolicy()  # Qué intenciones se responden sin LLM
+        self.stream = stream  # Mostrar la respuesta del LLM a medida que llega
+        self.latency = LLMLatencyStats()
+        self.response_cache = response_cache  # Respuestas del LLM ya redactadas (None = sin caché)
+        self.echo = echo  # Mostrar las respuestas en consola (en modo servidor se entregan por on_chunk)
+        self.last_result = None  # ShopifyResult de la última consulta (serializable en los modos batch y servidor)
         
         # MEJORA 1: SYSTEM MESSAGE ANTI-ALUCINACIONES
         system_message = """You are a specialized Shopify store assistant. CRITICAL RULES:
@@ -696,340 +3545,219 @@ MANDATORY FORMAT:
 
 FORBIDDEN: Inventing information, confirming operations without real verification, using words like "probably" or "I think"."""
         
-        self.chat_history.add_system_message(system_message)  # <<< SEMANTIC KERNEL
+        self.history = ConversationHistory(system_message)  # Últimos turnos, para el informe de depuración
 
-    async def process_with_guaranteed_execution(self, user_input: str):
-        import re  # Importar re al principio del método
-        
+    async def _call_shopify(self, function, *args, **kwargs):
+        """Ejecuta una función del plugin sin bloquear el event loop.
+
+        Las funciones del AsyncShopifyPlugin se esperan directamente; las del plugin
+        síncrono se ejecutan en un hilo aparte."""
+        with PROFILER.span(f"plugin:{function.__name__}"):
+            if inspect.iscoroutinefunction(function):
+                return await function(*args, **kwargs)
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def _execute_intent(self, shopify, intent) -> ShopifyResult:
+        """Ejecuta en `shopify` (el plugin de una tienda) la función que corresponde a la intención"""
+        function = intent.function
+        if function == 'list':
+            return await self._call_shopify(shopify.get_products_list)
+        elif function == 'count':
+            return await self._call_shopify(shopify.count_products)
+        elif function == 'sort':
+            return await self._call_shopify(shopify.get_products_sorted, intent.sort_order)
+        elif function == 'update_price':
+            # NUEVO: Manejar operaciones matemáticas si existen
+            if intent.operation and intent.value:
+                if intent.product_id:
+                    return await self._call_shopify(shopify.update_product_price_with_math, intent.product_id, intent.operation, intent.value, is_id=True)
+                elif intent.product_name:
+                    return await self._call_shopify(shopify.update_product_price_with_math, intent.product_name, intent.operation, intent.value, is_id=False)
+                else:
+                    return ShopifyResult.error("Error: No se pudo identificar el producto para la operación matemática")
+
+            # Actualización directa de precio si no hay operación matemática
+            elif intent.product_id and intent.new_price:
+                return await self._call_shopify(shopify.update_product_price, intent.product_id, intent.new_price)
+            elif intent.product_name and intent.new_price:
+                return await self._call_shopify(shopify.update_product_price_by_name, intent.product_name, intent.new_price)
+            else:
+                error_msg = "Error: No pude extraer suficiente información del mensaje.\n"
+                error_msg += f"Debug info: product_id={intent.product_id}, product_name='{intent.product_name}', new_price={intent.new_price}, math_op={intent.operation}, math_val={intent.value}\n"
+                error_msg += "Ejemplos válidos:\n"
+                error_msg += "- 'Actualizar precio del producto ID 123456 a 99.99'\n"
+                error_msg += "- 'Modificar el precio de Gift Card a 200'\n"
+                error_msg += "- 'Actualiza The Complete Snowboard añadiendo 1000'"
+                return ShopifyResult.error(error_msg)
+        elif function == 'bulk_update':
+            return await self._call_shopify(shopify.bulk_update_prices, intent.filter_text, intent.operation,
+                                            intent.value, filter_field=intent.filter_field)
+        elif function == 'revert':
+            if intent.product_id:
+                return await self._call_shopify(shopify.revert_price, intent.product_id)
+            else:
+                return ShopifyResult.error("Error: Necesito el ID del producto para restaurar su precio. Ejemplo: 'Vuelve el precio original del ID 123456'")
+        elif function == 'revert_batch':
+            return await self._call_shopify(shopify.revert_batch, intent.batch_id or "")
+        elif function == 'price_changes':
+            return await self._call_shopify(shopify.get_price_changes, intent.period)
+
+    # Consultas de solo lectura que se pueden lanzar en todas las tiendas a la vez
+    FAN_OUT_FUNCTIONS = {'list': 'get_products_list', 'count': 'count_products', 'sort': 'get_products_sorted',
+                         'price_changes': 'get_price_changes'}
+
+    async def _execute_in_scope(self, shopify, scope: str, intent) -> ShopifyResult:
+        """Ejecuta la intención en una tienda o, con ALL_SHOPS, en todas en paralelo (resultado unido)"""
+        if scope != ALL_SHOPS:
+            return await self._execute_intent(shopify, intent)
+        function_name = self.FAN_OUT_FUNCTIONS.get(intent.function)
+        if function_name is None:
+            return ShopifyResult.error("Los cambios de precio se aplican a una sola tienda: indica cuál "
+                                       f"(p.ej. 'en la tienda {self.shops.default}'). Tiendas: {', '.join(self.shops.shops)}")
+        args = {'sort': (intent.sort_order,), 'price_changes': (intent.period,)}.get(intent.function, ())
+        return self.shops.merge_results(await self.shops.fan_out(self._call_shopify, function_name, *args))
+
+    def _select_shop(self, user_input: str, shop: str = None):
+        """
+        Tienda de la consulta: la indicada en `shop` o la mencionada en el texto ("en la tienda eu",
+        "in all stores"). Devuelve (plugin, ámbito, texto para el router, error). La mención se quita
+        del texto para que no se confunda con un nombre de producto.
+        """
+        if not self.shops or not (self.shops.multi or shop):
+            return self.shopify, None, user_input, None
+        scope, query = self.shops.resolve(user_input) if self.shops.multi else (None, user_input)
+        scope = (shop or scope or self.shops.default).lower()
+        if scope == ALL_SHOPS:
+            return self.shopify, scope, query, None
+        if scope not in self.shops.shops:
+            return self.shopify, None, query, ShopifyResult.error(f"La tienda '{scope}' no existe. Tiendas: {', '.join(self.shops.shops)}")
+        return self.shops.get(scope), scope, query, None
+
+    def _catalog_version(self, shopify, scope: str):
+        if scope == ALL_SHOPS:
+            return ",".join(f"{name}:{plugin.catalog_cache.generation}" for name, plugin in self.shops.plugins().items())
+        return shopify.catalog_cache.generation
+
+    def _show_answer(self, text: str, on_chunk=None):
+        """Muestra la respuesta completa en consola y/o la entrega al consumidor (on_chunk)"""
+        if self.echo:
+            print(f"\nAssistant: {text}")
+        if on_chunk:
+            on_chunk(text)
+
+    async def _invoke_llm(self, prompt: str, thinking: ThinkingIndicator, on_chunk=None) -> str:
+        """Invoca el LLM y muestra la respuesta; con streaming, fragmento a fragmento.
+
+        El indicador de progreso se detiene al llegar el primer fragmento y se registran
+        la latencia hasta el primer token y la total."""
+        started = time.perf_counter()
+        if not self.stream:
+            response = await self.kernel.invoke_prompt(prompt=prompt)  # <<< SEMANTIC KERNEL
+            response_text = str(response)
+            first_token = time.perf_counter() - started
+            thinking.stop()
+            self._show_answer(response_text, on_chunk)
+        else:
+            parts = []
+            first_token = None
+            try:
+                async for messages in self.kernel.invoke_prompt_stream(prompt=prompt):  # <<< SEMANTIC KERNEL
+                    if not isinstance(messages, list):
+                        continue
+                    chunk = "".join(str(message) for message in messages)
+                    if not chunk:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                        thinking.stop()
+                        if self.echo:
+                            print("\nAssistant: ", end="", flush=True)
+                    if self.echo:
+                        print(chunk, end="", flush=True)
+                    if on_chunk:
+                        on_chunk(chunk)
+                    parts.append(chunk)
+            finally:
+                if first_token is not None and self.echo:
+                    print()  # Cerrar la línea aunque el stream se corte a medias
+            response_text = "".join(parts)
+            if first_token is None:
+                # El modelo no devolvió contenido: mostrar la respuesta vacía como antes
+                first_token = time.perf_counter() - started
+                thinking.stop()
+                self._show_answer("", on_chunk)
+        total = time.perf_counter() - started
+        self.latency.record(first_token, total)
+        PROFILER.observe("llm_first_token", first_token)
+        PROFILER.observe("llm", total)
+        if DEBUG_MODE:
+            print(Colors.blue(f"Primer token: {first_token:.2f}s | respuesta completa: {total:.2f}s"))
+        return response_text
+
+    async def process_with_guaranteed_execution(self, user_input: str, on_chunk=None, shop: str = None):
+        """Procesa una consulta y devuelve la respuesta (None si falla el LLM).
+
+        on_chunk: callback opcional que recibe el texto de la respuesta a medida que está disponible.
+        shop: tienda a consultar (nombre o ALL_SHOPS); por defecto la mencionada en el texto o la predeterminada."""
+        with PROFILER.span("request"):
+            return await self._process_query(user_input, on_chunk, shop)
+
+    async def _process_query(self, user_input: str, on_chunk=None, shop: str = None):
         # Crear indicador de progreso al inicio
         thinking = ThinkingIndicator("Processing query")
         thinking.start()
         
         if DEBUG_MODE:
             print(f"\nUsuario: {user_input}")
-        user_input_lower = user_input.lower()
-        
-        # Triggers mejorados para detectar intenciones (bilingüe)
-        triggers = {
-            'list': ['productos', 'lista', 'catálogo', 'disponible', 'tienes', 'mostrar', 'ver', 'dame',
-                     'barata', 'barato', 'cara', 'caro', 'cuesta', 'económico', 'costoso',
-                     'tabla', 'tablas', 'opciones', 'alternativas', 'oferta',
-                     'products', 'list', 'catalog', 'available', 'have', 'show', 'display', 'give',
-                     'cheap', 'expensive', 'cost', 'affordable', 'costly',
-                     'table', 'options', 'alternatives', 'offer'],
-            'count': ['cuántos', 'cantidad', 'número', 'total', 'how many', 'count', 'number', 'total'],
-            'sort_asc': ['menor', 'mayor', 'ascendente', 'descendente', 'ordenar', 'orden',
-                        'lowest', 'highest', 'ascending', 'descending', 'sort', 'order'],
-            'update_price': ['actualizar', 'actualiza', 'cambiar', 'cambio', 'modificar', 'modifica',
-                           'añade', 'añadir', 'suma', 'sumar', 'resta', 'restar',
-                           'aumenta', 'aumentar', 'incrementa', 'incrementar', 'sube', 'subir',
-                           'update', 'change', 'modify', 'set', 'add', 'subtract'],
-            'revert_price': ['vuelve', 'restaurar', 'deshacer', 'anterior', 'original', 'revertir', 'dejarlo',
-                           'revert', 'restore', 'undo', 'previous', 'original', 'back']
-        }
-        
-        execute_function = None
-        sort_order = None
-        product_id = None
-        new_price = None
-        product_name = None
-        math_operation = None
-        math_value = None
-        
-        # CORRECCIÓN: Detección más amplia y precisa de UPDATE_PRICE (bilingüe)
-        update_keywords = ['actualizar', 'actualiza', 'cambiar', 'cambio', 'modificar', 'modifica',
-                          'update', 'change', 'modify', 'set']
-        math_keywords = [
-            'añadiendo', 'añadiendole', 'añade', 'añadir', 'sumando', 'sumandole', 'agregando', 'agregandole',
-            'restando', 'restandole', 'quitando', 'quitandole', 'suma', 'sumar', 'add',
-            'resta', 'restar', 'subtract', 'quita', 'quitar',
-            'mitad', 'a la mitad', 'half', 'reduce', 'reducir', 'rebaja', 'descuento', '%',
-            'doble', 'al doble', 'duplicar', 'double', 'twice',
-            'aumenta', 'aumentar', 'incrementa', 'incrementar', 'sube', 'subir'
-        ]
-        price_patterns = [
-            r'a\s+[\$€]?\d+',                    # "a 1000"
-            r'precio\s+[\$€]?\d+',               # "precio 1000" 
-            r'price\s+to\s+[\$€]?\d+',           # "price to 25"
-            r'to\s+[\$€]?\d+',                   # "to 25"
-            r'[\$€]\s*\d+',                      # "$1000"
-            r'añadiendo(?:le)?\s+\d+',           # "añadiendo 1000" o "añadiendole 1000"
-            r'añade\s+\d+',                      # "añade 10"
-            r'añadir\s+\d+',                     # "añadir 20"
-            r'suma\s+\d+',                       # "suma 50"
-            r'sumar\s+\d+',                      # "sumar 30"
-            r'resta\s+\d+',                      # "resta 40"
-            r'restar\s+\d+',                     # "restar 25"
-            r'aumenta\s+(?:un\s+)?\d+\s+por\s+ciento',  # "aumenta un 5 por ciento"
-            r'aumenta\s+(?:un\s+)?\d+%',  # "aumenta un 5%"
-            r'incrementa\s+(?:un\s+)?\d+\s+por\s+ciento',  # "incrementa un 10 por ciento"
-            r'incrementa\s+(?:un\s+)?\d+%',  # "incrementa un 10%"
-            r'incrementa\s+(?:el\s+precio\s+(?:de|del)\s+)?\w+(?:\s+\w+)*\s+(?:un\s+)?\d+%',  # "incrementa el precio de X un Y%"
-            r'sube\s+(?:un\s+)?\d+\s+por\s+ciento',  # "sube un 15 por ciento"
-            r'sube\s+(?:un\s+)?\d+%',  # "sube un 15%"
-            r'sumando(?:le)?\s+\d+',             # "sumando 500" o "sumandole 500"
-            r'agregando(?:le)?\s+\d+',           # "agregando 200" o "agregandole 200"
-            r'restando(?:le)?\s+\d+',            # "restando 100" o "restandole 100"
-            r'quitando(?:le)?\s+\d+',            # "quitando 50" o "quitandole 50"
-            r'adding\s+\d+',                     # "adding 100"
-            r'subtracting\s+\d+',                # "subtracting 50"
-        ]
-        
-        has_update_keyword = any(keyword in user_input_lower for keyword in update_keywords)
-        has_math_keyword = any(keyword in user_input_lower for keyword in math_keywords)
-        has_price_pattern = any(re.search(pattern, user_input_lower) for pattern in price_patterns)
-        
-        # Atajo: "a la mitad" o "half" => dividir por 2
-        if (has_update_keyword and ('a la mitad' in user_input_lower or 'mitad' in user_input_lower or 'half' in user_input_lower)):
-            execute_function = 'update_price'
-            math_operation = 'divide'
-            math_value = 2
-            if DEBUG_MODE:
-                print("   Operación detectada: dividir por 2 (mitad)")
         
-        # Atajo: "al doble" o "duplicar" => multiplicar por 2
-        if (has_update_keyword and ('al doble' in user_input_lower or 'doble' in user_input_lower or 'duplicar' in user_input_lower or 'double' in user_input_lower or 'twice' in user_input_lower)):
-            execute_function = 'update_price'
-            math_operation = 'multiply'
-            math_value = 2
-            if DEBUG_MODE:
-                print("   Operación detectada: multiplicar por 2 (doble)")
-
-        if (has_update_keyword or has_math_keyword) and (has_price_pattern or math_operation):
-            execute_function = 'update_price'
-            if DEBUG_MODE:
-                print("   DETECTADO: UPDATE_PRICE")
-            
-            # Buscar ID del producto (después de "ID" o "id")
-            id_match = re.search(r'id[:\s]*(\d+)', user_input_lower)
-            
-            # Buscar precio/operación - AMPLIADO SIGNIFICATIVAMENTE
-            price_match = re.search(r'(?:a|precio|€|euros?|$|dollars?)[:\s]*(\d+\.?\d*)', user_input_lower)
-            
-            # Detectar operaciones matemáticas PRIMERO
-            math_patterns = {
-                'add': [
-                    r'añadiendo(?:le)?\s+(\d+\.?\d*)', 
-                    r'añade\s+(\d+\.?\d*)',
-                    r'añadir\s+(\d+\.?\d*)',
-                    r'sumando(?:le)?\s+(\d+\.?\d*)', 
-                    r'agregando(?:le)?\s+(\d+\.?\d*)',
-                    r'suma\s+(\d+\.?\d*)',
-                    r'sumar\s+(\d+\.?\d*)',
-                    r'add\s+(\d+\.?\d*)'
-                ],
-                'subtract': [
-                    r'restando(?:le)?\s+(\d+\.?\d*)', 
-                    r'quitando(?:le)?\s+(\d+\.?\d*)',
-                    r'resta\s+(\d+\.?\d*)',
-                    r'restar\s+(\d+\.?\d*)',
-                    r'quita\s+(\d+\.?\d*)',
-                    r'quitar\s+(\d+\.?\d*)',
-                    r'subtract\s+(\d+\.?\d*)'
-                ],
-                'divide': [r'a\s+la\s+mitad', r'\bmitad\b', r'\bhalf\b'],
-                'multiply': [r'al\s+doble', r'\bdoble\b', r'duplicar', r'\bdouble\b', r'\btwice\b'],
-                'percent_reduce': [r'(?:reduce|reducir|rebaja|descuento)\s+(\d+\.?\d*)%', r'(\b\d+\.?\d*%\b)'],
-                'percent_increase': [
-                    r'(?:incrementa|incrementar|sube|aumenta|increase|raise)\s+(?:un\s+)?(\d+\.?\d*)%',
-                    r'aumenta\s+(?:el\s+precio\s+)?(?:en\s+)?(?:un\s+)?(\d+\.?\d*)%',
-                    r'incrementa\s+(?:el\s+precio\s+)?(?:en\s+)?(?:un\s+)?(\d+\.?\d*)%',
-                    r'sube\s+(?:el\s+precio\s+)?(?:en\s+)?(?:un\s+)?(\d+\.?\d*)%',
-                    r'aumenta\s+(?:un\s+)?(\d+\.?\d*)\s+por\s+ciento',
-                    r'incrementa\s+(?:un\s+)?(\d+\.?\d*)\s+por\s+ciento',
-                    r'sube\s+(?:un\s+)?(\d+\.?\d*)\s+por\s+ciento',
-                    r'aumenta\s+(?:un\s+)?(\d+\.?\d*)%',
-                    r'incrementa\s+(?:un\s+)?(\d+\.?\d*)%',
-                    r'sube\s+(?:un\s+)?(\d+\.?\d*)%',
-                    r'incrementa\s+(?:el\s+precio\s+(?:de|del)\s+)?\w+(?:\s+\w+)*\s+(?:un\s+)?(\d+\.?\d*)%'  # "incrementa el precio de X un Y%"
-                ]
-            }
-            
-            for operation, patterns in math_patterns.items():
-                for pattern in patterns:
-                    match = re.search(pattern, user_input_lower)
-                    if match:
-                        math_operation = operation
-                        if operation == 'divide':
-                            math_value = 2.0
-                        else:
-                            math_value = float(match.group(1))
-                        if DEBUG_MODE:
-                            print(f"   Operación matemática detectada: {operation} {math_value}")
-                        break
-                if math_operation:
-                    break
-            
-            # Si no hay operación matemática, buscar precio directo
-            if not math_operation:
-                if not price_match:
-                    all_numbers = re.findall(r'(\d+\.?\d*)', user_input_lower)
-                    if len(all_numbers) >= 1:
-                        new_price = all_numbers[-1]
-                        price_match = True
-                
-                if price_match and hasattr(price_match, 'group'):
-                    new_price = price_match.group(1)
-            
-            # Buscar ID o nombre del producto
-            if id_match:
-                product_id = id_match.group(1)
-                print(f"   ID detectado: {product_id}")
-            else:
-                # MEJORADO: Búsqueda por nombre más inteligente
-                if DEBUG_MODE:
-                    print("   No se encontró ID, buscando por nombre de producto...")
-                
-                # Buscar nombre de producto con patrones mejorados y más específicos (bilingüe)
-                name_patterns = [
-                    # Patrones en español
-                    r'(?:actualiza|actualizar|modifica|modificar|cambiar|cambio)\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)\s+(?:a|añadiendo|sumando|agregando|restando|quitando|suma|sumar|resta|restar)\s+[\d.]+',
-                    r'(?:actualiza|actualizar|modifica|modificar|cambiar|cambio)\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)\s+(?:a\s+la\s+mitad|al\s+doble|duplicar)',
-                    r'(?:aumenta|aumentar|incrementa|incrementar|sube|subir)\s+(?:un\s+)?\d+\s+por\s+ciento\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)$',
-                    r'(?:aumenta|aumentar|incrementa|incrementar|sube|subir)\s+(?:un\s+)?\d+%\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)$',
-                    r'(?:incrementa|incrementar)\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)\s+(?:un\s+)?\d+%$',
-                    r'precio\s+(?:de|del)\s+(.+?)\s+a\s+[\d.]+',
-                    r'(.+?)\s+(?:añadiendo|sumando|agregando|restando|quitando|suma|sumar|resta|restar)\s+[\d.]+',
-                    r'(?:suma|sumar|add)\s+[\d.]+\s*[\$€]?\s*(?:al\s+precio\s+(?:de|del)\s+|a\s+(?:la\s+)?)?(.+?)$',
-                    r'(?:resta|restar|subtract)\s+[\d.]+\s*[\$€]?\s*(?:al\s+precio\s+(?:de|del)\s+|a\s+(?:la\s+)?)?(.+?)$',
-                    r'(?:añade|añadir|add)\s+[\d.]+\s*[\$€]?\s*(?:al\s+precio\s+(?:de|del)\s+|a\s+(?:la\s+)?)?(.+?)$',
-                    # Patrones en inglés
-                    r'(?:update|change|modify|set)\s+(.+?)\s+(?:price\s+)?to\s+[\d.]+',  # "update Gift Card price to 25"
-                    r'(?:update|change|modify)\s+(.+?)\s+(?:adding|subtracting)\s+[\d.]+',  # "update Gift Card adding 10"
-                    r'(.+?)\s+price\s+to\s+[\d.]+',                                     # "Gift Card price to 25"
-                ]
-                
-                for i, pattern in enumerate(name_patterns):
-                    name_match = re.search(pattern, user_input_lower, re.IGNORECASE)
-                    if name_match:
-                        extracted_name = name_match.group(1).strip()
-                        
-                        # Limpiar el nombre extraído
-                        # Remover palabras de comando que pueden haber quedado
-                        words_to_remove = ['actualiza', 'actualizar', 'modifica', 'modificar', 'cambiar', 'cambio', 'el', 'precio', 'de', 'del']
-                        name_words = extracted_name.split()
-                        cleaned_words = [word for word in name_words if word.lower() not in words_to_remove]
-                        
-                        if cleaned_words:  # Solo si queda algo después de limpiar
-                            product_name = ' '.join(word.capitalize() for word in cleaned_words)
-                            if DEBUG_MODE:
-                                print(f"   Patrón {i+1} - Nombre extraído: '{product_name}'")
-                            break
-                
-                # Patrón fallback más agresivo si los principales fallan
-                if not product_name:
-                    if DEBUG_MODE:
-                        print("   Usando patrón fallback...")
-                    # Buscar cualquier secuencia de palabras que pueda ser un nombre de producto
-                    fallback_pattern = r'(?:actualiza|actualizar|modifica|modificar|cambiar)\s+(?:el\s+precio\s+de\s+)?(.+?)(?:\s+(?:a|añadiendo|sumando|agregando|restando|quitando)|$)'
-                    name_match = re.search(fallback_pattern, user_input_lower, re.IGNORECASE)
-                    if name_match:
-                        extracted_name = name_match.group(1).strip()
-                        # Remover números y operaciones del final
-                        extracted_name = re.sub(r'\s+(?:a|añadiendo|sumando|agregando|restando|quitando)\s+[\d.]+.*$', '', extracted_name)
-                        # Remover palabras de comando
-                        words = extracted_name.split()
-                        cleaned_words = [word for word in words if word.lower() not in ['precio', 'de', 'del', 'el', 'la']]
-                        if cleaned_words:
-                            product_name = ' '.join(word.capitalize() for word in cleaned_words)
-                            if DEBUG_MODE:
-                                print(f"   Fallback - Nombre extraído: '{product_name}'")
-                
-                if product_name:
-                    if DEBUG_MODE:
-                        print(f"   {Colors.green('OK')} Producto identificado: '{product_name}'")
-                else:
-                    print(f"   {Colors.yellow('DEBUG')} No se pudo extraer nombre de producto")
-            
-            # Mostrar precio final o operación detectada
-            if math_operation and math_value:
-                if DEBUG_MODE:
-                    print(f"   Operación pendiente: {math_operation} {math_value}")
-            elif new_price:
-                pass  # Línea de debug comentada
-                
-        # Detectar intención de reversión de precio (NUEVO)
-        elif any(k in user_input_lower for k in triggers['revert_price']):
-            execute_function = 'revert'
-            # Buscar ID en el mensaje
-            id_match = re.search(r'id[:\s]*(\d+)', user_input_lower)
-            if id_match:
-                product_id = id_match.group(1)
-            else:
-                if DEBUG_MODE:
-                    print("    No se encontró ID específico para la reversión")
-                
-        # Detectar intención de ordenación
-        elif any(k in user_input_lower for k in triggers['sort_asc']):
-            if any(word in user_input_lower for word in ['menor', 'ascendente', 'bajo', 'barato']):
-                execute_function = 'sort'
-                sort_order = 'asc'
-            elif any(word in user_input_lower for word in ['mayor', 'descendente', 'alto', 'caro']):
-                execute_function = 'sort'
-                sort_order = 'desc'
-            elif 'orden' in user_input_lower or 'ordenar' in user_input_lower:
-                execute_function = 'sort'
-                sort_order = 'desc'  # Por defecto mayor a menor
-        elif any(k in user_input_lower for k in triggers['list']):
-            execute_function = 'list'
-        elif any(k in user_input_lower for k in triggers['count']):
-            execute_function = 'count'
+        # Enrutado: gramática precompilada en intent_router (coste fijo por mensaje)
+        with PROFILER.span("intent"):
+            shopify, scope, query, shopify_data = self._select_shop(user_input, shop)
+            intent = route_intent(query)
+        execute_function = intent.function
+        if DEBUG_MODE and execute_function:
+            print(f"   DETECTADO: {execute_function.upper()} {intent.to_dict()}" + (f" tienda={scope}" if scope else ""))
         
-        shopify_data = None
-        if execute_function:
+        if execute_function and shopify_data is None:
             if DEBUG_MODE:
                 print(Colors.blue(f"Intención detectada: {execute_function.upper()}"))
                 print(Colors.blue("Ejecutando función de Shopify..."))
             
-            if execute_function == 'list':
-                shopify_data = self.shopify.get_products_list()
-            elif execute_function == 'count':
-                shopify_data = self.shopify.count_products()
-            elif execute_function == 'sort':
-                shopify_data = self.shopify.get_products_sorted(sort_order)
-            elif execute_function == 'update_price':
-                # NUEVO: Manejar operaciones matemáticas si existen
-                if math_operation and math_value:
-                    if product_id:
-                        shopify_data = self.shopify.update_product_price_with_math(product_id, math_operation, math_value, is_id=True)
-                    elif product_name:
-                        shopify_data = self.shopify.update_product_price_with_math(product_name, math_operation, math_value, is_id=False)
-                    else:
-                        shopify_data = f"{Colors.red('ERROR')} Error: No se pudo identificar el producto para la operación matemática"
-                
-                # Actualización directa de precio si no hay operación matemática
-                elif product_id and new_price:
-                    shopify_data = self.shopify.update_product_price(product_id, new_price)
-                elif product_name and new_price:
-                    shopify_data = self.shopify.update_product_price_by_name(product_name, new_price)
-                else:
-                    error_msg = f"{Colors.red('ERROR')} Error: No pude extraer suficiente información del mensaje.\n"
-                    error_msg += f"Debug info: product_id={product_id}, product_name='{product_name}', new_price={new_price}, math_op={math_operation}, math_val={math_value}\n"
-                    error_msg += "Ejemplos válidos:\n"
-                    error_msg += "- 'Actualizar precio del producto ID 123456 a 99.99'\n"
-                    error_msg += "- 'Modificar el precio de Gift Card a 200'\n"
-                    error_msg += "- 'Actualiza The Complete Snowboard añadiendo 1000'"
-                    shopify_data = error_msg
-            elif execute_function == 'revert':
-                if product_id:
-                    shopify_data = self.shopify.revert_price(product_id)
-                else:
-                    shopify_data = f"{Colors.red('ERROR')} Error: Necesito el ID del producto para restaurar su precio. Ejemplo: 'Vuelve el precio original del ID 123456'"
+            shopify_data = await self._execute_in_scope(shopify, scope, intent)
                 
             if DEBUG_MODE:
                 print(Colors.blue("Datos obtenidos de Shopify"))
 
+        # El resultado tipado se convierte a texto una sola vez, para mostrarlo o incluirlo en el prompt
+        self.last_result = shopify_data
+        shopify_text = shopify_data.render() if shopify_data else None
+
         # MEJORA 2: MODO DIRECTO OPCIONAL (SIN LLM)
         if DIRECT_MODE and shopify_data:
-            print(f"\n[MODO DIRECTO ACTIVADO]")
-            print(f"DATOS DIRECTOS DE SHOPIFY:\n{shopify_data}")
-            return shopify_data
+            thinking.stop()
+            if self.echo:
+                print(f"\n[MODO DIRECTO ACTIVADO]")
+                print(f"DATOS DIRECTOS DE SHOPIFY:\n{shopify_text}")
+            if on_chunk:
+                on_chunk(shopify_text)
+            return shopify_text
+
+        # Intenciones deterministas: el resultado ya está formateado, se muestra sin pasar por el LLM
+        if shopify_data and self.response_policy.render_locally(execute_function, user_input):
+            self.response_policy.record(execute_function, local=True)
+            self.history.add_turn(user_input, shopify_text)
+            thinking.stop()
+            if DEBUG_MODE:
+                print(Colors.blue(f"Respuesta local ({execute_function}), sin llamada al LLM"))
+            self._show_answer(shopify_text, on_chunk)
+            return shopify_text
 
+        prompt_started = time.perf_counter()
         if shopify_data:
             # MEJORA 3: PROMPTS ULTRA-ESPECÍFICOS Y RESTRICTIVOS
             if execute_function == 'list' or execute_function == 'sort':
-                enhanced_prompt = f'''DATOS EXACTOS DE SHOPIFY:
-{shopify_data}
+                enhanced_prompt = f'''DATOS EXACTOS DE SHOPIFY (una fila por producto: {'tienda|' if scope == ALL_SHOPS else ''}id|título|precio):
+{pack_product_listing(shopify_data)}
 
 Usuario pidió: "{user_input}"
 
@@ -1037,16 +3765,15 @@ INSTRUCCIONES OBLIGATORIAS:
 - Muestra CADA producto con formato: "ID: [número] - [nombre] - $[precio]"
 - INCLUYE TODOS los productos y sus IDs reales
 - NO inventes ni omitas productos
+- Si hay productos omitidos por límite de tamaño, indica cuántos
 - USA EXACTAMENTE los datos proporcionados
 
 Responde SOLO con los productos reales listados arriba.'''
 
             elif execute_function == 'update_price':
-                # Detectar éxito con los nuevos patrones de Colors
-                success_patterns = ["[OK] Éxito", "OK] Éxito", "Éxito confirmado", "se ha actualizado", "Operación exitosa", "[32mOK[0m", "actualizado de $", "actualizado a $"]
-                if any(pattern in shopify_data for pattern in success_patterns):
+                if shopify_data.ok:
                     enhanced_prompt = f'''ACTUALIZACIÓN EXITOSA CONFIRMADA:
-{shopify_data}
+{shopify_text}
 
 Usuario pidió: "{user_input}"
 
@@ -1060,7 +3787,7 @@ INSTRUCCIONES OBLIGATORIAS:
 Responde de forma positiva confirmando el cambio exitoso.'''
                 else:
                     enhanced_prompt = f'''ACTUALIZACIÓN FALLÓ:
-{shopify_data}
+{shopify_text}
 
 Usuario pidió: "{user_input}"
 
@@ -1072,9 +3799,22 @@ INSTRUCCIONES OBLIGATORIAS:
 
 Responde explicando SOLO el error mostrado arriba.'''
 
+            elif execute_function == 'bulk_update':
+                enhanced_prompt = f'''RESULTADO DE LA ACTUALIZACIÓN MASIVA:
+{shopify_text}
+
+Usuario pidió: "{user_input}"
+
+INSTRUCCIONES OBLIGATORIAS:
+- Indica cuántos productos se actualizaron y cuántos fallaron según el resumen de arriba
+- Muestra la tabla con el precio anterior y nuevo de CADA producto
+- NO confirmes cambios de filas cuyo estado no sea OK
+
+Responde SOLO con los datos reales mostrados arriba.'''
+
             elif execute_function == 'count':
                 enhanced_prompt = f'''CONTEO EXACTO:
-{shopify_data}
+{shopify_text}
 
 Usuario pidió: "{user_input}"
 
@@ -1086,34 +3826,302 @@ Responde SOLO con el número real mostrado arriba.'''
 
             else:
                 enhanced_prompt = f'''DATOS DE SHOPIFY:
-{shopify_data}
+{shopify_text}
 
 Usuario pidió: "{user_input}"
 
 Responde basándote ÚNICAMENTE en los datos mostrados arriba.'''
         else:
             enhanced_prompt = user_input
+        PROFILER.observe("prompt", time.perf_counter() - prompt_started)
         
-        self.chat_history.add_user_message(user_input)  # <<< SEMANTIC KERNEL
         try:
             if DEBUG_MODE:
                 print(Colors.blue("Generando respuesta..."))
-            response = await self.kernel.invoke_prompt(prompt=enhanced_prompt)  # <<< SEMANTIC KERNEL
-            response_text = str(response)
-            self.chat_history.add_assistant_message(response_text)  # <<< SEMANTIC KERNEL
-            
-            # Detener el indicador de progreso antes de mostrar la respuesta
-            thinking.stop()
-            print(f"\nAssistant: {response_text}")
+            if self.response_cache:
+                catalog_version = self._catalog_version(shopify, scope)
+                cache_context = self.response_cache.context_key(execute_function, shopify_text, catalog_version)
+                with PROFILER.span("response_cache"):
+                    cached = await self.response_cache.get(cache_context, user_input)
+                if cached is not None:
+                    self.response_policy.record(execute_function, local=True)
+                    self.history.add_turn(user_input, cached)
+                    thinking.stop()
+                    if DEBUG_MODE:
+                        print(Colors.blue("Respuesta servida desde la caché, sin llamada al LLM"))
+                    self._show_answer(cached, on_chunk)
+                    return cached
+            self.response_policy.record(execute_function, local=False)
+            response_text = await self._invoke_llm(enhanced_prompt, thinking, on_chunk)
+            if self.response_cache and response_text:
+                await self.response_cache.put(cache_context, user_input, response_text)
+            self.history.add_turn(user_input, response_text)
+            if DEBUG_MODE:
+                print(Colors.blue(self.history.stats()))
             return response_text
         except Exception as e:
             # Detener el indicador en caso de error
             thinking.stop()
             print(f"{Colors.red('ERROR')} Error: {e}")
             if shopify_data:
-                print(f"\nDatos directos de Shopify:\n{shopify_data}")
+                print(f"\nDatos directos de Shopify:\n{shopify_text}")
             return None
 
+# ============================================
+# MODO BATCH (SIN TERMINAL INTERACTIVO)
+# ============================================
+
+ANSI_ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+def read_batch_queries(stream):
+    """
+    Lee las consultas del modo batch: una por línea en texto plano o en JSONL
+    ({"id": ..., "query": ...}). Ignora líneas vacías y comentarios ('#').
+    Devuelve tuplas (línea, id, consulta, error).
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if not line.startswith('{'):
+            yield line_number, None, line, None
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, None, f"JSON inválido: {e}"
+            continue
+        yield line_number, record.get('id'), record.get('query') or record.get('text'), None
+
+class BatchSummary:
+    """Totales y tiempos de una ejecución batch"""
+
+    def __init__(self):
+        self.timings = []
+        self.failed = 0
+        self.started = time.perf_counter()
+
+    def report(self) -> str:
+        if not self.timings:
+            return "Batch: sin consultas"
+        ordered = sorted(self.timings)
+        return (f"Batch: {len(ordered)} consultas, {self.failed} fallidas, "
+                f"{time.perf_counter() - self.started:.2f}s en total, mediana {ordered[len(ordered) // 2]:.0f} ms, "
+                f"máx {ordered[-1]:.0f} ms")
+
+async def run_batch(make_agent, queries: list, out, concurrency: int = 1) -> BatchSummary:
+    """
+    Procesa las consultas con un máximo de `concurrency` simultáneas y escribe un resultado JSONL
+    por consulta (en orden de finalización, con el número de línea de origen).
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    summary = BatchSummary()
+
+    async def run_one(line_number, query_id, query, error):
+        response = result = None
+        async with semaphore:
+            started = time.perf_counter()
+            if error is None and not query:
+                error = "Consulta vacía"
+            if error is None:
+                agent = make_agent()
+                try:
+                    response = await agent.process_with_guaranteed_execution(query)
+                    result = agent.last_result
+                except Exception as e:
+                    error = str(e)
+                if response is None and error is None:
+                    error = "El LLM no devolvió respuesta (detalle en stderr)"
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        record = {"line": line_number, "query": query, "intent": route_intent(query).function if query else None,
+                  "ok": error is None, "response": ANSI_ESCAPE_RE.sub('', response) if response else None,
+                  "error": error, "elapsed_ms": round(elapsed_ms, 1)}
+        if result is not None:
+            record["result"] = result.to_dict()
+        if query_id is not None:
+            record["id"] = query_id
+        summary.timings.append(elapsed_ms)
+        summary.failed += error is not None
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    await asyncio.gather(*(run_one(*query) for query in queries))
+    return summary
+
+# ============================================
+# MODO SERVIDOR (HTTP + SSE)
+# ============================================
+
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "8"))  # Consultas simultáneas en todo el servidor
+SERVER_SESSION_TTL = float(os.getenv("SERVER_SESSION_TTL", "1800"))     # Segundos de inactividad antes de cerrar una sesión
+SERVER_MAX_SESSIONS = int(os.getenv("SERVER_MAX_SESSIONS", "200"))
+
+class ServerSession:
+    """Agente (con su historial) de un operador; sus consultas se atienden en orden"""
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.pending = 0  # Consultas aceptadas y aún sin terminar (en curso o esperando el turno)
+
+    @property
+    def busy(self) -> bool:
+        return self.pending > 0 or self.lock.locked()
+
+class AgentServer:
+    """
+    Servidor HTTP (aiohttp) para compartir un proceso caliente entre varios operadores.
+
+    - Cada sesión tiene su propio agente e historial; el plugin de Shopify, el token de WSO2,
+      la sesión HTTP, las cachés y el kernel se comparten
+    - Un semáforo limita las consultas simultáneas de todo el servidor
+    - POST /chat responde JSON o, con 'Accept: text/event-stream', eventos SSE según llega el texto
+    """
+
+    def __init__(self, make_agent, max_concurrency: int = SERVER_MAX_CONCURRENCY, session_ttl: float = SERVER_SESSION_TTL,
+                 max_sessions: int = SERVER_MAX_SESSIONS, api_key: str = None):
+        self.make_agent = make_agent
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.api_key = api_key
+        self.sessions = OrderedDict()  # session_id -> ServerSession (orden de último uso)
+        self.requests = Counter()      # 'json' / 'sse' / 'error'
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._auth])
+        app.router.add_get("/health", self.health)
+        app.router.add_post("/chat", self.chat)
+        app.router.add_delete("/sessions/{session_id}", self.close_session)
+        if PROFILER.enabled:
+            app.router.add_get("/metrics", self.metrics)
+        return app
+
+    @web.middleware
+    async def _auth(self, request, handler):
+        if self.api_key and request.path != "/health" and not hmac.compare_digest(
+                request.headers.get("Authorization", "").encode("utf-8"), f"Bearer {self.api_key}".encode("utf-8")):
+            raise web.HTTPUnauthorized(text="Token de acceso inválido")
+        return await handler(request)
+
+    def _session(self, session_id: str = None):
+        """
+        Devuelve (session_id, sesión) con una consulta pendiente apuntada (la libera _process), creando la
+        sesión si no existe. Solo se expulsan sesiones ociosas: las inactivas durante más de session_ttl y,
+        por encima de max_sessions, las de uso más antiguo. Una sesión con consultas en curso o en cola
+        nunca se expulsa, aunque el servidor supere max_sessions mientras terminan.
+        """
+        now = time.monotonic()
+        expired = [key for key, session in self.sessions.items()
+                   if now - session.last_used > self.session_ttl and not session.busy]
+        for key in expired:
+            del self.sessions[key]
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session_id = session_id or uuid.uuid4().hex
+            session = self.sessions[session_id] = ServerSession(self.make_agent())
+        self.sessions.move_to_end(session_id)
+        session.last_used = now
+        session.pending += 1
+        excess = len(self.sessions) - self.max_sessions
+        if excess > 0:
+            for key in [key for key, idle in self.sessions.items() if not idle.busy][:excess]:
+                del self.sessions[key]
+        return session_id, session
+
+    async def _process(self, session: ServerSession, message: str, on_chunk=None, shop: str = None):
+        # Primero el turno de la sesión y después la plaza global, para no ocuparla esperando
+        # Devuelve (respuesta, ShopifyResult serializado o None) leídos con el turno de la sesión aún tomado
+        try:
+            async with session.lock, self.semaphore:
+                response = await session.agent.process_with_guaranteed_execution(message, on_chunk=on_chunk, shop=shop)
+                result = session.agent.last_result
+                return response, result.to_dict() if result is not None else None
+        finally:
+            session.pending -= 1
+            session.last_used = time.monotonic()
+
+    async def health(self, request):
+        return web.json_response({"status": "ok", "sessions": len(self.sessions), "requests": dict(self.requests),
+                                  "shopify_schedulers": {shop: scheduler.stats() for shop, scheduler in _call_schedulers.items()}})
+
+    async def metrics(self, request):
+        """Histogramas de latencia por etapa en formato OpenMetrics (solo con --profile)"""
+        return web.Response(body=PROFILER.to_openmetrics().encode("utf-8"),
+                            headers={"Content-Type": "application/openmetrics-text; version=1.0.0; charset=utf-8"})
+
+    async def close_session(self, request):
+        if self.sessions.pop(request.match_info["session_id"], None) is None:
+            raise web.HTTPNotFound(text="Sesión no encontrada")
+        return web.json_response({"closed": request.match_info["session_id"]})
+
+    async def chat(self, request):
+        try:
+            body = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise web.HTTPBadRequest(text="El cuerpo debe ser JSON: {\"message\": ..., \"session_id\": ...}")
+        message = str(body.get("message") or "").strip()
+        if not message:
+            raise web.HTTPBadRequest(text="Falta 'message'")
+        shop = body.get("shop")  # Tienda a consultar ("*" = todas); sin ella, la mencionada en el mensaje
+        session_id, session = self._session(body.get("session_id"))
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            return await self._chat_stream(request, session_id, session, message, shop)
+        started = time.perf_counter()
+        response, result = await self._process(session, message, shop=shop)
+        self.requests['json' if response is not None else 'error'] += 1
+        return web.json_response({
+            "session_id": session_id,
+            "ok": response is not None,
+            "response": ANSI_ESCAPE_RE.sub('', response) if response else None,
+            "result": result,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    @staticmethod
+    async def _send_event(stream: web.StreamResponse, event: str, data: dict):
+        await stream.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    async def _chat_stream(self, request, session_id: str, session: ServerSession, message: str, shop: str = None):
+        """Respuesta SSE: 'session', un 'chunk' por fragmento de texto y 'done' (o 'error') al final"""
+        started = time.perf_counter()
+        chunks = asyncio.Queue()
+        # La consulta se lanza antes de abrir el stream: así libera su turno aunque el cliente ya se haya ido
+        task = asyncio.ensure_future(self._process(session, message, on_chunk=chunks.put_nowait, shop=shop))
+        task.add_done_callback(lambda _: chunks.put_nowait(None))
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        try:
+            await stream.prepare(request)
+            await self._send_event(stream, "session", {"session_id": session_id})
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                await self._send_event(stream, "chunk", {"text": ANSI_ESCAPE_RE.sub('', chunk)})
+            response, result = (None, None) if task.exception() else task.result()
+            self.requests['sse' if response is not None else 'error'] += 1
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            if response is None:
+                await self._send_event(stream, "error", {"error": "No se pudo generar la respuesta", "elapsed_ms": elapsed_ms})
+            else:
+                await self._send_event(stream, "done", {"elapsed_ms": elapsed_ms, "result": result})
+            await stream.write_eof()
+        except ConnectionResetError:
+            pass  # El cliente se desconectó; la consulta termina igualmente en segundo plano
+        return stream
+
+async def run_server(server: AgentServer, host: str, port: int):
+    """Arranca el servidor y lo mantiene hasta que se interrumpe el proceso"""
+    runner = web.AppRunner(server.build_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(Colors.green(f"Servidor escuchando en http://{host}:{port} (POST /chat, GET /health)"))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 # ============================================
 # FUNCIÓN PRINCIPAL
 # ============================================
@@ -1125,7 +4133,56 @@ async def main():
     parser = argparse.ArgumentParser(description='Agente IA para Shopify a través de WSO2 Gateway')
     parser.add_argument('-d', '--debug', action='store_true', help='Activar modo debug')
     parser.add_argument('--direct', action='store_true', help='Modo directo: respuestas sin LLM')
+    parser.add_argument('--sync-http', action='store_true', help='Usar el plugin síncrono (requests) en lugar del asíncrono (aiohttp)')
+    parser.add_argument('--backend', choices=['rest', 'graphql'], default=os.getenv("SHOPIFY_BACKEND", "rest"),
+                        help='API de Shopify: REST o Admin GraphQL (exportación masiva y mutaciones agrupadas)')
+    parser.add_argument('--llm-policy', default=os.getenv("LLM_POLICY", "auto"),
+                        help="Intenciones que se responden sin LLM: 'auto' (list,count,sort,update_price,revert,bulk_update,revert_batch,price_changes), "
+                             "'always' (siempre LLM) o una lista separada por comas")
+    parser.add_argument('--no-stream', action='store_true', default=os.getenv("LLM_STREAM", "true").lower() in ("0", "false", "no"),
+                        help='Esperar la respuesta completa del LLM en lugar de mostrarla a medida que llega')
+    parser.add_argument('--response-cache-path', default=os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite"),
+                        help='Fichero SQLite con la caché de respuestas del LLM')
+    parser.add_argument('--no-response-cache', action='store_true', help='No reutilizar respuestas del LLM ya redactadas')
+    parser.add_argument('--eager-start', action='store_true',
+                        help='Verificar la conexión con OpenAI antes de aceptar consultas (por defecto se hace en segundo plano)')
+    parser.add_argument('--startup-report', action='store_true', help='Mostrar el tiempo de arranque por fases')
+    parser.add_argument('--profile', action='store_true',
+                        help='Medir la latencia por etapa (intención, token, Shopify, prompt, LLM) y mostrar p50/p95 al salir')
+    parser.add_argument('--profile-output', metavar='FICHERO',
+                        help='Exportar el perfil al salir: JSON si termina en .json, OpenMetrics en otro caso (implica --profile)')
+    parser.add_argument('--batch', metavar='FICHERO',
+                        help="Procesar las consultas de un fichero ('-' = stdin), en texto plano o JSONL, sin modo interactivo")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv("BATCH_CONCURRENCY", "1")),
+                        help='Consultas simultáneas en modo batch (1 = en orden)')
+    parser.add_argument('--output', default='-', help="Fichero JSONL de resultados del modo batch ('-' = stdout)")
+    parser.add_argument('--serve', action='store_true', help='Modo servidor HTTP (POST /chat, respuestas JSON o SSE)')
+    parser.add_argument('--host', default=os.getenv("SERVER_HOST", "127.0.0.1"), help='Dirección del modo servidor')
+    parser.add_argument('--port', type=int, default=int(os.getenv("SERVER_PORT", "8080")), help='Puerto del modo servidor')
+    parser.add_argument('--cache-ttl', type=float, default=float(os.getenv("CATALOG_CACHE_TTL", "120")),
+                        help='Segundos de validez de la caché local del catálogo (0 = desactivada)')
+    parser.add_argument('--snapshot-path', default=os.getenv("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.sqlite"),
+                        help='Fichero SQLite con el snapshot del catálogo para arrancar en caliente')
+    parser.add_argument('--no-snapshot', action='store_true', help='No usar el snapshot del catálogo en disco')
     args = parser.parse_args()
+    startup = StartupTimer()
+    startup.mark("módulos")
+    PROFILER.enabled = args.profile or bool(args.profile_output)
+    results_out = None
+    if args.batch:
+        # La salida estándar queda reservada para los resultados JSONL; los mensajes del agente van a stderr
+        results_out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        sys.stdout = sys.stderr
+    if args.batch or args.serve:
+        ThinkingIndicator.enabled = False
+    
+    print("=" * 60)
+    print("ECOMMERCE AI AGENT v1.3 (SHOPIFY + WSO2)")
+    print("=" * 60)
+    try:
+        response_policy = ResponsePolicy.parse(args.llm_policy)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Configurar modo debug
     DEBUG_MODE = args.debug
@@ -1142,81 +4199,178 @@ async def main():
     if DEBUG_MODE:
         print("✓ Credenciales de OpenAI detectadas")
     
-    kernel = sk.Kernel()  # <<< SEMANTIC KERNEL
-    model_to_use = "gpt-4-turbo-preview"
-    try:
-        kernel.add_service(OpenAIChatCompletion(service_id="openai", api_key=os.getenv("OPENAI_API_KEY"), ai_model_id=model_to_use))  # <<< SEMANTIC KERNEL
+    startup.mark("configuración")
+    
+    if args.backend == 'graphql':
+        # Sin variante aiohttp: el agente (y el servidor) ejecutan sus funciones en hilos con asyncio.to_thread
+        plugin_class = ShopifyGraphQLPlugin
         if DEBUG_MODE:
-            print(f"✓ Modelo configurado: {model_to_use}")
-            print(f"\n{Colors.yellow('DEBUG')} Verificando conexión...", end="")
-            await kernel.invoke_prompt("Di 'OK'")  # <<< SEMANTIC KERNEL
-            print(f" {Colors.green('OK')} Conexión exitosa")
+            print("✓ Backend GraphQL (síncrono: sus llamadas se ejecutan en hilos)")
+    else:
+        plugin_class = ShopifyPlugin if args.sync_http else AsyncShopifyPlugin
+    use_snapshot = not args.no_snapshot and args.cache_ttl > 0
+    token_manager = WSO2TokenManager()  # El token del Gateway es común a todas las tiendas
+
+    def make_plugin(shop: ShopConfig):
+        """Plugin de una tienda con su caché, snapshot, historial y planificador propios"""
+        options = dict(shop=shop, token_manager=token_manager,
+                       catalog_cache=CatalogCache(ttl=args.cache_ttl, max_entries=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "50000"))),
+                       catalog_snapshot=CatalogSnapshot(shop.file_path(args.snapshot_path)) if use_snapshot else None,
+                       price_history=PriceHistory(shop.file_path(os.getenv("PRICE_HISTORY_PATH", "price_history.sqlite"))))
+        if shop.name != DEFAULT_SHOP:
+            # Multitienda: pool de conexiones propio para que una tienda lenta no acapare el de las demás
+            options["transport"] = HttpTransport.from_env()
+            if plugin_class is AsyncShopifyPlugin:
+                options["async_transport"] = AsyncHttpTransport.from_env()
+        return plugin_class(**options)
+
+    shops = ShopRegistry(shops_from_env(), make_plugin, default=os.getenv("SHOPIFY_DEFAULT_SHOP"))
+    shopify_plugin = shops.get()
+    if shops.multi and DEBUG_MODE:
+        print(f"✓ Tiendas: {', '.join(shops.shops)} (por defecto: {shops.default})")
+
+    async def sync_snapshot(plugin):
+        # Arranque en caliente: snapshot local + delta de productos modificados
+        if isinstance(plugin, AsyncShopifyPlugin):
+            snapshot_status = await plugin.sync_catalog_snapshot_async()
         else:
-            # Solo verificar conexión sin mostrar detalles
-            await kernel.invoke_prompt("Di 'OK'")  # <<< SEMANTIC KERNEL
-    except Exception as e:
-        print(f"{Colors.red('ERROR')} Error de conexión: {e}")
-        return
+            snapshot_status = await asyncio.to_thread(plugin.sync_catalog_snapshot)
+        if snapshot_status and DEBUG_MODE:
+            print(f"✓ [{plugin.shop.name}] {snapshot_status}" if shops.multi else f"✓ {snapshot_status}")
+
+    if use_snapshot:
+        await asyncio.gather(*(sync_snapshot(plugin) for plugin in shops.plugins().values()))
+    startup.mark("catálogo")
     
-    shopify_plugin = ShopifyPlugin()
-    kernel.add_plugin(shopify_plugin, plugin_name="Shopify")  # <<< SEMANTIC KERNEL
-    if DEBUG_MODE:
-        print("✓ Plugin de Shopify registrado")
+    model_to_use = "gpt-4-turbo-preview"
     
-    agent = AgentWithManualExecution(kernel, shopify_plugin)  # <<< SEMANTIC KERNEL
+    kernel = LazyKernel(lambda: build_kernel(shopify_plugin, model_to_use))  # <<< SEMANTIC KERNEL
+    if args.eager_start:
+        # Arranque clásico: no se acepta entrada hasta verificar la conexión con OpenAI
+        if not await asyncio.to_thread(check_llm_connection, kernel, model_to_use):
+            await shops.aclose()
+            return
+        startup.mark("LLM")
+    elif not DIRECT_MODE:
+        # Verificación en segundo plano mientras el usuario escribe (en modo directo no hace falta)
+        threading.Thread(target=check_llm_connection, args=(kernel, model_to_use), daemon=True).start()
     
-    def show_help():
-        """Muestra la ayuda con ejemplos de comandos"""
-        print("\n" + "=" * 60)
-        print("INTERACTIVE MODE - WSO2 OAUTH2 - INTELLIGENT ECOMMERCE MANAGEMENT")
-        print("=" * 60)
-        if DIRECT_MODE:
-            print("[DIRECT MODE] Responses will be exact Shopify data without processing")
-        print("\nTry these queries:")
-        print("  - 'List products'")
-        print("  - 'How many products do you have?'")
-        print("  - 'Show products from lowest to highest price'")
-        print("  - 'Sort products from highest to lowest price'")
-        print(f"  {Colors.blue('UPDATE BY ID:')}")
-        print("  - 'Change price of product ID 123456 to 99.99'")
-        print("  - 'Update ID 789012 to 150 dollars'")
-        print(f"  {Colors.blue('UPDATE BY NAME:')}")  
-        print("  - 'Modify price of Gift Card to 200'")
-        print("  - 'Change price of The Draft Snowboard to 1500'")
-        print(f"  {Colors.blue('MATH OPERATIONS:')}")
-        print("  - 'Update The Complete Snowboard adding 1000'")
-        print("  - 'Modify Gift Card adding 50'")
-        print("  - 'Change ID 123456 subtracting 100'")
-        print(f"  {Colors.blue('PRICE RESTORATION:')}")
-        print("  - 'Restore previous price of ID 123456'")
-        print("  - 'Revert original price of ID 789012'")
-        print("\nType 'quit' or 'exit' to quit")
-        print("-" * 60)
+    response_cache = None
+    if not args.no_response_cache:
+        response_cache = ResponseCache(args.response_cache_path,
+                                       embedder=kernel if RESPONSE_CACHE_SIMILARITY > 0 else None)
     
-    # Mostrar ayuda solo en modo debug
-    if DEBUG_MODE:
-        show_help()
-    else:
-        print("\n" + Colors.green("Agent ready. Type your query or 'help' for examples."))
+    agent = AgentWithManualExecution(kernel, shopify_plugin, response_policy=response_policy,
+                                     stream=not args.no_stream, response_cache=response_cache, shops=shops)  # <<< SEMANTIC KERNEL
+    startup.mark("agente")
+    if DEBUG_MODE or args.startup_report:
+        print(Colors.blue(startup.report()))
     
-    while True:
+    batch_summary = None
+    if args.batch:
+        if args.batch == '-':
+            queries = list(read_batch_queries(sys.stdin))
+        else:
+            with open(args.batch, encoding='utf-8') as source:
+                queries = list(read_batch_queries(source))
+        # Un agente (historial propio) por consulta; plugin, token, sesión HTTP y cachés compartidos
+        def make_agent():
+            return AgentWithManualExecution(kernel, shopify_plugin, response_policy=response_policy,
+                                            stream=False, response_cache=response_cache, shops=shops)  # <<< SEMANTIC KERNEL
+        try:
+            batch_summary = await run_batch(make_agent, queries, results_out, concurrency=args.concurrency)
+        finally:
+            if args.output != '-':
+                results_out.close()
+        print(Colors.blue(batch_summary.report()))
+    elif args.serve:
+        # Un agente por sesión: las respuestas se entregan por HTTP/SSE, no por consola
+        def make_agent():
+            return AgentWithManualExecution(kernel, shopify_plugin, response_policy=response_policy,
+                                            stream=not args.no_stream, response_cache=response_cache, echo=False,
+                                            shops=shops)  # <<< SEMANTIC KERNEL
         try:
-            user_input = input("\nYou: ")
-            if user_input.lower() in ['quit', 'exit']:
-                print("\nGoodbye!")
+            await run_server(AgentServer(make_agent, api_key=os.getenv("SERVER_API_KEY")), args.host, args.port)
+        except asyncio.CancelledError:
+            print("\nServidor detenido")
+    else:
+        def show_help():
+            """Muestra la ayuda con ejemplos de comandos"""
+            print("\n" + "=" * 60)
+            print("INTERACTIVE MODE - WSO2 OAUTH2 - INTELLIGENT ECOMMERCE MANAGEMENT")
+            print("=" * 60)
+            if DIRECT_MODE:
+                print("[DIRECT MODE] Responses will be exact Shopify data without processing")
+            print("\nTry these queries:")
+            print("  - 'List products'")
+            print("  - 'How many products do you have?'")
+            print("  - 'Show products from lowest to highest price'")
+            print("  - 'Sort products from highest to lowest price'")
+            print(f"  {Colors.blue('UPDATE BY ID:')}")
+            print("  - 'Change price of product ID 123456 to 99.99'")
+            print("  - 'Update ID 789012 to 150 dollars'")
+            print(f"  {Colors.blue('UPDATE BY NAME:')}")  
+            print("  - 'Modify price of Gift Card to 200'")
+            print("  - 'Change price of The Draft Snowboard to 1500'")
+            print(f"  {Colors.blue('MATH OPERATIONS:')}")
+            print("  - 'Update The Complete Snowboard adding 1000'")
+            print("  - 'Modify Gift Card adding 50'")
+            print("  - 'Change ID 123456 subtracting 100'")
+            print(f"  {Colors.blue('PRICE RESTORATION:')}")
+            print("  - 'Restore previous price of ID 123456'")
+            print("  - 'Revert original price of ID 789012'")
+            print("  - 'Undo the last bulk update'")
+            print("  - 'What changed today?'")
+            print("\nType 'quit' or 'exit' to quit")
+            print("-" * 60)
+    
+        # Mostrar ayuda solo en modo debug
+        if DEBUG_MODE:
+            show_help()
+        else:
+            print("\n" + Colors.green("Agent ready. Type your query or 'help' for examples."))
+    
+        while True:
+            try:
+                user_input = input("\nYou: ")
+                if user_input.lower() in ['quit', 'exit']:
+                    print("\nGoodbye!")
+                    break
+                elif user_input.lower() in ['help', '?']:
+                    show_help()
+                    continue
+                await agent.process_with_guaranteed_execution(user_input)
+            except (EOFError, KeyboardInterrupt):
+                print("\n\nGoodbye!")
                 break
-            elif user_input.lower() in ['help', '?']:
-                show_help()
-                continue
-            await agent.process_with_guaranteed_execution(user_input)
-        except (EOFError, KeyboardInterrupt):
-            print("\n\nGoodbye!")
-            break
-        except Exception as e:
-            print(f"\n{Colors.red('ERROR')} Error inesperado: {e}")
-            break
+            except Exception as e:
+                print(f"\n{Colors.red('ERROR')} Error inesperado: {e}")
+                break
+
+    if DEBUG_MODE or sum(response_policy.llm_avoided.values()):
+        print(Colors.blue(response_policy.summary()))
+    if DEBUG_MODE and agent.latency.total:
+        print(Colors.blue(agent.latency.summary()))
+    if DEBUG_MODE:
+        print(Colors.blue(agent.history.stats()))
+        for shop, scheduler in _call_schedulers.items():
+            print(Colors.blue(f"Planificador de Shopify '{shop}': {scheduler.stats()}"))
+    if response_cache:
+        if DEBUG_MODE:
+            print(Colors.blue(response_cache.summary()))
+        response_cache.close()
+    if PROFILER.enabled:
+        print(Colors.blue(PROFILER.summary()))
+        if args.profile_output:
+            PROFILER.export(args.profile_output)
+            print(Colors.blue(f"Perfil exportado a {args.profile_output}"))
+
+    # Cerrar pools HTTP, snapshots e historiales de las tiendas
+    await shops.aclose()
+    if batch_summary and batch_summary.failed:
+        return 1
 
 if __name__ == "__main__":
     import urllib3
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    asyncio.run(main())
\ No newline at end of file
+    sys.exit(asyncio.run(main()))
\ No newline at end of file
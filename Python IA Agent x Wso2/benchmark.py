@@ -0,0 +1,494 @@
+"""
+Banco de pruebas sin conexión del agente de Shopify.
+
+Levanta un servidor local (aiohttp) que imita el endpoint de tokens de WSO2, la API REST de
+Shopify detrás del Gateway y el servicio de chat de OpenAI, y ejecuta cargas de trabajo
+guionizadas contra ShopifyPlugin / AsyncShopifyPlugin y AgentWithManualExecution.
+Informa de throughput y latencia (p50/p95/máx) por carga de trabajo.
+
+    python benchmark.py                                   # Todas las cargas con la configuración por defecto
+    python benchmark.py --catalog-size 2000 --latency-ms 50
+    python benchmark.py --workloads list_cold,update_price --plugin sync
+    python benchmark.py --output actual.json --baseline anterior.json
+
+No usa credenciales reales: las variables de WSO2, Shopify y OpenAI del proceso se sustituyen
+por las del servidor local (OPENAI_BASE_URL apunta al servicio de chat simulado).
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from aiohttp import web
+
+GATEWAY_PREFIX = "/shopify/1.0.0"  # Contexto de la API de Shopify en el Gateway (igual que ShopifyPlugin._build_api_url)
+CALL_LIMIT = 40                    # Capacidad del leaky bucket de Shopify que se anuncia en las cabeceras
+
+# ============================================
+# SERVIDOR LOCAL (WSO2 + SHOPIFY + OPENAI)
+# ============================================
+
+def make_catalog(size: int) -> list:
+    """Catálogo sintético: un producto por índice, con una variante; uno de cada cincuenta lleva la etiqueta 'oferta'."""
+    stamp = "2026-01-01T00:00:00Z"
+    return [{
+        "id": 7000000000 + i,
+        "title": f"Producto {i}",
+        "body_html": f"<p>Descripción del producto {i}</p>",
+        "tags": "oferta" if i % 50 == 0 else "catalogo",
+        "product_type": ["Snowboard", "Accesorio", "Gift Card"][i % 3],
+        "vendor": "Bench",
+        "updated_at": stamp,
+        "variants": [{"id": 8000000000 + i, "product_id": 7000000000 + i, "price": f"{10 + i % 500}.00", "updated_at": stamp}],
+    } for i in range(size)]
+
+
+class FakeBackend:
+    """
+    Servidor local que imita WSO2, Shopify y OpenAI, con latencia configurable.
+
+    Se ejecuta en su propio hilo y event loop, de modo que tanto el plugin síncrono (requests)
+    como el asíncrono (aiohttp) lo llaman como a un servicio remoto.
+    """
+
+    def __init__(self, catalog_size: int = 500, latency: float = 0.02, token_latency: float = 0.05,
+                 llm_first_token: float = 0.3, llm_chunk_delay: float = 0.02, llm_chunks: int = 8, leak_rate: float = 2.0):
+        self.products = make_catalog(catalog_size)
+        self.by_id = {product["id"]: product for product in self.products}
+        self.variants = {product["variants"][0]["id"]: product for product in self.products}
+        self.latency = latency
+        self.token_latency = token_latency
+        self.llm_first_token = llm_first_token
+        self.llm_chunk_delay = llm_chunk_delay
+        self.llm_chunks = llm_chunks
+        self.leak_rate = leak_rate  # Llamadas por segundo que vacía el bucket (2 = plan estándar de Shopify)
+        self.requests = Counter()  # Ruta → número de peticiones
+        self.faults = deque()      # Respuestas de error (status, cabeceras) que Shopify devuelve antes de las normales
+        self._bucket_level = 0.0
+        self._bucket_stamp = time.monotonic()
+        self._loop = None
+        self._runner = None
+        self.base_url = None
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> str:
+        """Arranca el servidor en segundo plano y devuelve su URL base"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.build_app())
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/token", self.token)
+        app.router.add_get(GATEWAY_PREFIX + "/products.json", self.list_products)
+        app.router.add_get(GATEWAY_PREFIX + "/products/count.json", self.count_products)
+        app.router.add_get(GATEWAY_PREFIX + "/products/{product_id}.json", self.get_product)
+        app.router.add_put(GATEWAY_PREFIX + "/products/{product_id}.json", self.put_product)
+        app.router.add_get(GATEWAY_PREFIX + "/variants/{variant_id}.json", self.get_variant)
+        app.router.add_put(GATEWAY_PREFIX + "/variants/{variant_id}.json", self.put_variant)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models/{model_id}", self.model)
+        return app
+
+    # --- WSO2 y Shopify ---
+
+    async def token(self, request):
+        self.requests["token"] += 1
+        await request.read()
+        await asyncio.sleep(self.token_latency)
+        return web.json_response({"access_token": uuid.uuid4().hex, "token_type": "Bearer", "expires_in": 3600})
+
+    async def _shopify(self, route: str, payload: dict, status: int = 200, headers: dict = None):
+        """Respuesta de Shopify tras la latencia configurada, con la cabecera de límite de llamadas (429 si el cubo está lleno)"""
+        self.requests[route] += 1
+        if self.faults:
+            status, fault_headers = self.faults.popleft()
+            self.requests[str(status)] += 1
+            return web.json_response({"errors": f"Fallo simulado {status}"}, status=status, headers=fault_headers)
+        now = time.monotonic()
+        self._bucket_level = max(0.0, self._bucket_level - (now - self._bucket_stamp) * self.leak_rate)
+        self._bucket_stamp = now
+        if self._bucket_level + 1 > CALL_LIMIT:
+            self.requests["429"] += 1
+            await asyncio.sleep(self.latency)
+            return web.json_response({"errors": "Exceeded 2 calls per second for api client. Reduce request rates to resume uninterrupted service."},
+                                     status=429, headers={"Retry-After": "2.0",
+                                                          "X-Shopify-Shop-Api-Call-Limit": f"{CALL_LIMIT}/{CALL_LIMIT}"})
+        self._bucket_level += 1
+        await asyncio.sleep(self.latency)
+        headers = dict(headers or {})
+        headers["X-Shopify-Shop-Api-Call-Limit"] = f"{min(CALL_LIMIT, int(self._bucket_level))}/{CALL_LIMIT}"
+        return web.json_response(payload, status=status, headers=headers)
+
+    @staticmethod
+    def _project(product: dict, fields: str) -> dict:
+        if not fields:
+            return product
+        wanted = set(fields.split(","))
+        return {key: value for key, value in product.items() if key in wanted}
+
+    async def list_products(self, request):
+        query = request.query
+        limit = min(int(query.get("limit", "50")), 250)
+        start = int(query.get("page_info", "0"))
+        products = self.products
+        if query.get("updated_at_min"):
+            since = query["updated_at_min"].replace("+00:00", "Z")
+            products = [product for product in products if product["updated_at"] >= since]
+        page = [self._project(product, query.get("fields")) for product in products[start:start + limit]]
+        headers = {}
+        if start + limit < len(products):
+            next_url = f"{self.base_url}{GATEWAY_PREFIX}/products.json?limit={limit}&page_info={start + limit}"
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return await self._shopify("products", {"products": page}, headers=headers)
+
+    async def count_products(self, request):
+        return await self._shopify("count", {"count": len(self.products)})
+
+    async def get_product(self, request):
+        product = self.by_id.get(int(request.match_info["product_id"]))
+        if product is None:
+            return await self._shopify("product", {"errors": "Not Found"}, status=404)
+        return await self._shopify("product", {"product": product})
+
+    async def get_variant(self, request):
+        product = self.variants.get(int(request.match_info["variant_id"]))
+        if product is None:
+            return await self._shopify("variant", {"errors": "Not Found"}, status=404)
+        return await self._shopify("variant", {"variant": self._project(product["variants"][0], request.query.get("fields"))})
+
+    def _set_price(self, product: dict, price: str) -> dict:
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        variant = product["variants"][0]
+        variant["price"] = str(price)
+        variant["updated_at"] = product["updated_at"] = stamp
+        return variant
+
+    async def put_product(self, request):
+        body = await request.json()
+        product = self.by_id.get(int(request.match_info["product_id"]))
+        if product is None:
+            return await self._shopify("put_product", {"errors": "Not Found"}, status=404)
+        for variant in body.get("product", {}).get("variants", []):
+            if variant.get("id") == product["variants"][0]["id"]:
+                self._set_price(product, variant["price"])
+        return await self._shopify("put_product", {"product": product})
+
+    async def put_variant(self, request):
+        body = await request.json()
+        product = self.variants.get(int(request.match_info["variant_id"]))
+        if product is None:
+            return await self._shopify("put_variant", {"errors": "Not Found"}, status=404)
+        return await self._shopify("put_variant", {"variant": self._set_price(product, body["variant"]["price"])})
+
+    # --- OpenAI ---
+
+    async def model(self, request):
+        self.requests["llm_model"] += 1
+        return web.json_response({"id": request.match_info["model_id"], "object": "model", "created": 0, "owned_by": "benchmark"})
+
+    def _reply_chunks(self, body: dict) -> list:
+        prompt_chars = sum(len(str(message.get("content") or "")) for message in body.get("messages", []))
+        words = f"Respuesta simulada del modelo para un prompt de {prompt_chars} caracteres.".split(" ")
+        size = max(1, len(words) // self.llm_chunks)
+        return [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.requests["llm"] += 1
+        chunks = self._reply_chunks(body)
+        completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex[:12]}", int(time.time()), body.get("model", "stub")
+        if not body.get("stream"):
+            await asyncio.sleep(self.llm_first_token + self.llm_chunk_delay * (len(chunks) - 1))
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+        await asyncio.sleep(self.llm_first_token)
+        for index, chunk in enumerate(chunks + [None]):
+            if index:
+                await asyncio.sleep(self.llm_chunk_delay)
+            delta = {"role": "assistant", "content": chunk} if chunk is not None else {}
+            event = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None if chunk is not None else "stop"}]}
+            await stream.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        await stream.write(b"data: [DONE]\n\n")
+        await stream.write_eof()
+        return stream
+
+# ============================================
+# CARGAS DE TRABAJO
+# ============================================
+
+class WorkloadResult:
+    """Latencias de una carga de trabajo"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def to_dict(self) -> dict:
+        ordered = sorted(self.latencies) or [0.0]
+        return {
+            "ops": len(self.latencies),
+            "errors": self.errors,
+            "seconds": round(self.elapsed, 3),
+            "ops_per_s": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+
+
+async def _call(function, *args, **kwargs):
+    """Llama a una función del plugin síncrono (en un hilo) o asíncrono (directamente)"""
+    if inspect.iscoroutinefunction(function):
+        return await function(*args, **kwargs)
+    return await asyncio.to_thread(function, *args, **kwargs)
+
+
+def _is_failure(result) -> bool:
+    ok = getattr(result, "ok", None)
+    return result is None or ok is False
+
+
+class Workloads:
+    """Cargas guionizadas sobre el plugin y el agente (cada una es una corrutina por operación)"""
+
+    def __init__(self, agent_module, plugin, kernel, seed: int = 7):
+        self.a = agent_module
+        self.plugin = plugin
+        self.kernel = kernel
+        self.random = random.Random(seed)
+
+    def _random_product(self, catalog_size: int) -> str:
+        return str(7000000000 + self.random.randrange(catalog_size))
+
+    def _agent(self, policy: str = "auto"):
+        return self.a.AgentWithManualExecution(self.kernel, self.plugin, response_policy=self.a.ResponsePolicy.parse(policy),
+                                               stream=True, response_cache=None, echo=False)
+
+    def build(self, catalog_size: int) -> dict:
+        """Nombre → (descripción, operación)"""
+        plugin = self.plugin
+
+        async def list_cold():
+            plugin.catalog_cache.invalidate()
+            return await _call(plugin.get_products_list)
+
+        async def list_warm():
+            return await _call(plugin.get_products_list)
+
+        async def sort_warm():
+            return await _call(plugin.get_products_sorted, "asc")
+
+        async def count():
+            return await _call(plugin.count_products)
+
+        async def search():
+            return await _call(plugin.find_product_by_name, f"Producto {self.random.randrange(catalog_size)}")
+
+        async def update_price():
+            return await _call(plugin.update_product_price, self._random_product(catalog_size), f"{self.random.randrange(10, 900)}.00")
+
+        async def math_update():
+            return await _call(plugin.update_product_price_with_math, self._random_product(catalog_size), "percent_increase", 1.0)
+
+        async def bulk_update():
+            result = await _call(plugin.bulk_update_prices, "oferta", "add", 1.0, filter_field="tag")
+            await _call(plugin.revert_batch, "")
+            return result
+
+        scripted = ["List products", "ordena los productos de menor a mayor precio"]
+
+        async def agent_local():
+            query = self.random.choice(scripted + [f"Change price of product ID {self._random_product(catalog_size)} to 19.99"])
+            return await self._agent().process_with_guaranteed_execution(query)
+
+        async def agent_llm():
+            query = self.random.choice(["¿Cuál es el producto más caro?", "hola, ¿qué puedes hacer?"])
+            return await self._agent().process_with_guaranteed_execution(query)
+
+        return {
+            "list_cold": ("listado completo sin caché (paginado)", list_cold),
+            "list_warm": ("listado servido desde la caché", list_warm),
+            "sort_warm": ("ordenación por precio desde la caché", sort_warm),
+            "count": ("conteo de productos", count),
+            "search": ("búsqueda por nombre", search),
+            "update_price": ("cambio de precio por ID", update_price),
+            "math_update": ("cambio de precio con operación matemática", math_update),
+            "bulk_update": ("actualización masiva por etiqueta + revertir lote", bulk_update),
+            "agent_local": ("agente: intenciones respondidas sin LLM", agent_local),
+            "agent_llm": ("agente: preguntas abiertas con el LLM simulado", agent_llm),
+        }
+
+
+async def run_workload(name: str, operation, iterations: int, concurrency: int) -> WorkloadResult:
+    """Ejecuta `iterations` operaciones con como mucho `concurrency` simultáneas"""
+    result = WorkloadResult(name)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                failed = _is_failure(await operation())
+            except Exception as e:
+                print(f"   {name}: {type(e).__name__}: {e}", file=sys.stderr)
+                failed = True
+            result.latencies.append(time.perf_counter() - started)
+            result.errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one() for _ in range(iterations)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+# ============================================
+# INFORME Y COMPARACIÓN
+# ============================================
+
+def format_report(results: dict, baseline: dict = None) -> str:
+    width = max(len(name) for name in results)
+    lines = [f"{'carga'.ljust(width)}  {'ops':>5} {'err':>4} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'máx ms':>9}"]
+    for name, stats in results.items():
+        line = (f"{name.ljust(width)}  {stats['ops']:>5} {stats['errors']:>4} {stats['ops_per_s']:>9.2f} "
+                f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+        previous = (baseline or {}).get(name)
+        if previous and previous.get("p50_ms"):
+            line += (f"   p50 {(stats['p50_ms'] / previous['p50_ms'] - 1) * 100:+.0f}%"
+                     f", ops/s {(stats['ops_per_s'] / previous['ops_per_s'] - 1) * 100 if previous['ops_per_s'] else 0:+.0f}%")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def configure_environment(base_url: str, leak_rate: float):
+    """Dirige el agente al servidor local (sustituye cualquier credencial real del entorno)"""
+    os.environ.update({
+        "SHOPIFY_LEAK_RATE": str(leak_rate),
+        "WSO2_TOKEN_ENDPOINT": f"{base_url}/token",
+        "WSO2_CONSUMER_KEY": "benchmark",
+        "WSO2_CONSUMER_SECRET": "benchmark",
+        "WSO2_GW_URL": base_url,
+        "SHOPIFY_API_TOKEN": "benchmark",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+    })
+
+
+async def run(args) -> dict:
+    backend = FakeBackend(catalog_size=args.catalog_size, latency=args.latency_ms / 1000,
+                          token_latency=args.token_latency_ms / 1000, llm_first_token=args.llm_first_token_ms / 1000,
+                          llm_chunk_delay=args.llm_chunk_ms / 1000, leak_rate=args.leak_rate)
+    configure_environment(backend.start(), args.leak_rate)
+    import agent_gpt4  # Después de configurar el entorno (load_dotenv no sobrescribe estas variables)
+
+    agent_gpt4.ThinkingIndicator.enabled = False
+    agent_gpt4.PROFILER.enabled = args.profile
+    workdir = tempfile.mkdtemp(prefix="agent-bench-")
+    plugin_class = agent_gpt4.ShopifyPlugin if args.plugin == "sync" else agent_gpt4.AsyncShopifyPlugin
+    plugin = plugin_class(catalog_cache=agent_gpt4.CatalogCache(ttl=3600),
+                          price_history=agent_gpt4.PriceHistory(os.path.join(workdir, "price_history.sqlite")))
+    kernel = agent_gpt4.LazyKernel(lambda: agent_gpt4.build_kernel(plugin, "gpt-4-turbo-preview"))
+    workloads = Workloads(agent_gpt4, plugin, kernel, seed=args.seed).build(args.catalog_size)
+
+    selected = args.workloads.split(",") if args.workloads else list(workloads)
+    unknown = [name for name in selected if name not in workloads]
+    if unknown:
+        raise SystemExit(f"Cargas desconocidas: {', '.join(unknown)} (disponibles: {', '.join(workloads)})")
+    if any(name.startswith("agent_llm") for name in selected):
+        kernel.start()  # Semantic Kernel se importa fuera de la medición
+
+    print(f"Servidor local {backend.base_url}: {args.catalog_size} productos, latencia Shopify {args.latency_ms:.0f} ms, "
+          f"primer token LLM {args.llm_first_token_ms:.0f} ms, plugin {args.plugin}")
+    results = {}
+    try:
+        if "agent_llm" in selected:
+            await kernel.get()
+        await _call(plugin.get_products_list)  # Calentamiento: token de WSO2 y caché del catálogo
+        for name in selected:
+            description, operation = workloads[name]
+            print(f"-> {name}: {description}")
+            results[name] = (await run_workload(name, operation, args.iterations, args.concurrency)).to_dict()
+    finally:
+        if isinstance(plugin, agent_gpt4.AsyncShopifyPlugin):
+            await plugin.aclose()
+        else:
+            plugin.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+        backend.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as source:
+            baseline = json.load(source).get("results")
+    print("\n" + format_report(results, baseline))
+    print(f"Peticiones al servidor local: {dict(backend.requests)}")
+    print(f"Planificador de Shopify: {plugin.call_scheduler.stats()}")
+    if args.profile:
+        print(agent_gpt4.PROFILER.summary())
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+              "results": results, "scheduler": plugin.call_scheduler.stats()}
+    if args.profile:
+        report["stages"] = agent_gpt4.PROFILER.to_dict()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banco de pruebas sin conexión del agente (WSO2/Shopify/OpenAI simulados)")
+    parser.add_argument("--workloads", help="Cargas separadas por comas (por defecto todas)")
+    parser.add_argument("--iterations", type=int, default=20, help="Operaciones por carga")
+    parser.add_argument("--concurrency", type=int, default=1, help="Operaciones simultáneas por carga")
+    parser.add_argument("--catalog-size", type=int, default=500, help="Productos del catálogo simulado")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latencia de cada llamada a Shopify a través del Gateway")
+    parser.add_argument("--token-latency-ms", type=float, default=50, help="Latencia del endpoint de tokens de WSO2")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300, help="Tiempo hasta el primer fragmento del LLM simulado")
+    parser.add_argument("--llm-chunk-ms", type=float, default=20, help="Tiempo entre fragmentos del LLM simulado")
+    parser.add_argument("--leak-rate", type=float, default=2.0,
+                        help="Llamadas/s que vacía el leaky bucket simulado de Shopify (2 = plan estándar; marca el ritmo de bulk_update)")
+    parser.add_argument("--plugin", choices=["async", "sync"], default="async", help="AsyncShopifyPlugin (aiohttp) o ShopifyPlugin (requests)")
+    parser.add_argument("--seed", type=int, default=7, help="Semilla de las cargas aleatorias")
+    parser.add_argument("--profile", action="store_true", help="Incluir el desglose por etapa del agente (p50/p95)")
+    parser.add_argument("--output", help="Guardar los resultados en JSON")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,76 @@
+"""
+Utilidades comunes de las pruebas (pytest).
+
+Las pruebas no usan credenciales reales: cada una levanta el servidor local de benchmark.py
+(WSO2 + Shopify detrás del Gateway + OpenAI simulados) y dirige el agente hacia él.
+"""
+
+import asyncio
+
+import pytest
+
+import agent_gpt4
+import benchmark
+
+agent_gpt4.ThinkingIndicator.enabled = False
+
+
+def backend_environment(base_url: str) -> dict:
+    """Variables que dirigen el agente al servidor local (mismas que benchmark.configure_environment)"""
+    return {
+        "WSO2_TOKEN_ENDPOINT": f"{base_url}/token",
+        "WSO2_CONSUMER_KEY": "test",
+        "WSO2_CONSUMER_SECRET": "test",
+        "WSO2_GW_URL": base_url,
+        "SHOPIFY_API_TOKEN": "test",
+        "OPENAI_API_KEY": "sk-test",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+    }
+
+
+@pytest.fixture
+def shopify_backend(monkeypatch):
+    """Arranca un FakeBackend (sin latencia por defecto) y apunta el entorno a él."""
+    started = []
+
+    def start(catalog_size: int = 20, latency: float = 0.0, backend_class=benchmark.FakeBackend, **options) -> benchmark.FakeBackend:
+        options.setdefault("token_latency", 0.0)
+        backend = backend_class(catalog_size=catalog_size, latency=latency, **options)
+        base_url = backend.start()
+        started.append(backend)
+        for name, value in backend_environment(base_url).items():
+            monkeypatch.setenv(name, value)
+        return backend
+
+    yield start
+    for backend in started:
+        backend.stop()
+
+
+@pytest.fixture
+def make_plugin(tmp_path):
+    """Construye plugins aislados: transporte, token, caché, historial y planificador propios."""
+    created = []
+
+    def build(plugin_class=agent_gpt4.ShopifyPlugin, **overrides):
+        transport = overrides.pop("transport", None) or agent_gpt4.HttpTransport(max_retries=0)
+        options = {
+            "transport": transport,
+            "token_manager": agent_gpt4.WSO2TokenManager(transport=transport),
+            "catalog_cache": agent_gpt4.CatalogCache(ttl=3600),
+            "price_history": agent_gpt4.PriceHistory(str(tmp_path / f"price_history_{len(created)}.sqlite")),
+            "call_scheduler": agent_gpt4.ShopifyCallScheduler("test"),
+        }
+        if plugin_class is agent_gpt4.AsyncShopifyPlugin:
+            options["async_transport"] = agent_gpt4.AsyncHttpTransport(max_retries=0)
+        options.update(overrides)
+        plugin = plugin_class(**options)
+        created.append(plugin)
+        return plugin
+
+    yield build
+    for plugin in created:
+        if isinstance(plugin, agent_gpt4.AsyncShopifyPlugin):
+            asyncio.run(plugin.aclose())
+        else:
+            plugin.close()
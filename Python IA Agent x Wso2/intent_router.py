@@ -0,0 +1,388 @@
+"""
+Router de intenciones del agente de Shopify.
+
+Convierte el mensaje del usuario en una `Intent` (función a ejecutar, ID o nombre de producto,
+operación matemática, precio, orden o filtro masivo). Toda la gramática (palabras clave y
+patrones, en español e inglés) se compila una sola vez al importar el módulo: cada familia de
+palabras clave es una única alternancia regex y los patrones se evalúan ya compilados, de modo
+que enrutar un mensaje tiene un coste fijo aunque se añadan idiomas.
+
+Uso desde la línea de comandos:
+    python intent_router.py --check     # Compara con el corpus de referencia (intent_corpus.jsonl)
+    python intent_router.py --bench     # Microbenchmark sobre el corpus
+    python intent_router.py "actualiza Gift Card a 200"
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, asdict
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.jsonl")
+
+
+@dataclass(frozen=True)
+class Intent:
+    """Intención detectada. `function` es None si el mensaje no corresponde a ninguna función de Shopify."""
+    function: str = None        # 'list' | 'count' | 'sort' | 'update_price' | 'revert' | 'bulk_update' | 'revert_batch' | 'price_changes'
+    product_id: str = None
+    product_name: str = None
+    new_price: str = None       # Precio absoluto (tal como aparece en el mensaje)
+    operation: str = None       # add | subtract | divide | multiply | percent_reduce | percent_increase
+    value: float = None
+    sort_order: str = None      # 'asc' | 'desc'
+    filter_text: str = None     # Solo bulk_update
+    filter_field: str = None    # Solo bulk_update: any | tag | product_type | vendor
+    batch_id: str = None        # Solo revert_batch (None = el último lote)
+    period: str = None          # Solo price_changes: today | yesterday | week
+
+    def to_dict(self) -> dict:
+        """Campos informados (sin los None), p.ej. para el corpus de referencia."""
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+# ============================================
+# GRAMÁTICA (se compila una vez al importar)
+# ============================================
+
+def _keywords(*words) -> re.Pattern:
+    """Alternancia única equivalente a `any(palabra in texto for palabra in words)`."""
+    return re.compile("|".join(re.escape(word) for word in sorted(set(words), key=len, reverse=True)))
+
+
+def _any_of(patterns) -> re.Pattern:
+    """Alternancia única equivalente a `any(re.search(p, texto) for p in patterns)`."""
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+LIST_KEYWORDS = _keywords(
+    'productos', 'lista', 'catálogo', 'disponible', 'tienes', 'mostrar', 'ver', 'dame',
+    'barata', 'barato', 'cara', 'caro', 'cuesta', 'económico', 'costoso',
+    'tabla', 'tablas', 'opciones', 'alternativas', 'oferta',
+    'products', 'list', 'catalog', 'available', 'have', 'show', 'display', 'give',
+    'cheap', 'expensive', 'cost', 'affordable', 'costly',
+    'table', 'options', 'alternatives', 'offer')
+COUNT_KEYWORDS = _keywords('cuántos', 'cantidad', 'número', 'total', 'how many', 'count', 'number')
+SORT_KEYWORDS = _keywords('menor', 'mayor', 'ascendente', 'descendente', 'ordenar', 'orden',
+                          'lowest', 'highest', 'ascending', 'descending', 'sort', 'order')
+SORT_ASC_WORDS = _keywords('menor', 'ascendente', 'bajo', 'barato')
+SORT_DESC_WORDS = _keywords('mayor', 'descendente', 'alto', 'caro')
+SORT_DEFAULT_WORDS = _keywords('orden', 'ordenar')
+REVERT_KEYWORDS = _keywords('vuelve', 'restaurar', 'deshacer', 'anterior', 'original', 'revertir', 'dejarlo',
+                            'revert', 'restore', 'undo', 'previous', 'back')
+BATCH_WORDS = _keywords('lote', 'masiva', 'masivo', 'batch', 'bulk')
+BATCH_REVERT_KEYWORDS = _keywords('revierte', 'revertir', 'deshaz', 'deshacer', 'restaura', 'restaurar', 'anula', 'anular',
+                                  'revert', 'undo', 'roll back', 'rollback', 'restore')
+PRICE_CHANGES_KEYWORDS = _keywords(
+    'cambios de precio', 'qué ha cambiado', 'que ha cambiado', 'qué cambió', 'que cambió', 'que cambio',
+    'historial de precios', 'precios modificados', 'precios cambiados',
+    'price changes', 'what changed', 'changed today', 'price history', 'prices changed')
+PERIOD_YESTERDAY_WORDS = _keywords('ayer', 'yesterday')
+PERIOD_WEEK_WORDS = _keywords('semana', '7 días', '7 dias', 'week', '7 days')
+UPDATE_KEYWORDS = _keywords('actualizar', 'actualiza', 'cambiar', 'cambio', 'modificar', 'modifica',
+                            'update', 'change', 'modify', 'set')
+MATH_KEYWORDS = _keywords(
+    'añadiendo', 'añadiendole', 'añade', 'añadir', 'sumando', 'sumandole', 'agregando', 'agregandole',
+    'restando', 'restandole', 'quitando', 'quitandole', 'suma', 'sumar', 'add',
+    'resta', 'restar', 'subtract', 'quita', 'quitar',
+    'mitad', 'a la mitad', 'half', 'reduce', 'reducir', 'rebaja', 'descuento', '%',
+    'doble', 'al doble', 'duplicar', 'double', 'twice',
+    'aumenta', 'aumentar', 'incrementa', 'incrementar', 'sube', 'subir')
+HALF_WORDS = _keywords('a la mitad', 'mitad', 'half')
+DOUBLE_WORDS = _keywords('al doble', 'doble', 'duplicar', 'double', 'twice')
+
+BATCH_ID_PATTERN = re.compile(r'(?:lote|batch)\s+#?([0-9a-f]{8})\b')  # IDs de lote del historial de precios
+
+PRICE_PATTERN = _any_of([
+    r'a\s+[\$€]?\d+',                    # "a 1000"
+    r'precio\s+[\$€]?\d+',               # "precio 1000"
+    r'price\s+to\s+[\$€]?\d+',           # "price to 25"
+    r'to\s+[\$€]?\d+',                   # "to 25"
+    r'[\$€]\s*\d+',                      # "$1000"
+    r'añadiendo(?:le)?\s+\d+',           # "añadiendo 1000" o "añadiendole 1000"
+    r'añade\s+\d+',                      # "añade 10"
+    r'añadir\s+\d+',                     # "añadir 20"
+    r'suma\s+\d+',                       # "suma 50"
+    r'sumar\s+\d+',                      # "sumar 30"
+    r'resta\s+\d+',                      # "resta 40"
+    r'restar\s+\d+',                     # "restar 25"
+    r'aumenta\s+(?:un\s+)?\d+\s+por\s+ciento',  # "aumenta un 5 por ciento"
+    r'aumenta\s+(?:un\s+)?\d+%',         # "aumenta un 5%"
+    r'incrementa\s+(?:un\s+)?\d+\s+por\s+ciento',  # "incrementa un 10 por ciento"
+    r'incrementa\s+(?:un\s+)?\d+%',      # "incrementa un 10%"
+    r'incrementa\s+(?:el\s+precio\s+(?:de|del)\s+)?\w+(?:\s+\w+)*\s+(?:un\s+)?\d+%',  # "incrementa el precio de X un Y%"
+    r'sube\s+(?:un\s+)?\d+\s+por\s+ciento',  # "sube un 15 por ciento"
+    r'sube\s+(?:un\s+)?\d+%',            # "sube un 15%"
+    r'sumando(?:le)?\s+\d+',             # "sumando 500" o "sumandole 500"
+    r'agregando(?:le)?\s+\d+',           # "agregando 200" o "agregandole 200"
+    r'restando(?:le)?\s+\d+',            # "restando 100" o "restandole 100"
+    r'quitando(?:le)?\s+\d+',            # "quitando 50" o "quitandole 50"
+    r'adding\s+\d+',                     # "adding 100"
+    r'subtracting\s+\d+',                # "subtracting 50"
+])
+
+# Preguntas abiertas sobre el catálogo ("¿cuál es el más caro?", "do you have gift cards?"): requieren razonar sobre los datos
+OPEN_QUESTION_KEYWORDS = _keywords(
+    '?', '¿', 'cuál', 'cual', 'qué', 'tienes', 'barata', 'barato', 'cara', 'caro', 'cuesta', 'económico', 'costoso',
+    'opciones', 'alternativas', 'oferta', 'which', 'what', 'have', 'cheap', 'expensive', 'cost', 'affordable',
+    'costly', 'options', 'alternatives', 'offer', 'recommend', 'recomienda')
+
+ID_PATTERN = re.compile(r'id[:\s]*(\d+)')
+PRICE_VALUE_PATTERN = re.compile(r'(?:a|precio|€|euros?|$|dollars?)[:\s]*(\d+\.?\d*)')
+NUMBER_PATTERN = re.compile(r'(\d+\.?\d*)')
+
+# Operaciones matemáticas en orden de prioridad (gana el primer grupo con coincidencia)
+MATH_PATTERNS = [(operation, [re.compile(p) for p in patterns]) for operation, patterns in [
+    ('add', [
+        r'añadiendo(?:le)?\s+(\d+\.?\d*)',
+        r'añade\s+(\d+\.?\d*)',
+        r'añadir\s+(\d+\.?\d*)',
+        r'sumando(?:le)?\s+(\d+\.?\d*)',
+        r'agregando(?:le)?\s+(\d+\.?\d*)',
+        r'suma\s+(\d+\.?\d*)',
+        r'sumar\s+(\d+\.?\d*)',
+        r'add\s+(\d+\.?\d*)',
+    ]),
+    ('subtract', [
+        r'restando(?:le)?\s+(\d+\.?\d*)',
+        r'quitando(?:le)?\s+(\d+\.?\d*)',
+        r'resta\s+(\d+\.?\d*)',
+        r'restar\s+(\d+\.?\d*)',
+        r'quita\s+(\d+\.?\d*)',
+        r'quitar\s+(\d+\.?\d*)',
+        r'subtract\s+(\d+\.?\d*)',
+    ]),
+    ('divide', [r'a\s+la\s+mitad', r'\bmitad\b', r'\bhalf\b']),
+    ('multiply', [r'al\s+doble', r'\bdoble\b', r'duplicar', r'\bdouble\b', r'\btwice\b']),
+    ('percent_reduce', [r'(?:reduce|reducir|rebaja|descuento)\s+(\d+\.?\d*)%', r'(\b\d+\.?\d*%\b)']),
+    ('percent_increase', [
+        r'(?:incrementa|incrementar|sube|aumenta|increase|raise)\s+(?:un\s+)?(\d+\.?\d*)%',
+        r'aumenta\s+(?:el\s+precio\s+)?(?:en\s+)?(?:un\s+)?(\d+\.?\d*)%',
+        r'incrementa\s+(?:el\s+precio\s+)?(?:en\s+)?(?:un\s+)?(\d+\.?\d*)%',
+        r'sube\s+(?:el\s+precio\s+)?(?:en\s+)?(?:un\s+)?(\d+\.?\d*)%',
+        r'aumenta\s+(?:un\s+)?(\d+\.?\d*)\s+por\s+ciento',
+        r'incrementa\s+(?:un\s+)?(\d+\.?\d*)\s+por\s+ciento',
+        r'sube\s+(?:un\s+)?(\d+\.?\d*)\s+por\s+ciento',
+        r'aumenta\s+(?:un\s+)?(\d+\.?\d*)%',
+        r'incrementa\s+(?:un\s+)?(\d+\.?\d*)%',
+        r'sube\s+(?:un\s+)?(\d+\.?\d*)%',
+        r'incrementa\s+(?:el\s+precio\s+(?:de|del)\s+)?\w+(?:\s+\w+)*\s+(?:un\s+)?(\d+\.?\d*)%',  # "incrementa el precio de X un Y%"
+    ]),
+]]
+# Filtro previo: si ninguna operación coincide no se recorre la lista ordenada
+MATH_ANY = _any_of([pattern.pattern for _, patterns in MATH_PATTERNS for pattern in patterns])
+
+# Nombre del producto (bilingüe), en orden de prioridad
+NAME_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    # Patrones en español
+    r'(?:actualiza|actualizar|modifica|modificar|cambiar|cambio)\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)\s+(?:a|añadiendo|sumando|agregando|restando|quitando|suma|sumar|resta|restar)\s+[\d.]+',
+    r'(?:actualiza|actualizar|modifica|modificar|cambiar|cambio)\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)\s+(?:a\s+la\s+mitad|al\s+doble|duplicar)',
+    r'(?:aumenta|aumentar|incrementa|incrementar|sube|subir)\s+(?:un\s+)?\d+\s+por\s+ciento\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)$',
+    r'(?:aumenta|aumentar|incrementa|incrementar|sube|subir)\s+(?:un\s+)?\d+%\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)$',
+    r'(?:incrementa|incrementar)\s+(?:el\s+precio\s+(?:de|del)\s+)?(.+?)\s+(?:un\s+)?\d+%$',
+    r'precio\s+(?:de|del)\s+(.+?)\s+a\s+[\d.]+',
+    r'(.+?)\s+(?:añadiendo|sumando|agregando|restando|quitando|suma|sumar|resta|restar)\s+[\d.]+',
+    r'(?:suma|sumar|add)\s+[\d.]+\s*[\$€]?\s*(?:al\s+precio\s+(?:de|del)\s+|a\s+(?:la\s+)?)?(.+?)$',
+    r'(?:resta|restar|subtract)\s+[\d.]+\s*[\$€]?\s*(?:al\s+precio\s+(?:de|del)\s+|a\s+(?:la\s+)?)?(.+?)$',
+    r'(?:añade|añadir|add)\s+[\d.]+\s*[\$€]?\s*(?:al\s+precio\s+(?:de|del)\s+|a\s+(?:la\s+)?)?(.+?)$',
+    # Patrones en inglés
+    r'(?:update|change|modify|set)\s+(.+?)\s+(?:price\s+)?to\s+[\d.]+',  # "update Gift Card price to 25"
+    r'(?:update|change|modify)\s+(.+?)\s+(?:adding|subtracting)\s+[\d.]+',  # "update Gift Card adding 10"
+    r'(.+?)\s+price\s+to\s+[\d.]+',                                     # "Gift Card price to 25"
+]]
+NAME_STOP_WORDS = {'actualiza', 'actualizar', 'modifica', 'modificar', 'cambiar', 'cambio', 'el', 'precio', 'de', 'del'}
+# Fallback más agresivo si los patrones principales fallan
+NAME_FALLBACK = re.compile(r'(?:actualiza|actualizar|modifica|modificar|cambiar)\s+(?:el\s+precio\s+de\s+)?(.+?)(?:\s+(?:a|añadiendo|sumando|agregando|restando|quitando)|$)', re.IGNORECASE)
+NAME_FALLBACK_TAIL = re.compile(r'\s+(?:a|añadiendo|sumando|agregando|restando|quitando)\s+[\d.]+.*$')
+NAME_FALLBACK_STOP_WORDS = {'precio', 'de', 'del', 'el', 'la'}
+
+# Peticiones masivas: "raise every snowboard 10%", "discount tag sale by 15%", "sube un 10% todos los snowboards"
+_BULK_VERBS = r'(?P<verb>raise|increase|discount|reduce|lower|cut|sube|subir|aumenta|aumentar|incrementa|incrementar|rebaja|rebajar|descuenta|reducir|baja|bajar)'
+_BULK_VALUE = r'(?P<value>\d+(?:\.\d+)?)\s*(?:%|por\s+ciento|percent)'
+BULK_PATTERNS = [
+    re.compile(_BULK_VERBS + r'\s+(?:(?:el\s+)?precio\s+de\s+|the\s+price\s+of\s+)?(?:every|all(?:\s+the)?|todos\s+los|todas\s+las)\s+(?P<target>.+?)\s+(?:by\s+|un\s+|en\s+un\s+)?' + _BULK_VALUE),
+    re.compile(_BULK_VERBS + r'\s+(?:un\s+)?' + _BULK_VALUE + r'\s+(?:a\s+)?(?:every|all(?:\s+the)?|todos\s+los|todas\s+las)\s+(?P<target>.+?)\s*$'),
+    re.compile(_BULK_VERBS + r'\s+(?:(?:los\s+)?productos\s+(?:con\s+)?)?(?P<target>(?:tag|etiqueta|type|tipo|vendor)\s+.+?)\s+(?:by\s+|un\s+|en\s+un\s+)?' + _BULK_VALUE),
+]
+BULK_INCREASE_VERBS = {'raise', 'increase', 'sube', 'subir', 'aumenta', 'aumentar', 'incrementa', 'incrementar'}
+BULK_FILTER_PREFIXES = [
+    (re.compile(r'^(?:products\s+tagged|productos\s+con\s+(?:la\s+)?etiqueta|tag|etiqueta)\s+'), 'tag'),
+    (re.compile(r'^(?:type|tipo)\s+'), 'product_type'),
+    (re.compile(r'^vendor\s+'), 'vendor'),
+]
+
+
+# ============================================
+# ENRUTADO
+# ============================================
+
+def _parse_bulk(text: str) -> Intent or None:
+    for pattern in BULK_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        target = match.group('target').strip(' "\'.,')
+        filter_field = 'any'
+        for prefix, field in BULK_FILTER_PREFIXES:
+            if prefix.match(target):
+                target, filter_field = prefix.sub('', target).strip(' "\''), field
+                break
+        operation = 'percent_increase' if match.group('verb') in BULK_INCREASE_VERBS else 'percent_reduce'
+        return Intent('bulk_update', operation=operation, value=float(match.group('value')),
+                      filter_text=target, filter_field=filter_field)
+    return None
+
+
+def _parse_math(text: str, operation: str, value):
+    """Operación matemática por prioridad. Parte de la detectada por los atajos (mitad/doble), si la hay."""
+    if not MATH_ANY.search(text):
+        return operation, value
+    for candidate, patterns in MATH_PATTERNS:
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                operation = candidate
+                value = 2.0 if candidate == 'divide' else float(match.group(1).rstrip('%')) if match.groups() else 2.0
+                break
+        if operation:
+            break
+    return operation, value
+
+
+def _parse_product_name(text: str) -> str or None:
+    for pattern in NAME_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            words = [word for word in match.group(1).strip().split() if word.lower() not in NAME_STOP_WORDS]
+            if words:  # Solo si queda algo después de limpiar
+                return ' '.join(word.capitalize() for word in words)
+
+    match = NAME_FALLBACK.search(text)
+    if match:
+        extracted = NAME_FALLBACK_TAIL.sub('', match.group(1).strip())
+        words = [word for word in extracted.split() if word.lower() not in NAME_FALLBACK_STOP_WORDS]
+        if words:
+            return ' '.join(word.capitalize() for word in words)
+    return None
+
+
+def _parse_update(text: str, operation: str, value) -> Intent:
+    operation, value = _parse_math(text, operation, value)
+
+    # Si no hay operación matemática, buscar precio directo (o, en su defecto, el último número)
+    new_price = None
+    if not operation:
+        price_match = PRICE_VALUE_PATTERN.search(text)
+        if price_match:
+            new_price = price_match.group(1)
+        else:
+            numbers = NUMBER_PATTERN.findall(text)
+            if numbers:
+                new_price = numbers[-1]
+
+    id_match = ID_PATTERN.search(text)
+    if id_match:
+        return Intent('update_price', product_id=id_match.group(1), new_price=new_price, operation=operation, value=value)
+    return Intent('update_price', product_name=_parse_product_name(text), new_price=new_price,
+                  operation=operation, value=value)
+
+
+def route(user_input: str) -> Intent:
+    """Devuelve la intención del mensaje (Intent() vacía si no corresponde a ninguna función)."""
+    text = user_input.lower()
+    has_update_keyword = UPDATE_KEYWORDS.search(text) is not None
+
+    # Atajos: "a la mitad"/"half" => dividir por 2, "al doble"/"duplicar" => multiplicar por 2
+    operation = value = None
+    if has_update_keyword and HALF_WORDS.search(text):
+        operation, value = 'divide', 2
+    if has_update_keyword and DOUBLE_WORDS.search(text):
+        operation, value = 'multiply', 2
+
+    # Historial de precios: consultas y reversión de lotes, antes que la gramática de actualización
+    if PRICE_CHANGES_KEYWORDS.search(text):
+        if PERIOD_YESTERDAY_WORDS.search(text):
+            return Intent('price_changes', period='yesterday')
+        return Intent('price_changes', period='week' if PERIOD_WEEK_WORDS.search(text) else 'today')
+    if BATCH_REVERT_KEYWORDS.search(text) and BATCH_WORDS.search(text):
+        batch_match = BATCH_ID_PATTERN.search(text)
+        return Intent('revert_batch', batch_id=batch_match.group(1) if batch_match else None)
+
+    bulk = _parse_bulk(text)
+    if bulk:
+        return bulk
+    if (has_update_keyword or MATH_KEYWORDS.search(text)) and (operation or PRICE_PATTERN.search(text)):
+        return _parse_update(text, operation, value)
+    if REVERT_KEYWORDS.search(text):
+        id_match = ID_PATTERN.search(text)
+        return Intent('revert', product_id=id_match.group(1) if id_match else None)
+    if SORT_KEYWORDS.search(text):
+        if SORT_ASC_WORDS.search(text):
+            return Intent('sort', sort_order='asc')
+        if SORT_DESC_WORDS.search(text):
+            return Intent('sort', sort_order='desc')
+        if SORT_DEFAULT_WORDS.search(text):
+            return Intent('sort', sort_order='desc')  # Por defecto mayor a menor
+        return Intent()
+    if LIST_KEYWORDS.search(text):
+        return Intent('list')
+    if COUNT_KEYWORDS.search(text):
+        return Intent('count')
+    return Intent()
+
+
+def is_open_question(user_input: str) -> bool:
+    """True si el mensaje pide algo más que los datos tal cual (comparar, filtrar, recomendar)."""
+    return OPEN_QUESTION_KEYWORDS.search(user_input.lower()) is not None
+
+
+# ============================================
+# CORPUS DE REFERENCIA Y MICROBENCHMARK
+# ============================================
+
+def load_corpus(path: str = CORPUS_PATH) -> list:
+    with open(path, encoding="utf-8") as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def check_corpus(path: str = CORPUS_PATH) -> int:
+    """Compara el router con el corpus. Devuelve el número de discrepancias."""
+    failures = 0
+    corpus = load_corpus(path)
+    for case in corpus:
+        got = route(case["text"]).to_dict()
+        if json.dumps(got, sort_keys=True) != json.dumps(case["intent"], sort_keys=True):
+            failures += 1
+            print(f"DIFF {case['text']!r}\n  esperado: {case['intent']}\n  obtenido: {got}")
+    print(f"{len(corpus) - failures}/{len(corpus)} casos correctos")
+    return failures
+
+
+def bench(path: str = CORPUS_PATH, rounds: int = 200):
+    texts = [case["text"] for case in load_corpus(path)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            route(text)
+    elapsed = time.perf_counter() - start
+    per_message = elapsed / (rounds * len(texts)) * 1e6
+    print(f"{rounds * len(texts)} mensajes en {elapsed:.3f}s → {per_message:.1f} µs/mensaje")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Router de intenciones del agente de Shopify")
+    parser.add_argument("text", nargs="*", help="Mensaje a enrutar")
+    parser.add_argument("--check", action="store_true", help="Verificar contra el corpus de referencia")
+    parser.add_argument("--bench", action="store_true", help="Microbenchmark sobre el corpus")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="Ruta del corpus JSONL")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check_corpus(args.corpus) else 0)
+    if args.bench:
+        bench(args.corpus)
+    if args.text:
+        print(route(" ".join(args.text)).to_dict())
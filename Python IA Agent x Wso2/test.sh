@@ -10,6 +10,36 @@ set -e
 echo "🚀 TEST COMPLETO WSO2-SHOPIFY"
 echo "============================================"
 
+# Comprobaciones sin credenciales: router de intenciones y pruebas automáticas
+run_offline_checks() {
+    # Router de intenciones contra el corpus de referencia
+    if python3 intent_router.py --check > /tmp/intent_check.txt 2>&1; then
+        echo "✅ Router de intenciones: $(tail -n 1 /tmp/intent_check.txt)"
+    else
+        echo "❌ El router de intenciones no coincide con intent_corpus.jsonl:"
+        cat /tmp/intent_check.txt
+        OFFLINE_FAILED=1
+    fi
+
+    # Pruebas automáticas contra el servidor local de benchmark.py (sin credenciales reales)
+    if python3 -m pytest -q > /tmp/pytest_output.txt 2>&1; then
+        echo "✅ Pruebas: $(tail -n 1 /tmp/pytest_output.txt)"
+    else
+        echo "❌ Fallan pruebas:"
+        tail -n 30 /tmp/pytest_output.txt
+        OFFLINE_FAILED=1
+    fi
+    rm -f /tmp/intent_check.txt /tmp/pytest_output.txt
+}
+
+OFFLINE_FAILED=0
+
+# ./test.sh --offline: solo las comprobaciones sin credenciales (no necesita .env ni venv)
+if [ "$1" == "--offline" ]; then
+    run_offline_checks
+    exit $OFFLINE_FAILED
+fi
+
 # Verificar archivo .env en directorio actual
 if [ ! -f ".env" ]; then
     echo "❌ Error: No se encuentra .env en $(pwd)"
@@ -102,6 +132,8 @@ else
     echo "❌ No se encuentra agent_gpt4.py"
 fi
 
+run_offline_checks
+
 # Resumen
 echo ""
 echo "============================================"
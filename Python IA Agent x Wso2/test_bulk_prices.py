@@ -0,0 +1,72 @@
+"""Actualización masiva de precios: selección fresca, historial y aritmética Decimal."""
+
+import asyncio
+
+import pytest
+
+import agent_gpt4
+
+OFFER_IDS = (7000000000, 7000000050)  # Productos con la etiqueta 'oferta' en un catálogo de 60
+
+
+def _call(plugin, name, *args, **kwargs):
+    result = getattr(plugin, name)(*args, **kwargs)
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_bulk_update_ignores_stale_cached_prices(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend(catalog_size=60)
+    plugin = make_plugin(plugin_class)
+
+    # Una búsqueda sin coincidencia exacta recorre (y cachea) el catálogo con los campos de búsqueda
+    _call(plugin, "find_product_by_name", "zzz")
+    assert plugin.catalog_cache.full_catalog(agent_gpt4.SEARCH_FIELDS) is not None
+    stale = plugin.catalog_cache.get(OFFER_IDS[1], agent_gpt4.SEARCH_FIELDS)["variants"][0]["price"]
+
+    # Alguien cambia el precio en Shopify mientras la caché sigue vigente
+    backend._set_price(backend.by_id[OFFER_IDS[1]], "99.00")
+
+    result = _call(plugin, "bulk_update_prices", "oferta", "add", 1, filter_field="tag")
+
+    assert result.ok, result.message
+    assert backend.by_id[OFFER_IDS[1]]["variants"][0]["price"] == "100.00"
+    change = plugin.price_history.latest_change(str(OFFER_IDS[1]))
+    assert change["old_price"] == "99.00" != stale
+    assert change["new_price"] == "100.00"
+    assert plugin.catalog_cache.get(OFFER_IDS[1], agent_gpt4.SEARCH_FIELDS)["variants"][0]["price"] == "100.00"
+
+
+def test_revert_batch_restores_every_price(shopify_backend, make_plugin):
+    backend = shopify_backend(catalog_size=60)
+    plugin = make_plugin()
+    before = {product_id: backend.by_id[product_id]["variants"][0]["price"] for product_id in OFFER_IDS}
+
+    assert plugin.bulk_update_prices("oferta", "percent_increase", 10, filter_field="tag").ok
+    assert plugin.revert_batch().ok
+
+    assert {product_id: backend.by_id[product_id]["variants"][0]["price"] for product_id in OFFER_IDS} == before
+    assert plugin.price_history.last_batch_id() is None
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_math_update_rounds_like_bulk_update(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend()
+    plugin = make_plugin(plugin_class)
+    product_id = 7000000001
+    backend._set_price(backend.by_id[product_id], "10.03")
+
+    # 10.03 * 1.5 = 15.045: en float queda 15.04499... y se redondeaba a 15.04
+    result = _call(plugin, "update_product_price_with_math", str(product_id), "multiply", 1.5)
+
+    assert result.ok, result.message
+    assert backend.by_id[product_id]["variants"][0]["price"] == "15.05"
+    assert "de $10.03 a $15.05" in result.message
+    assert plugin.price_history.latest_change(str(product_id))["new_price"] == "15.05"
+
+
+def test_math_update_rejects_unknown_operation(shopify_backend, make_plugin):
+    shopify_backend()
+    result = make_plugin().update_product_price_with_math("7000000001", "power", 2)
+    assert not result.ok
+    assert "no soportada" in result.message
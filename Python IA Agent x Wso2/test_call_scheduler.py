@@ -0,0 +1,87 @@
+"""Planificador de llamadas a Shopify: los 429 y 5xx se reintentan pidiendo turno, no en el transporte."""
+
+import asyncio
+import time
+
+import pytest
+
+import agent_gpt4
+
+
+def _call(plugin, name, *args):
+    result = getattr(plugin, name)(*args)
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+def _retrying_plugin(make_plugin, plugin_class):
+    """Plugin cuyos transportes SÍ reintentarían: así se comprueba que no lo hacen en las llamadas planificadas."""
+    options = {"transport": agent_gpt4.HttpTransport(max_retries=3, backoff_factor=0.01)}
+    if plugin_class is agent_gpt4.AsyncShopifyPlugin:
+        options["async_transport"] = agent_gpt4.AsyncHttpTransport(max_retries=3, backoff_factor=0.01)
+    return make_plugin(plugin_class, **options)
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_throttled_call_is_paused_and_retried_by_the_scheduler(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend()
+    plugin = _retrying_plugin(make_plugin, plugin_class)
+    scheduler = plugin.call_scheduler
+    backend.faults.append((429, {"Retry-After": "0.3", "X-Shopify-Shop-Api-Call-Limit": "40/40"}))
+
+    started = time.monotonic()
+    result = _call(plugin, "count_products")
+
+    assert result.ok, result.message
+    assert backend.requests["429"] == 1
+    assert backend.requests["count"] == 2          # La llamada original y un único reintento
+    assert scheduler.throttled == 1
+    assert scheduler.calls == 2                    # Cada intento pidió turno
+    assert scheduler.total_wait >= 0.25            # La pausa de Retry-After la aplicó acquire()
+    assert time.monotonic() - started >= 0.25
+    assert scheduler.stats()["level"] >= 1
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_server_errors_are_retried_through_the_scheduler(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend()
+    plugin = _retrying_plugin(make_plugin, plugin_class)
+    backend.faults.extend([(503, {}), (502, {})])
+
+    result = _call(plugin, "count_products")
+
+    assert result.ok, result.message
+    assert backend.requests["count"] == 3
+    assert plugin.call_scheduler.calls == 3        # Ningún reintento se saltó la cola
+    assert plugin.call_scheduler.throttled == 0
+
+
+def test_throttle_retries_are_bounded(shopify_backend, make_plugin):
+    backend = shopify_backend()
+    plugin = _retrying_plugin(make_plugin, agent_gpt4.ShopifyPlugin)
+    backend.faults.extend([(503, {"Retry-After": "0"})] * 10)
+
+    result = plugin.count_products()
+
+    assert not result.ok
+    assert backend.requests["count"] == agent_gpt4.SHOPIFY_THROTTLE_RETRIES + 2
+    assert plugin.call_scheduler.calls == backend.requests["count"]
+
+
+def test_scheduler_paces_calls_under_the_bucket_limit():
+    scheduler = agent_gpt4.ShopifyCallScheduler("pace", limit=4, leak_rate=10, headroom=1)
+    waits = [scheduler._reserve() for _ in range(6)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]            # Capacidad límite - margen
+    assert waits[3] == pytest.approx(0.1, abs=0.01)
+    assert waits[5] == pytest.approx(0.3, abs=0.01)  # Turnos en orden de llegada
+    assert scheduler.stats()["max_waiting"] == 3
+
+
+def test_headers_only_raise_the_estimated_level():
+    scheduler = agent_gpt4.ShopifyCallScheduler("observe", limit=40, leak_rate=2)
+    scheduler.observe({"X-Shopify-Shop-Api-Call-Limit": "30/80"})
+    scheduler.observe({"X-Shopify-Shop-Api-Call-Limit": "5/80"})
+
+    stats = scheduler.stats()
+    assert stats["limit"] == 80
+    assert 29 <= stats["level"] <= 30
@@ -0,0 +1,61 @@
+"""Caché del catálogo: escritura directa tras actualizar precios y llamadas mínimas por actualización."""
+
+import asyncio
+
+import pytest
+
+import agent_gpt4
+
+PRODUCT_ID = 7000000003
+
+
+def _call(plugin, name, *args, **kwargs):
+    result = getattr(plugin, name)(*args, **kwargs)
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+def _listed_price(listing, product_id):
+    return next(product["price"] for product in listing.data["products"] if product["id"] == product_id)
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_update_writes_through_to_cached_listing(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend()
+    plugin = make_plugin(plugin_class)
+    assert _call(plugin, "get_products_list").ok
+    assert backend.requests["products"] == 1
+
+    for price in ("42.50", "43.75"):
+        before = dict(backend.requests)
+        assert _call(plugin, "update_product_price", str(PRODUCT_ID), price).ok
+        # Con el producto en caché basta con leer la variante y escribirla
+        assert {route: count - before.get(route, 0) for route, count in backend.requests.items()
+                if count != before.get(route, 0)} == {"variant": 1, "put_variant": 1}
+
+        listing = _call(plugin, "get_products_list")
+        assert _listed_price(listing, PRODUCT_ID) == price
+    assert backend.requests["products"] == 1  # Los listados salen de la caché, ya actualizada
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_cold_update_reads_the_product_once(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend()
+    plugin = make_plugin(plugin_class)
+    plugin.token_manager.get_token()
+    backend.requests.clear()
+
+    assert _call(plugin, "update_product_price", str(PRODUCT_ID), "42.50").ok
+
+    assert dict(backend.requests) == {"product": 1, "put_variant": 1}
+    assert backend.by_id[PRODUCT_ID]["variants"][0]["price"] == "42.50"
+    assert plugin.catalog_cache.get(PRODUCT_ID, agent_gpt4.PRODUCT_FIELDS)["variants"][0]["price"] == "42.50"
+
+
+def test_disabled_cache_reads_shopify_every_time(shopify_backend, make_plugin):
+    backend = shopify_backend()
+    plugin = make_plugin(catalog_cache=agent_gpt4.CatalogCache(ttl=0))
+
+    assert plugin.get_products_list().ok
+    assert plugin.update_product_price(str(PRODUCT_ID), "42.50").ok
+    assert _listed_price(plugin.get_products_list(), PRODUCT_ID) == "42.50"
+    assert backend.requests["products"] == 2
@@ -0,0 +1,97 @@
+"""Snapshot del catálogo en disco: arranque en caliente con el delta desde la marca de agua."""
+
+import asyncio
+
+import pytest
+
+import agent_gpt4
+import benchmark
+
+PLUGINS = [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin]
+
+
+def _call(plugin, name, *args, **kwargs):
+    result = getattr(plugin, name)(*args, **kwargs)
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+def _sync_snapshot(plugin):
+    if isinstance(plugin, agent_gpt4.AsyncShopifyPlugin):
+        return _call(plugin, "sync_catalog_snapshot_async")
+    return plugin.sync_catalog_snapshot()
+
+
+def _listing(plugin):
+    return {product["id"]: product["price"] for product in _call(plugin, "get_products_list").data["products"]}
+
+
+@pytest.fixture
+def snapshot_session(make_plugin, tmp_path):
+    """Cada llamada es una sesión nueva del agente (caché vacía) sobre el mismo fichero de snapshot."""
+    def open_session(plugin_class):
+        return make_plugin(plugin_class, catalog_snapshot=agent_gpt4.CatalogSnapshot(str(tmp_path / "snapshot.sqlite")))
+    return open_session
+
+
+def _store_with_older_products(shopify_backend):
+    # Solo el primer producto queda en la marca de agua: updated_at_min es inclusivo y Shopify lo devuelve de nuevo
+    backend = shopify_backend()
+    for product in backend.products[1:]:
+        product["updated_at"] = product["variants"][0]["updated_at"] = "2025-12-01T00:00:00Z"
+    return backend
+
+
+@pytest.mark.parametrize("plugin_class", PLUGINS)
+def test_warm_start_fetches_only_the_delta(shopify_backend, snapshot_session, plugin_class):
+    backend = _store_with_older_products(shopify_backend)
+    assert len(_listing(snapshot_session(plugin_class))) == 20
+
+    # Entre sesiones cambia un precio y se da de alta un producto (marcas fijas, no la hora del sistema)
+    changed = backend.by_id[7000000005]
+    changed["variants"][0]["price"] = "77.00"
+    added = benchmark.make_catalog(21)[20]
+    for product in (changed, added):
+        product["updated_at"] = product["variants"][0]["updated_at"] = "2026-06-01T00:00:00Z"
+    backend.products.append(added)
+    backend.by_id[added["id"]] = added
+    backend.variants[added["variants"][0]["id"]] = added
+    backend.requests.clear()
+
+    plugin = snapshot_session(plugin_class)
+    status = _sync_snapshot(plugin)
+
+    assert status == "Snapshot del catálogo sincronizado: 21 productos (3 cambios desde la última sesión)."
+    assert (backend.requests["products"], backend.requests["count"]) == (1, 1)
+    listing = _listing(plugin)
+    assert backend.requests["products"] == 1  # El listado sale del snapshot ya sincronizado
+    assert len(listing) == 21
+    assert listing[7000000005] == "77.00"
+    assert listing[added["id"]] == added["variants"][0]["price"]
+
+    # La sesión siguiente parte de la nueva marca de agua: solo vuelven los dos productos que están en ella
+    next_status = _sync_snapshot(snapshot_session(plugin_class))
+    assert next_status == "Snapshot del catálogo sincronizado: 21 productos (2 cambios desde la última sesión)."
+
+
+@pytest.mark.parametrize("plugin_class", PLUGINS)
+def test_deleted_products_force_a_full_reload(shopify_backend, snapshot_session, plugin_class):
+    backend = _store_with_older_products(shopify_backend)
+    assert len(_listing(snapshot_session(plugin_class))) == 20
+
+    removed = backend.products.pop(3)
+    del backend.by_id[removed["id"]]
+    backend.requests.clear()
+
+    plugin = snapshot_session(plugin_class)
+    status = _sync_snapshot(plugin)
+
+    assert "pero la tienda tiene 19" in status
+    listing = _listing(plugin)
+    assert removed["id"] not in listing and len(listing) == 19
+    assert backend.requests["products"] == 2  # Delta + recorrido completo del primer listado
+
+
+def test_empty_snapshot_is_not_restored(shopify_backend, snapshot_session):
+    backend = shopify_backend()
+    assert snapshot_session(agent_gpt4.ShopifyPlugin).sync_catalog_snapshot() is None
+    assert backend.requests["products"] == 0
@@ -0,0 +1,92 @@
+"""Backend GraphQL: cubo de coste por tienda y reintentos ante THROTTLED."""
+
+import time
+
+from aiohttp import web
+
+import agent_gpt4
+import benchmark
+
+
+class GraphQLBackend(benchmark.FakeBackend):
+    """FakeBackend con /graphql.json: responde productsCount y rechaza las primeras consultas con THROTTLED."""
+
+    QUERY_COST = 40
+
+    def __init__(self, throttled: int = 0, available: float = 30.0, **options):
+        super().__init__(**options)
+        self.throttled = throttled
+        self.available = available
+
+    def build_app(self) -> web.Application:
+        app = super().build_app()
+        app.router.add_post(benchmark.GATEWAY_PREFIX + "/graphql.json", self.graphql)
+        return app
+
+    def _cost(self, actual, available: float) -> dict:
+        return {"cost": {"requestedQueryCost": self.QUERY_COST, "actualQueryCost": actual,
+                         "throttleStatus": {"maximumAvailable": 1000.0, "currentlyAvailable": available, "restoreRate": 50.0}}}
+
+    async def graphql(self, request):
+        await request.json()
+        self.requests["graphql"] += 1
+        if self.throttled:
+            self.throttled -= 1
+            self.requests["THROTTLED"] += 1
+            return web.json_response({"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                                      "extensions": self._cost(None, self.available)})
+        return web.json_response({"data": {"productsCount": {"count": len(self.products)}},
+                                  "extensions": self._cost(2, 998.0)})
+
+
+def _graphql_plugin(make_plugin, scheduler=None):
+    return make_plugin(agent_gpt4.ShopifyGraphQLPlugin,
+                       cost_scheduler=scheduler or agent_gpt4.ShopifyCallScheduler("test:graphql", limit=1000, leak_rate=50, headroom=0))
+
+
+def test_throttled_query_waits_for_enough_points(shopify_backend, make_plugin):
+    backend = shopify_backend(backend_class=GraphQLBackend, throttled=1, available=30.0)
+    plugin = _graphql_plugin(make_plugin)
+
+    started = time.monotonic()
+    result = plugin.count_products()
+
+    assert result.ok, result.message
+    assert result.data["count"] == len(backend.products)
+    assert backend.requests["graphql"] == 2
+    scheduler = plugin.cost_scheduler
+    assert scheduler.throttled == 1
+    assert scheduler.calls == 2
+    # Faltaban 40 - 30 = 10 puntos a 50/s: el reintento espera ~0.2 s en acquire()
+    assert 0.15 <= scheduler.total_wait <= 0.5
+    assert time.monotonic() - started >= 0.15
+    assert plugin._query_costs                        # El coste real se recuerda para la siguiente vez
+
+
+def test_query_cost_tracks_throttle_status(shopify_backend, make_plugin):
+    shopify_backend(backend_class=GraphQLBackend)
+    plugin = _graphql_plugin(make_plugin)
+
+    assert plugin.count_products().ok
+    stats = plugin.cost_scheduler.stats()
+    assert stats["throttled"] == 0
+    assert stats["limit"] == 1000 and stats["leak_rate"] == 50.0
+    assert stats["level"] <= agent_gpt4.GRAPHQL_DEFAULT_QUERY_COST   # Se devuelve lo reservado de más (coste real 2)
+
+
+def test_graphql_throttling_gives_up_after_the_retry_budget(shopify_backend, make_plugin):
+    backend = shopify_backend(backend_class=GraphQLBackend, throttled=100, available=1000.0)
+    plugin = _graphql_plugin(make_plugin)
+
+    result = plugin.count_products()
+
+    assert not result.ok
+    assert "Throttled" in result.message
+    assert backend.requests["graphql"] == agent_gpt4.SHOPIFY_THROTTLE_RETRIES + 1
+
+
+def test_graphql_scheduler_is_shared_per_shop():
+    first = agent_gpt4.get_graphql_scheduler("graphql-test")
+    assert agent_gpt4.get_graphql_scheduler("graphql-test") is first
+    assert first is not agent_gpt4.get_call_scheduler("graphql-test")
+    assert first.limit == agent_gpt4.GRAPHQL_COST_LIMIT
@@ -0,0 +1,92 @@
+"""Historial de precios: deshacer en varios pasos, lotes y persistencia entre sesiones."""
+
+import asyncio
+import time
+
+import pytest
+
+import agent_gpt4
+
+PRODUCT_ID = "7000000004"
+OFFER_IDS = (7000000000, 7000000050)  # Productos con la etiqueta 'oferta' en un catálogo de 60
+
+
+def _call(plugin, name, *args, **kwargs):
+    result = getattr(plugin, name)(*args, **kwargs)
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+def _price(backend, product_id):
+    return backend.by_id[int(product_id)]["variants"][0]["price"]
+
+
+@pytest.mark.parametrize("plugin_class", [agent_gpt4.ShopifyPlugin, agent_gpt4.AsyncShopifyPlugin])
+def test_undo_walks_back_every_change(shopify_backend, make_plugin, plugin_class):
+    backend = shopify_backend()
+    plugin = make_plugin(plugin_class)
+    prices = [_price(backend, PRODUCT_ID), "20.00", "30.00", "40.00"]
+    for price in prices[1:]:
+        assert _call(plugin, "update_product_price", PRODUCT_ID, price).ok
+    assert plugin.price_history.undo_depth(PRODUCT_ID) == 3
+
+    for expected in reversed(prices[:-1]):
+        result = _call(plugin, "revert_price", PRODUCT_ID)
+        assert result.ok, result.message
+        assert _price(backend, PRODUCT_ID) == expected
+    assert plugin.price_history.undo_depth(PRODUCT_ID) == 0
+
+    result = _call(plugin, "revert_price", PRODUCT_ID)
+    assert not result.ok and "No hay historial" in result.message
+    assert _price(backend, PRODUCT_ID) == prices[0]
+
+    # El registro solo crece: cada deshacer es una fila que apunta al cambio que deshace
+    rows = plugin.price_history.changes_since(0)
+    assert [row["new_price"] for row in rows] == ["20.00", "30.00", "40.00", "30.00", "20.00", prices[0]]
+    assert [row["reverts"] for row in rows[3:]] == [rows[2]["id"], rows[1]["id"], rows[0]["id"]]
+
+
+def test_history_survives_a_new_session(shopify_backend, make_plugin, tmp_path):
+    backend = shopify_backend()
+    path = str(tmp_path / "history.sqlite")
+    first = make_plugin(price_history=agent_gpt4.PriceHistory(path))
+    original = _price(backend, PRODUCT_ID)
+    assert first.update_product_price(PRODUCT_ID, "55.00").ok
+    first.price_history.close()
+
+    second = make_plugin(price_history=agent_gpt4.PriceHistory(path))
+    assert second.price_history.get_previous_price(PRODUCT_ID) == original
+    assert second.revert_price(PRODUCT_ID).ok
+    assert _price(backend, PRODUCT_ID) == original
+
+
+def test_batch_revert_skips_products_already_undone(shopify_backend, make_plugin):
+    backend = shopify_backend(catalog_size=60)
+    plugin = make_plugin()
+    before = {product_id: _price(backend, product_id) for product_id in OFFER_IDS}
+    assert plugin.bulk_update_prices("oferta", "add", 5, filter_field="tag").ok
+
+    # Deshacer un producto del lote y cambiarlo a mano: revertir el lote ya no debe tocarlo
+    assert plugin.revert_price(str(OFFER_IDS[0])).ok
+    assert plugin.update_product_price(str(OFFER_IDS[0]), "99.00").ok
+    result = plugin.revert_batch()
+
+    assert result.ok, result.message
+    assert _price(backend, OFFER_IDS[0]) == "99.00"
+    assert _price(backend, OFFER_IDS[1]) == before[OFFER_IDS[1]]
+    assert plugin.price_history.last_batch_id() is None
+
+
+def test_retention_prunes_old_changes(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    history = agent_gpt4.PriceHistory(path, retention_days=0)
+    history.remember_price_change("1", "10.00", "11.00")
+    change_id = history.remember_price_change("2", "20.00", "21.00")
+    with history._conn:
+        history._conn.execute("UPDATE price_changes SET changed_at = ? WHERE id = ?", (time.time() - 3 * 86400, change_id))
+    history.close()
+
+    history = agent_gpt4.PriceHistory(path, retention_days=1)
+    try:
+        assert history.has_history("1") and not history.has_history("2")
+    finally:
+        history.close()
@@ -0,0 +1,69 @@
+"""Índice de búsqueda: mismo resultado que ProductMatcher y mantenimiento incremental."""
+
+import pytest
+
+import agent_gpt4
+import benchmark
+
+NAMED = ["The Complete Snowboard", "The Collection Snowboard: Liquid", "Gift Card", "Selling Plans Ski Wax",
+         "The Multi-location Snowboard", "Snowboard Wax Kit", "Guantes de esquí", "Casco Pro"]
+
+
+def _catalog() -> list:
+    products = benchmark.make_catalog(300)
+    for i, title in enumerate(NAMED):
+        product_id = 9000000000 + i
+        products.append({"id": product_id, "title": title, "body_html": f"<p>{title} para la temporada</p>",
+                         "tags": "invierno, nieve" if i % 2 else "accesorio", "product_type": "Snowboard", "vendor": "Bench",
+                         "variants": [{"id": 9100000000 + i, "product_id": product_id, "price": f"{20 + i}.00"}]})
+    return products
+
+
+def _scan(products: list, query: str) -> dict:
+    matcher = agent_gpt4.ProductMatcher(query)
+    for product in products:
+        if matcher.feed(product):
+            break
+    return matcher.result()
+
+
+@pytest.mark.parametrize("query", [
+    "Producto 17", "producto 299", "gift card", "Gift Crd", "snowbord completo", "The Compleat Snowboard",
+    "ski wax", "wax", "nieve", "temporada", "guantes esqui", "casco", "descripción del producto 42",
+    "snowboard liquid", "xyz", "zq", "Producto",
+    # Con solo los 64 candidatos más parecidos por trigramas estas daban otro resultado (o ninguno)
+    "gift calo producto", "acesorio", "git pr wx", "descripcinde snoword",
+])
+def test_index_matches_full_scan(query):
+    products = _catalog()
+    assert len(products) <= agent_gpt4.ProductSearchIndex.FULL_FUZZY_LIMIT
+    index = agent_gpt4.ProductSearchIndex()
+    index.rebuild(products, generation=1)
+
+    assert index.search(query) == _scan(products, query)
+
+
+def test_new_catalog_download_updates_the_index_in_place(shopify_backend, make_plugin, monkeypatch):
+    backend = shopify_backend(catalog_size=30)
+    plugin = make_plugin()
+    plugin.find_product_by_name("zzz")                      # Recorre y cachea el catálogo completo
+    assert plugin.find_product_by_name("Producto 7")["id"] == "7000000007"  # Construye el índice
+    assert plugin.search_index.generation is not None
+
+    rebuilds = []
+    monkeypatch.setattr(plugin.search_index, "rebuild", lambda *args: rebuilds.append(args))
+
+    # Cambios en Shopify: un alta, una baja y un cambio de precio hecho por el agente (write-through)
+    added = dict(backend.products[0], id=7100000000, title="Tabla Nueva", variants=[
+        {"id": 8100000000, "product_id": 7100000000, "price": "55.00", "updated_at": "2026-01-01T00:00:00Z"}])
+    removed = backend.products.pop(5)
+    backend.products.append(added)
+    backend.by_id[added["id"]] = added
+    assert plugin.update_product_price("7000000007", "77.00").ok
+    list(plugin._iter_products(agent_gpt4.SEARCH_FIELDS, refresh=True))  # Catálogo completo nuevo (generación nueva)
+
+    assert plugin.find_product_by_name("Tabla Nueva")["id"] == "7100000000"
+    assert plugin.find_product_by_name(removed["title"]).get("id") != str(removed["id"])
+    assert plugin.find_product_by_name("Producto 7")["price"] == "77.00"
+    assert plugin.search_index.generation == plugin.catalog_cache.full_catalog_generation(agent_gpt4.SEARCH_FIELDS)
+    assert rebuilds == []
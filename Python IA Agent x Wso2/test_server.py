@@ -0,0 +1,176 @@
+"""Servidor HTTP (AgentServer): sesiones, autenticación y respuestas SSE."""
+
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import agent_gpt4
+
+
+class FakeAgent:
+    """
+    Agente que responde con el mensaje recibido, palabra a palabra y en verde (ANSI) como la consola.
+    Con `gate` espera a que se abra antes de contestar; el mensaje 'falla' simula un error del LLM.
+    """
+
+    def __init__(self, gate: asyncio.Event = None):
+        self.gate = gate
+        self.last_result = None
+        self.messages = []
+
+    async def process_with_guaranteed_execution(self, message, on_chunk=None, shop=None):
+        self.messages.append((message, shop))
+        if self.gate is not None:
+            await self.gate.wait()
+        if message == "falla":
+            self.last_result = None
+            return None
+        if on_chunk:
+            for word in message.split():
+                on_chunk(f"{agent_gpt4.Colors.GREEN}{word}{agent_gpt4.Colors.RESET} ")
+                await asyncio.sleep(0)
+        self.last_result = agent_gpt4.ShopifyResult.success(message, shop=shop)
+        return message
+
+
+async def _read_events(response) -> list:
+    """Eventos SSE de la respuesta como [(evento, datos)]"""
+    events = []
+    for block in (await response.text()).split("\n\n"):
+        if block.strip():
+            lines = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_session_limit_never_evicts_busy_sessions():
+    async def run():
+        gate = asyncio.Event()
+        server = agent_gpt4.AgentServer(lambda: FakeAgent(gate), max_sessions=1)
+        busy_id, busy = server._session()
+        running = asyncio.ensure_future(server._process(busy, "lento"))
+        await asyncio.sleep(0)
+        assert busy.lock.locked()
+
+        # Otra sesión aceptada pero aún en cola (sin el lock tomado) tampoco se expulsa
+        queued_id, queued = server._session()
+        assert not queued.lock.locked()
+        assert set(server.sessions) == {busy_id, queued_id}
+
+        # Una tercera sesión sí ocupa su plaza, pero solo expulsa sesiones ociosas
+        idle_id, idle = server._session()
+        assert set(server.sessions) == {busy_id, queued_id, idle_id}
+        idle.pending -= 1  # Terminada sin llegar a _process
+
+        gate.set()
+        assert (await running)[0] == "lento"
+        assert (await server._process(queued, "en cola"))[0] == "en cola"
+
+        # Con todas ociosas se vuelve al límite expulsando por orden de uso
+        new_id, _ = server._session()
+        assert list(server.sessions) == [new_id]
+        assert server.sessions[new_id].pending == 1
+
+    asyncio.run(run())
+
+
+def test_expired_sessions_are_kept_while_busy():
+    async def run():
+        gate = asyncio.Event()
+        server = agent_gpt4.AgentServer(lambda: FakeAgent(gate), session_ttl=0)
+        busy_id, busy = server._session()
+        running = asyncio.ensure_future(server._process(busy, "lento"))
+        await asyncio.sleep(0)
+
+        other_id, other = server._session()
+        assert busy_id in server.sessions
+        other.pending -= 1
+
+        gate.set()
+        await running
+        server._session()
+        assert busy_id not in server.sessions and other_id not in server.sessions
+
+    asyncio.run(run())
+
+
+def test_api_key_is_required_except_for_health():
+    async def run():
+        server = agent_gpt4.AgentServer(FakeAgent, api_key="secreto")
+        async with TestClient(TestServer(server.build_app())) as client:
+            assert (await client.get("/health")).status == 200
+            for headers in ({}, {"Authorization": "Bearer otro"}, {"Authorization": "Bearer secreto-largo"},
+                            {"Authorization": "Bearer señal"}):
+                response = await client.post("/chat", json={"message": "hola"}, headers=headers)
+                assert response.status == 401
+            response = await client.post("/chat", json={"message": "hola"}, headers={"Authorization": "Bearer secreto"})
+            assert response.status == 200
+            assert (await response.json())["response"] == "hola"
+
+    asyncio.run(run())
+
+
+def test_sse_streams_chunks_then_done():
+    async def run():
+        agents = []
+        server = agent_gpt4.AgentServer(lambda: agents.append(FakeAgent()) or agents[-1])
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.post("/chat", json={"message": "lista los productos", "shop": "eu"},
+                                         headers={"Accept": "text/event-stream"})
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/event-stream")
+            events = await _read_events(response)
+
+            names = [name for name, _ in events]
+            assert names == ["session", "chunk", "chunk", "chunk", "done"]
+            session_id = events[0][1]["session_id"]
+            assert "".join(data["text"] for name, data in events if name == "chunk") == "lista los productos "
+            assert events[-1][1]["result"]["ok"] and events[-1][1]["result"]["data"] == {"shop": "eu"}
+
+            # La misma sesión reutiliza su agente; el JSON normal devuelve el mismo resultado
+            response = await client.post("/chat", json={"message": "cuenta", "session_id": session_id})
+            body = await response.json()
+            assert body["session_id"] == session_id and body["response"] == "cuenta"
+            assert len(agents) == 1 and agents[0].messages == [("lista los productos", "eu"), ("cuenta", None)]
+
+            health = await (await client.get("/health")).json()
+            assert health["sessions"] == 1 and health["requests"] == {"sse": 1, "json": 1}
+            assert not server.sessions[session_id].busy
+
+    asyncio.run(run())
+
+
+def test_sse_reports_failures_as_error_event():
+    async def run():
+        server = agent_gpt4.AgentServer(FakeAgent)
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.post("/chat", json={"message": "falla"}, headers={"Accept": "text/event-stream"})
+            events = await _read_events(response)
+            assert [name for name, _ in events] == ["session", "error"]
+            assert "elapsed_ms" in events[-1][1]
+            assert server.requests["error"] == 1
+
+    asyncio.run(run())
+
+
+def test_sse_client_disconnect_still_releases_the_session():
+    async def run():
+        gate = asyncio.Event()
+        agent = FakeAgent(gate)
+        server = agent_gpt4.AgentServer(lambda: agent)
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.post("/chat", json={"message": "uno dos"}, headers={"Accept": "text/event-stream"})
+            session_id = json.loads((await response.content.readuntil(b"\n\n")).decode().split("data: ", 1)[1])["session_id"]
+            assert server.sessions[session_id].busy
+            response.close()  # El cliente se va antes de la respuesta
+
+            gate.set()
+            for _ in range(100):
+                if not server.sessions[session_id].busy:
+                    break
+                await asyncio.sleep(0.01)
+            assert not server.sessions[session_id].busy
+            assert agent.last_result.ok
+
+    asyncio.run(run())
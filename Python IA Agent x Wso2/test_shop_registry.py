@@ -0,0 +1,61 @@
+"""Multitienda: ShopRegistry.aclose cierra todos los recursos de cada tienda."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+import agent_gpt4
+
+
+class TrackingTransport(agent_gpt4.HttpTransport):
+    """HttpTransport que recuerda si se ha cerrado su pool."""
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def _assert_sqlite_closed(conn):
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_aclose_releases_every_shop(shopify_backend, tmp_path):
+    shopify_backend()
+    token_manager = agent_gpt4.WSO2TokenManager(transport=agent_gpt4.HttpTransport(max_retries=0))
+    plugin_classes = {"eu": agent_gpt4.ShopifyPlugin, "us": agent_gpt4.AsyncShopifyPlugin}
+
+    def make_plugin(shop):
+        # Mismo contexto en el Gateway para ambas: el servidor local sirve una sola tienda
+        options = dict(shop=shop, token_manager=token_manager, transport=TrackingTransport(max_retries=0),
+                       catalog_cache=agent_gpt4.CatalogCache(ttl=3600),
+                       catalog_snapshot=agent_gpt4.CatalogSnapshot(shop.file_path(str(tmp_path / "snapshot.sqlite"))),
+                       price_history=agent_gpt4.PriceHistory(shop.file_path(str(tmp_path / "history.sqlite"))),
+                       call_scheduler=agent_gpt4.ShopifyCallScheduler(shop.name))
+        if plugin_classes[shop.name] is agent_gpt4.AsyncShopifyPlugin:
+            options["async_transport"] = agent_gpt4.AsyncHttpTransport(max_retries=0)
+        return plugin_classes[shop.name](**options)
+
+    shops = [agent_gpt4.ShopConfig(name, access_token="test") for name in plugin_classes]
+    registry = agent_gpt4.ShopRegistry(shops, make_plugin, default="eu")
+
+    async def run():
+        plugins = registry.plugins()
+        # Una llamada por tienda para que ambos pools tengan conexiones abiertas
+        assert plugins["eu"].find_product_by_name("zzz") is not None
+        assert await plugins["us"].find_product_by_name("zzz") is not None
+        assert plugins["us"].async_transport._session is not None
+        await registry.aclose()
+        return plugins
+
+    plugins = asyncio.run(run())
+
+    for plugin in plugins.values():
+        assert plugin.transport.closed
+        _assert_sqlite_closed(plugin.catalog_snapshot._conn)
+        _assert_sqlite_closed(plugin.price_history._conn)
+    assert plugins["us"].async_transport._session.closed
+    token_manager.transport.close()
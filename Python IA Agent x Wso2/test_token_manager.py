@@ -0,0 +1,76 @@
+"""Token de WSO2: single-flight, refresco anticipado y renovación tras un 401."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import agent_gpt4
+
+
+@pytest.fixture
+def token_manager():
+    manager = agent_gpt4.WSO2TokenManager(transport=agent_gpt4.HttpTransport(max_retries=0))
+    yield manager
+    manager.transport.close()
+
+
+def test_concurrent_threads_share_one_token_request(shopify_backend, token_manager):
+    backend = shopify_backend(token_latency=0.2)
+    barrier = threading.Barrier(16)
+    tokens = []
+
+    def worker():
+        barrier.wait()
+        tokens.append(token_manager.get_token())
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.requests["token"] == 1
+    assert len(tokens) == 16 and len(set(tokens)) == 1 and tokens[0]
+
+
+def test_concurrent_tasks_share_one_token_request(shopify_backend, token_manager):
+    backend = shopify_backend(token_latency=0.2)
+
+    async def run():
+        return await asyncio.gather(*(token_manager.get_token_async() for _ in range(16)))
+
+    tokens = asyncio.run(run())
+    assert backend.requests["token"] == 1
+    assert len(set(tokens)) == 1 and tokens[0]
+
+
+def test_refresh_ahead_renews_once_in_background(shopify_backend, token_manager):
+    backend = shopify_backend(token_latency=0.2)
+    first = token_manager.get_token()
+    token_manager._refresh_at = 0.0  # Simula la entrada en la ventana de refresco
+
+    # Mientras se renueva, los llamantes siguen recibiendo el token vigente sin esperar
+    started = time.perf_counter()
+    assert [token_manager.get_token() for _ in range(10)] == [first] * 10
+    assert time.perf_counter() - started < 0.1
+
+    deadline = time.monotonic() + 5
+    while token_manager.get_token() == first and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert token_manager.get_token() != first
+    assert backend.requests["token"] == 2
+
+
+def test_gateway_401_renews_the_token_once(shopify_backend, make_plugin):
+    backend = shopify_backend()
+    plugin = make_plugin()
+    token = plugin.token_manager.get_token()
+    backend.faults.append((401, {}))
+
+    result = plugin.count_products()
+
+    assert result.ok, result.message
+    assert backend.requests["token"] == 2
+    assert plugin.token_manager.get_token() != token